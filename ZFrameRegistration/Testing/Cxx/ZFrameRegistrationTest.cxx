@@ -9,7 +9,14 @@
 #include "itkTestMain.h"
 
 // STD includes
+#include <algorithm>
+#include <cmath>
+#include <cstdlib>
+#include <fstream>
 #include <iostream>
+#include <sstream>
+#include <string>
+#include <vector>
 
 #ifdef WIN32
 # define MODULE_IMPORT __declspec(dllimport)
@@ -19,7 +26,113 @@
 
 extern "C" MODULE_IMPORT int ModuleEntryPoint(int, char* []);
 
+// Read the parameters of an ITK transform file (the numbers of its "Parameters:" and "FixedParameters:" lines)
+bool ReadTransformParameters(const char* fileName, std::vector<double>& parameters)
+{
+  std::ifstream file(fileName);
+  std::string line;
+  while (std::getline(file, line))
+    {
+    if (line.compare(0, 11, "Parameters:") != 0 && line.compare(0, 16, "FixedParameters:") != 0)
+      {
+      continue;
+      }
+    std::stringstream stream(line.substr(line.find(':') + 1));
+    double value;
+    while (stream >> value)
+      {
+      parameters.push_back(value);
+      }
+    }
+  return !parameters.empty();
+}
+
+// Compare the parameters of two ITK transform files:
+// CompareTransforms baseline.txt test.txt [tolerance]
+// The tolerance is the largest absolute difference allowed; 0 (default) requires identical transforms.
+int CompareTransforms(int argc, char* argv[])
+{
+  if (argc < 3)
+    {
+    std::cerr << "Usage: CompareTransforms baseline.txt test.txt [tolerance]" << std::endl;
+    return EXIT_FAILURE;
+    }
+  double tolerance = argc > 3 ? atof(argv[3]) : 0.0;
+  std::vector<double> baseline;
+  std::vector<double> test;
+  if (!ReadTransformParameters(argv[1], baseline) || !ReadTransformParameters(argv[2], test))
+    {
+    std::cerr << "Cannot read the transforms " << argv[1] << " and " << argv[2] << std::endl;
+    return EXIT_FAILURE;
+    }
+  if (baseline.size() != test.size())
+    {
+    std::cerr << "The transforms have different numbers of parameters" << std::endl;
+    return EXIT_FAILURE;
+    }
+  double largest = 0.0;
+  for (size_t i = 0; i < baseline.size(); i ++)
+    {
+    largest = std::max(largest, std::fabs(baseline[i] - test[i]));
+    }
+  std::cout << "Largest parameter difference: " << largest << std::endl;
+  if (largest > tolerance)
+    {
+    std::cerr << "The transforms differ by more than " << tolerance << std::endl;
+    return EXIT_FAILURE;
+    }
+  return EXIT_SUCCESS;
+}
+
+// Check the success column of a batch summary.csv, one expected value (0 or 1) per case:
+// CheckBatchSummary summary.csv success1 [success2 ...]
+int CheckBatchSummary(int argc, char* argv[])
+{
+  if (argc < 3)
+    {
+    std::cerr << "Usage: CheckBatchSummary summary.csv success1 [success2 ...]" << std::endl;
+    return EXIT_FAILURE;
+    }
+  std::ifstream summary(argv[1]);
+  std::string line;
+  if (!std::getline(summary, line))
+    {
+    std::cerr << "Cannot read " << argv[1] << std::endl;
+    return EXIT_FAILURE;
+    }
+
+  int cases = 0;
+  while (std::getline(summary, line))
+    {
+    if (line.empty())
+      {
+      continue;
+      }
+    std::vector<std::string> fields;
+    std::stringstream stream(line);
+    std::string field;
+    while (std::getline(stream, field, ','))
+      {
+      fields.push_back(field);
+      }
+    cases ++;
+    if (cases >= argc - 1 || fields.size() < 5 || fields[4] != argv[cases + 1])
+      {
+      std::cerr << "Unexpected case " << cases << ": " << line << std::endl;
+      return EXIT_FAILURE;
+      }
+    }
+  if (cases != argc - 2)
+    {
+    std::cerr << "Expected " << argc - 2 << " cases, found " << cases << std::endl;
+    return EXIT_FAILURE;
+    }
+  return EXIT_SUCCESS;
+}
+
 void RegisterTests()
 {
   StringToTestFunctionMap["ModuleEntryPoint"] = ModuleEntryPoint;
+  StringToTestFunctionMap["CheckBatchSummary"] = CheckBatchSummary;
+  StringToTestFunctionMap["CompareTransforms"] = CompareTransforms;
 }
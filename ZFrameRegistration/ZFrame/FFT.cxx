@@ -0,0 +1,281 @@
+/*==========================================================================
+
+  Portions (c) Copyright 2008 Brigham and Women's Hospital (BWH) All Rights Reserved.
+
+  See Doc/copyright/copyright.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   ZFrame Registration
+  Module:    FFT.cxx
+
+==========================================================================*/
+
+#include <algorithm>
+#include <cmath>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <stdexcept>
+
+#include "FFT.h"
+
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+namespace zf {
+
+//----------------------------------------------------------------------------
+FFTPlan::FFTPlan(int n)
+  : n(n), reversal(n), cosines(n/2), sines(n/2)
+{
+  int bits = 0;
+  while ((1 << bits) < n)
+    {
+    bits ++;
+    }
+  for (int i = 0; i < n; i ++)
+    {
+    int r = 0;
+    for (int b = 0; b < bits; b ++)
+      {
+      r |= ((i >> b) & 1) << (bits - 1 - b);
+      }
+    this->reversal[i] = r;
+    }
+
+  // exp(-2 pi i k / n)
+  for (int k = 0; k < n/2; k ++)
+    {
+    double angle = -2.0 * M_PI * k / n;
+    this->cosines[k] = cos(angle);
+    this->sines[k] = sin(angle);
+    }
+}
+
+
+bool FFTPlan::Supports(int n)
+{
+  return n >= 1 && (n & (n - 1)) == 0;
+}
+
+
+const FFTPlan& FFTPlan::Get(int n)
+{
+  // Plans are created once per size and kept for the lifetime of the process.
+  static std::mutex mutex;
+  static std::map<int, std::unique_ptr<FFTPlan> > plans;
+
+  std::lock_guard<std::mutex> lock(mutex);
+  std::unique_ptr<FFTPlan>& plan = plans[n];
+  if (!plan)
+    {
+    plan.reset(new FFTPlan(n));
+    }
+  return *plan;
+}
+
+
+void FFTPlan::Transform(std::complex<double>* data, bool inverse) const
+{
+  for (int i = 0; i < this->n; i ++)
+    {
+    if (i < this->reversal[i])
+      {
+      std::swap(data[i], data[this->reversal[i]]);
+      }
+    }
+
+  // Iterative radix-2 decimation in time. The products are written out to
+  // avoid the NaN checks of std::complex multiplication.
+  double sign = inverse ? -1.0 : 1.0;
+  for (int half = 1; half < this->n; half *= 2)
+    {
+    int step = this->n / (2 * half);
+    for (int start = 0; start < this->n; start += 2 * half)
+      {
+      for (int k = 0; k < half; k ++)
+        {
+        double wr = this->cosines[k * step];
+        double wi = sign * this->sines[k * step];
+        std::complex<double>& a = data[start + k];
+        std::complex<double>& b = data[start + k + half];
+        double tr = wr * b.real() - wi * b.imag();
+        double ti = wr * b.imag() + wi * b.real();
+        b = std::complex<double>(a.real() - tr, a.imag() - ti);
+        a = std::complex<double>(a.real() + tr, a.imag() + ti);
+        }
+      }
+    }
+}
+
+
+//----------------------------------------------------------------------------
+RealCorrelator::RealCorrelator()
+  : xsize(0), ysize(0), hsize(0)
+{
+}
+
+
+bool RealCorrelator::Supports(int xsize, int ysize)
+{
+  return xsize >= 2 && ysize >= 4 && FFTPlan::Supports(xsize) && FFTPlan::Supports(ysize);
+}
+
+
+void RealCorrelator::Init(const Matrix& kernel)
+{
+  this->xsize = kernel.nrows();
+  this->ysize = kernel.ncols();
+  this->hsize = this->ysize / 2 + 1;
+
+  // exp(-2 pi i k / ysize), used to split the half-length row transforms
+  this->rcosines.resize(this->hsize);
+  this->rsines.resize(this->hsize);
+  for (int k = 0; k < this->hsize; k ++)
+    {
+    double angle = -2.0 * M_PI * k / this->ysize;
+    this->rcosines[k] = cos(angle);
+    this->rsines[k] = sin(angle);
+    }
+
+  this->spectrum.resize(this->xsize * this->hsize);
+  this->buffer.resize(std::max(this->xsize, this->ysize / 2));
+
+  ForwardRows(kernel);
+  TransformColumns(false);
+
+  // Conjugate the kernel spectrum for the correlation, multiply it by
+  // (-1)^(i+k) to shift the result by half the image size in both directions
+  // (FFTSHIFT), and include the normalization of the inverse transform.
+  this->kernelSpectrum.resize(this->spectrum.size());
+  double scale = 1.0 / ((double) this->xsize * (this->ysize / 2));
+  for (int i = 0; i < this->xsize; i ++)
+    {
+    for (int k = 0; k < this->hsize; k ++)
+      {
+      double shift = ((i + k) % 2) ? -scale : scale;
+      this->kernelSpectrum[i*this->hsize + k] = std::conj(this->spectrum[i*this->hsize + k]) * shift;
+      }
+    }
+}
+
+
+void RealCorrelator::Correlate(const Matrix& image, Matrix& result)
+{
+  if (image.nrows() != this->xsize || image.ncols() != this->ysize)
+    {
+    throw std::invalid_argument("RealCorrelator::Correlate - the image and the kernel sizes differ");
+    }
+
+  ForwardRows(image);
+  TransformColumns(false);
+
+  for (size_t i = 0; i < this->spectrum.size(); i ++)
+    {
+    const std::complex<double>& s = this->spectrum[i];
+    const std::complex<double>& m = this->kernelSpectrum[i];
+    this->spectrum[i] = std::complex<double>(s.real() * m.real() - s.imag() * m.imag(),
+                                             s.real() * m.imag() + s.imag() * m.real());
+    }
+
+  TransformColumns(true);
+  result.ReSize(this->xsize, this->ysize);
+  InverseRows(result);
+}
+
+
+void RealCorrelator::ForwardRows(const Matrix& image)
+{
+  // Each real row of length ysize is transformed as a complex sequence of
+  // length ysize/2 (even samples in the real part, odd samples in the
+  // imaginary part), which is then split into the ysize/2+1 Fourier
+  // coefficients of the real row.
+  int m = this->ysize / 2;
+  const FFTPlan& plan = FFTPlan::Get(m);
+  std::complex<double>* z = &this->buffer[0];
+  const Real* pixels = image.const_data();
+
+  for (int i = 0; i < this->xsize; i ++)
+    {
+    const Real* row = pixels + i * this->ysize;
+    for (int k = 0; k < m; k ++)
+      {
+      z[k] = std::complex<double>(row[2*k], row[2*k+1]);
+      }
+    plan.Transform(z, false);
+
+    std::complex<double>* out = &this->spectrum[i * this->hsize];
+    for (int k = 0; k <= m; k ++)
+      {
+      std::complex<double> a = z[k % m];
+      std::complex<double> b = std::conj(z[(m - k) % m]);
+      // Transforms of the even and odd samples
+      std::complex<double> even = 0.5 * (a + b);
+      std::complex<double> odd = std::complex<double>(0.5 * (a.imag() - b.imag()), -0.5 * (a.real() - b.real()));
+      double wr = this->rcosines[k];
+      double wi = this->rsines[k];
+      out[k] = std::complex<double>(even.real() + wr * odd.real() - wi * odd.imag(),
+                                    even.imag() + wr * odd.imag() + wi * odd.real());
+      }
+    }
+}
+
+
+void RealCorrelator::TransformColumns(bool inverse)
+{
+  const FFTPlan& plan = FFTPlan::Get(this->xsize);
+  std::complex<double>* column = &this->buffer[0];
+
+  for (int k = 0; k < this->hsize; k ++)
+    {
+    for (int i = 0; i < this->xsize; i ++)
+      {
+      column[i] = this->spectrum[i * this->hsize + k];
+      }
+    plan.Transform(column, inverse);
+    for (int i = 0; i < this->xsize; i ++)
+      {
+      this->spectrum[i * this->hsize + k] = column[i];
+      }
+    }
+}
+
+
+void RealCorrelator::InverseRows(Matrix& result)
+{
+  // Inverse of ForwardRows: the ysize/2+1 coefficients of each row are
+  // combined into a complex sequence of length ysize/2 whose inverse
+  // transform holds the even and odd samples of the real row.
+  int m = this->ysize / 2;
+  const FFTPlan& plan = FFTPlan::Get(m);
+  std::complex<double>* z = &this->buffer[0];
+  Real* pixels = result.data();
+
+  for (int i = 0; i < this->xsize; i ++)
+    {
+    const std::complex<double>* in = &this->spectrum[i * this->hsize];
+    for (int k = 0; k < m; k ++)
+      {
+      std::complex<double> a = in[k];
+      std::complex<double> b = std::conj(in[m - k]);
+      std::complex<double> even = 0.5 * (a + b);
+      std::complex<double> d = 0.5 * (a - b);
+      // odd = d * conj(w)
+      double wr = this->rcosines[k];
+      double wi = this->rsines[k];
+      std::complex<double> odd(d.real() * wr + d.imag() * wi, d.imag() * wr - d.real() * wi);
+      z[k] = std::complex<double>(even.real() - odd.imag(), even.imag() + odd.real());
+      }
+    plan.Transform(z, true);
+
+    Real* row = pixels + i * this->ysize;
+    for (int k = 0; k < m; k ++)
+      {
+      row[2*k] = z[k].real();
+      row[2*k+1] = z[k].imag();
+      }
+    }
+}
+
+}
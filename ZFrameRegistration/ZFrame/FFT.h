@@ -0,0 +1,96 @@
+/*==========================================================================
+
+  Portions (c) Copyright 2008 Brigham and Women's Hospital (BWH) All Rights Reserved.
+
+  See Doc/copyright/copyright.txt
+  or http://www.slicer.org/copyright/copyright.txt for details.
+
+  Program:   ZFrame Registration
+  Module:    FFT.h
+
+==========================================================================*/
+
+#ifndef __FFT_h
+#define __FFT_h
+
+#include <complex>
+#include <vector>
+
+#include "newmat.h"
+
+
+namespace zf {
+
+  // FFT used to correlate the images with the fiducial kernel.
+  enum FFTBackend
+  {
+    // Real-to-complex transforms of zf::RealCorrelator (power-of-two image sizes)
+    FFT_REAL = 0,
+    // Complex transforms of newmat (FFT2/FFT2I), for any image size
+    FFT_NEWMAT = 1
+  };
+
+  // Twiddle factors and bit-reversal permutation of a power-of-two complex FFT.
+  // Plans are immutable, and the plans returned by Get() are shared by all
+  // threads.
+  // The detection slices are power-of-two images (256 x 256 for the Z-frame
+  // scans), and newmat already handles the other sizes, so a mixed-radix
+  // library such as pocketfft would only replace this radix-2 transform by a
+  // second vendored dependency.
+  class FFTPlan
+  {
+  public:
+    explicit FFTPlan(int n);
+
+    static bool Supports(int n);
+    static const FFTPlan& Get(int n);
+
+    int Size() const { return this->n; }
+
+    // In-place transform of n contiguous values. The inverse transform is
+    // not normalized.
+    void Transform(std::complex<double>* data, bool inverse) const;
+
+  protected:
+    int n;
+    std::vector<int> reversal;
+    std::vector<double> cosines;
+    std::vector<double> sines;
+  };
+
+  // Circular cross-correlation of real images with a real kernel through
+  // real-to-complex FFTs. The spectrum of the kernel is computed once by
+  // Init(), with the FFTSHIFT of the result folded in, so Correlate() gives
+  // the same image as FFT2, the product with the conjugate kernel spectrum,
+  // FFT2I and the quadrant swap of Registration::LocateFiducials.
+  class RealCorrelator
+  {
+  public:
+    RealCorrelator();
+
+    static bool Supports(int xsize, int ysize);
+
+    bool IsInitialized() const { return this->xsize > 0; }
+
+    // kernel: xsize x ysize image with the kernel centred at (xsize/2, ysize/2)
+    void Init(const Matrix& kernel);
+    void Correlate(const Matrix& image, Matrix& result);
+
+  protected:
+    void ForwardRows(const Matrix& image);
+    void TransformColumns(bool inverse);
+    void InverseRows(Matrix& result);
+
+    int xsize;
+    int ysize;
+    int hsize;   // ysize/2 + 1 stored columns of the Hermitian spectrum
+    std::vector<double> rcosines;
+    std::vector<double> rsines;
+    std::vector<std::complex<double> > spectrum;
+    std::vector<std::complex<double> > kernelSpectrum;
+    std::vector<std::complex<double> > buffer;
+  };
+
+}
+
+#endif // __FFT_h
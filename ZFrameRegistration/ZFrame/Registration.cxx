@@ -16,6 +16,11 @@
 #include <sstream>
 #include <fstream>
 #include <algorithm>
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <thread>
+#include <vector>
 
 #include "Registration.h"
 
@@ -173,6 +178,8 @@ Registration::Registration()
     {
     this->InputImageDim[i] = 0;
     }
+  this->NumberOfThreads = 0;
+  this->FFTBackend = zf::FFT_REAL;
 }
 
 
@@ -226,6 +233,22 @@ int Registration::SetOrientationBase(float orientation[4])
 }
 
 
+int Registration::SetNumberOfThreads(int numberOfThreads)
+{
+  // 0 uses one thread per core
+  this->NumberOfThreads = numberOfThreads;
+  return 1;
+}
+
+
+int Registration::SetFFTBackend(int backend)
+{
+  // zf::FFT_REAL falls back to newmat for image sizes that are not powers of two
+  this->FFTBackend = backend;
+  return 1;
+}
+
+
 int Registration::Register(int range[2], float Zposition[3], float Zorientation[4])
 {
 
@@ -285,9 +308,6 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
     for (int j = 0; j < 4; j ++)
       T.element(i, j) = 0.0;
 
-  float position[3];
-  float quaternion[4];
-
   zf_9fid::Matrix4x4 matrix;
   matrix[0][0] = ntx;
   matrix[1][0] = nty;
@@ -299,79 +319,149 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
   matrix[1][2] = nny;
   matrix[2][2] = nnz;
 
-  for (int slindex = range[0]; slindex < range[1]; slindex ++)
+  // Orientation of the imaging plane; it is the same for all slices.
+  float imageQuaternion[4];
+  zf::MatrixToQuaternion(matrix, imageQuaternion);
+
+  float spacing[3];
+  spacing[0] = psi;
+  spacing[1] = psj;
+  spacing[2] = psk;
+
+  if (range[0] < 0 || range[1] > zsize)
     {
-    
+    return 0;
+    }
+
+  // The slices are registered concurrently. Each thread has its own workspace,
+  // kept from one call to the next, and takes the next slice until all slices
+  // are done. The results are kept
+  // per slice and accumulated in slice order below, so that the average pose
+  // does not depend on the number of threads.
+  int nslices = std::max(range[1] - range[0], 0);
+  std::vector<zf::SliceResult> results(nslices);
+  std::atomic<int> nextSlice(0);
+  std::exception_ptr error;
+  std::mutex errorMutex;
+
+  auto registerSlices = [&](zf::Workspace& workspace)
+    {
+    try
+      {
+      // The mask spectrum only depends on the image size and the FFT backend
+      if (workspace.xsize != xsize || workspace.ysize != ysize || workspace.backend != this->FFTBackend)
+        {
+        Init(workspace, xsize, ysize);
+        workspace.xsize = xsize;
+        workspace.ysize = ysize;
+        workspace.backend = this->FFTBackend;
+        }
+
+      for (int s = nextSlice ++; s < nslices; s = nextSlice ++)
+        {
+        int slindex = range[0] + s;
+
 #ifdef DEBUG_ZFRAME_REGISTRATION
-    std::cerr << "=== Current Slice Index: " << slindex << "===" << std::endl;
+        std::cerr << "=== Current Slice Index: " << slindex << "===" << std::endl;
 #endif
-        
-    // Shift the center
-    // NOTE: The center of the image should be shifted due to different
-    // definitions of image origin between VTK (Slicer) and OpenIGTLink;
-    // OpenIGTLink image has its origin at the center, while VTK image
-    // has one at the corner.
 
-    float hfovi = psi * (this->InputImageDim[0]-1) / 2.0;
-    float hfovj = psj * (this->InputImageDim[1]-1) / 2.0;
-    //float hfovk = psk * (this->InputImageDim[2]-1) / 2.0;
+        // Shift the center
+        // NOTE: The center of the image should be shifted due to different
+        // definitions of image origin between VTK (Slicer) and OpenIGTLink;
+        // OpenIGTLink image has its origin at the center, while VTK image
+        // has one at the corner.
 
-    // For slice (k) direction, we calculate slice offset based on
-    // the slice index.
-    float offsetk = psk * slindex;
+        float hfovi = psi * (this->InputImageDim[0]-1) / 2.0;
+        float hfovj = psj * (this->InputImageDim[1]-1) / 2.0;
+        //float hfovk = psk * (this->InputImageDim[2]-1) / 2.0;
 
-    float cx = ntx * hfovi + nsx * hfovj + nnx * offsetk;
-    float cy = nty * hfovi + nsy * hfovj + nny * offsetk;
-    float cz = ntz * hfovi + nsz * hfovj + nnz * offsetk;
+        // For slice (k) direction, we calculate slice offset based on
+        // the slice index.
+        float offsetk = psk * slindex;
 
-    // position and quaternion will be overwritten by ZFrameRegistrationQuaternion()
-    zf::MatrixToQuaternion(matrix, quaternion);
+        float cx = ntx * hfovi + nsx * hfovj + nnx * offsetk;
+        float cy = nty * hfovi + nsy * hfovj + nny * offsetk;
+        float cz = ntz * hfovi + nsz * hfovj + nnz * offsetk;
 
-    position[0] = px + cx;
-    position[1] = py + cy;
-    position[2] = pz + cz;
+        // position and quaternion will be overwritten by ZFrameRegistrationQuaternion()
+        float* position = results[s].position;
+        float* quaternion = results[s].quaternion;
+        memcpy(quaternion, imageQuaternion, sizeof(float)*4);
 
-#ifdef DEBUG_ZFRAME_REGISTRATION
-    std::cerr << "=== Image position ===" << std::endl;
-    std::cerr << "x = " << position[0] << std::endl;
-    std::cerr << "y = " << position[1] << std::endl;
-    std::cerr << "z = " << position[2] << std::endl;
-#endif // DEBUG_ZFRAME_REGISTRATION
+        position[0] = px + cx;
+        position[1] = py + cy;
+        position[2] = pz + cz;
 
-    short * currentSlice;
-    if (slindex >= 0 && slindex < zsize)
-      {
-      currentSlice = &(this->InputImage[xsize*ysize*slindex]);
+        short * currentSlice = &(this->InputImage[xsize*ysize*slindex]);
+
+        // Transfer image to a Matrix.
+        workspace.SourceImage.ReSize(xsize,ysize);
+
+        for(int i=0; i<xsize; i++)
+          for(int j=0; j<ysize; j++)
+            workspace.SourceImage.element(i,j) = currentSlice[j*xsize+i];
+
+        results[s].success = RegisterQuaternion(position, quaternion, this->ZOrientationBase,
+                                                workspace, this->InputImageDim, spacing);
+        }
       }
-    else
+    catch (...)
       {
-      return 0;
+      std::lock_guard<std::mutex> lock(errorMutex);
+      if (!error)
+        {
+        error = std::current_exception();
+        }
+      // Let the other threads run out of slices
+      nextSlice = nslices;
       }
+    };
 
-    // Transfer image to a Matrix.
-    SourceImage.ReSize(xsize,ysize);
+  int nthreads = this->NumberOfThreads;
+  if (nthreads <= 0)
+    {
+    nthreads = (int) std::thread::hardware_concurrency();
+    }
+  nthreads = std::max(1, std::min(nthreads, nslices));
 
-    for(int i=0; i<xsize; i++)
-      for(int j=0; j<ysize; j++)
-        SourceImage.element(i,j) = currentSlice[j*xsize+i];
+#ifdef DEBUG_ZFRAME_REGISTRATION
+  std::cerr << "=== Number of threads: " << nthreads << "===" << std::endl;
+#endif
 
-    // if Z-frame position is determined from the slice
-    float spacing[3];
-    spacing[0] = psi;
-    spacing[1] = psj;
-    spacing[2] = psk;
+  while ((int) this->Workspaces.size() < nthreads)
+    {
+    this->Workspaces.push_back(std::unique_ptr<zf::Workspace>(new zf::Workspace()));
+    }
 
-    Init(xsize, ysize);
+  // The calling thread registers slices too.
+  std::vector<std::thread> threads;
+  for (int t = 1; t < nthreads; t ++)
+    {
+    threads.push_back(std::thread(registerSlices, std::ref(*this->Workspaces[t])));
+    }
+  registerSlices(*this->Workspaces[0]);
+  for (size_t t = 0; t < threads.size(); t ++)
+    {
+    threads[t].join();
+    }
+  if (error)
+    {
+    std::rethrow_exception(error);
+    }
 
-    if (RegisterQuaternion(position, quaternion, this->ZOrientationBase,
-                           SourceImage, this->InputImageDim, spacing))
+  for (int s = 0; s < nslices; s ++)
+    {
+    if (results[s].success)
       {
+      float* position = results[s].position;
+      float* quaternion = results[s].quaternion;
+
       P[0] += position[0];
       P[1] += position[1];
       P[2] += position[2];
 
 #ifdef DEBUG_ZFRAME_REGISTRATION
-      std::cerr << "position = ("
+      std::cerr << "slice " << range[0] + s << ": position = ("
                 << position[0] << ", "
                 << position[1] << ", "
                 << position[2] << ")" << std::endl;
@@ -392,7 +482,7 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
       n ++;
 
 #ifdef DEBUG_ZFRAME_REGISTRATION
-      std::cerr << "quaternion = ("
+      std::cerr << "slice " << range[0] + s << ": quaternion = ("
                 << quaternion[0] << ", "
                 << quaternion[1] << ", "
                 << quaternion[2] << ", "
@@ -497,7 +587,7 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
 }
 
 
-void Registration::Init(int xsize, int ysize)
+void Registration::Init(zf::Workspace& workspace, int xsize, int ysize)
 {
   int i,j,m,n;
 
@@ -539,38 +629,47 @@ void Registration::Init(int xsize, int ysize)
   // Create a mask image and initialize elements to zero.
   // The Matrix class is implemented in the newmat library:
   // see: http://www.robertnz.net/
-  MaskImage.ReSize(xsize,ysize);
+  workspace.MaskImage.ReSize(xsize,ysize);
   for(i=0; i<xsize; i++)
     for(j=0; j<ysize; j++)
-        MaskImage.element(i,j) = 0; 
+        workspace.MaskImage.element(i,j) = 0; 
 
   // Copy the correlation kernel to the centre of the mask image.
   for(i=((xsize/2)-5),m=0; i<=((xsize/2)+5); i++,m++)
     for(j=((ysize/2)-5),n=0; j<=((ysize/2)+5); j++,n++)
     {
-        MaskImage.element(i,j) = kernel[m][n];
+        workspace.MaskImage.element(i,j) = kernel[m][n];
     }
 
   // Correlation will be computed using spatial convolution, and hence
   // multiplication in the frequency domain. This dramatically accelerates
   // fiducial detection. Transform mask to frequency domain; this only
   // has to be done once.
+  if (this->FFTBackend == zf::FFT_REAL && zf::RealCorrelator::Supports(xsize, ysize))
+    {
+    // Real-to-complex transforms with cached plans (see FFT.h); the newmat
+    // matrices below are not needed.
+    workspace.correlator.Init(workspace.MaskImage);
+    return;
+    }
+  workspace.correlator = zf::RealCorrelator();
+
   // Before transforming the mask to the spatial frequency domain, need to
   // create an empty imaginary component, since the mask is real-valued.
-  zeroimag.ReSize(xsize,ysize);
+  workspace.zeroimag.ReSize(xsize,ysize);
   for(i=0; i<xsize; i++)
     for(j=0; j<ysize; j++)
-        zeroimag.element(i,j) = 0;
+        workspace.zeroimag.element(i,j) = 0;
 
   // The Radix-2 FFT algorithm is implemented in the newmat library:
   // see: http://www.robertnz.net/
-  FFT2(MaskImage, zeroimag, MFreal, MFimag);
+  FFT2(workspace.MaskImage, workspace.zeroimag, workspace.MFreal, workspace.MFimag);
 
   // Conjugate and normalize the mask.
-  MFimag *= -1;
-  Real maxabsolute = ComplexMax(MFreal, MFimag);
-  MFreal *= (1/maxabsolute);
-  MFimag *= (1/maxabsolute);
+  workspace.MFimag *= -1;
+  Real maxabsolute = ComplexMax(workspace.MFreal, workspace.MFimag);
+  workspace.MFreal *= (1/maxabsolute);
+  workspace.MFimag *= (1/maxabsolute);
 
   // MFreal and MFimag now contain the real and imaginary matrix elements for
   // the frequency domain representation of the correlation mask.
@@ -580,14 +679,14 @@ void Registration::Init(int xsize, int ysize)
 
 int Registration::RegisterQuaternion(float position[3], float quaternion[4],
                                                     float ZquaternionBase[4],
-                                                    Matrix& SourceImage, int dimension[3], float spacing[3])
+                                                    zf::Workspace& workspace, int dimension[3], float spacing[3])
 {
 
   Column3Vector Zposition;
   Quaternion    Zorientation;
   Quaternion    ZorientationBase;
-  static Column3Vector Iposition;
-  static Quaternion Iorientation;
+  Column3Vector Iposition;
+  Quaternion    Iorientation;
   int           Zcoordinates[9][2];
   float         tZcoordinates[9][2];
   bool          frame_lock;
@@ -609,7 +708,7 @@ int Registration::RegisterQuaternion(float position[3], float quaternion[4],
 
   // Find the 9 Z-frame fiducial intercept artifacts in the image.
   std::cerr << "ZTrackerTransform - Searching fiducials...\n" << std::endl;
-  if(LocateFiducials(SourceImage, dimension[0], dimension[1], Zcoordinates, tZcoordinates) == false)
+  if(LocateFiducials(workspace, dimension[0], dimension[1], Zcoordinates, tZcoordinates) == false)
   {
   std::cerr << "ZTrackerTransform::onEventGenerated - Ficudials not detected. No frame lock on this image.\n" << std::endl;
   frame_lock = false;
@@ -703,13 +802,13 @@ int Registration::RegisterQuaternion(float position[3], float quaternion[4],
  * The Z-frame contains nine line fiducials arranged in such a manner that
  * its position and orientation in the MRI scanner can be determined from a
  * single image. This method detects the nine line fiducial intercepts.
- * @param SourceImage An image matrix containing the latest image.
+ * @param workspace Matrices of the slice; workspace.SourceImage contains the latest image.
  * @param xsize The width of the image in pixels.
  * @param ysize The height of the image in pixels.
  * @param Zcoordinates[][] The resulting list of nine fiducial coordinates.
 
 */
-bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
+bool Registration::LocateFiducials(zf::Workspace &workspace, int xsize,
                   int ysize, int Zcoordinates[9][2], float tZcoordinates[9][2])
 {
   
@@ -718,58 +817,68 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
     int    i,j;
     Real   peakval, offpeak1, offpeak2, offpeak3, offpeak4;
 
-    // Transform the MR image to the frequency domain (k-space).
-    FFT2(SourceImage, zeroimag, IFreal, IFimag);
-
-    // Normalize the image.
-    Real maxabsolute = ComplexMax(IFreal,IFimag);
-
-    // RISK: maxabsolute may be close to zero.
-    if(maxabsolute<MEPSILON)
-    {
-      std::cerr << "ZTrackerTransform::LocateFiducials - divide by zero." << std::endl;
-    } else
+    Real maxabsolute;
+    if (workspace.correlator.IsInitialized())
       {
-        IFreal *= (1/maxabsolute);
-        IFimag *= (1/maxabsolute);
+      // Correlate with the real-to-complex FFTs of FFT.h. The FFTSHIFT is
+      // folded into the mask spectrum.
+      workspace.correlator.Correlate(workspace.SourceImage, workspace.PIreal);
       }
+    else
+      {
+      // Transform the MR image to the frequency domain (k-space).
+      FFT2(workspace.SourceImage, workspace.zeroimag, workspace.IFreal, workspace.IFimag);
 
-    // Pointwise multiply the Image and the Mask in k-space.
-    PFreal.ReSize(xsize,ysize);
-    PFimag.ReSize(xsize,ysize);
-    for(i=0; i<xsize; i++)
-      for(j=0; j<ysize; j++)
-    {
-      PFreal.element(i,j) = IFreal.element(i,j)*MFreal.element(i,j) -
-                            IFimag.element(i,j)*MFimag.element(i,j);
-      PFimag.element(i,j) = IFreal.element(i,j)*MFimag.element(i,j) +
-                            IFimag.element(i,j)*MFreal.element(i,j);
-    }
+      // Normalize the image.
+      maxabsolute = ComplexMax(workspace.IFreal,workspace.IFimag);
 
-    // Invert the product of the two k-space images back to spatial domain.
-    // Regions of high correlation between the mask the image will appear
-    // as sharp peaks in the inverted image.
-    PIreal.ReSize(xsize,ysize);
-    PIimag.ReSize(xsize,ysize);
-    FFT2I(PFreal, PFimag, PIreal, PIimag);
-    // FFTSHIFT: exchange diagonally-opposite image quadrants.
-    Real swaptemp;
-    for(i=0; i<(xsize/2); i++)
-      for(j=0; j<ysize/2; j++)
+      // RISK: maxabsolute may be close to zero.
+      if(maxabsolute<MEPSILON)
       {
-        // Exchange first and fourth quadrants.
-        swaptemp = PIreal.element(i,j);
-        PIreal.element(i,j) = PIreal.element(i+xsize/2,j+ysize/2);
-        PIreal.element(i+xsize/2,j+ysize/2) = swaptemp;
+        std::cerr << "ZTrackerTransform::LocateFiducials - divide by zero." << std::endl;
+      } else
+        {
+          workspace.IFreal *= (1/maxabsolute);
+          workspace.IFimag *= (1/maxabsolute);
+        }
 
-        // Exchange second and third quadrants.
-        swaptemp = PIreal.element(i+xsize/2,j);
-        PIreal.element(i+xsize/2,j) = PIreal.element(i,j+ysize/2);
-        PIreal.element(i,j+ysize/2) = swaptemp;
-    }
+      // Pointwise multiply the Image and the Mask in k-space.
+      workspace.PFreal.ReSize(xsize,ysize);
+      workspace.PFimag.ReSize(xsize,ysize);
+      for(i=0; i<xsize; i++)
+        for(j=0; j<ysize; j++)
+      {
+        workspace.PFreal.element(i,j) = workspace.IFreal.element(i,j)*workspace.MFreal.element(i,j) -
+                              workspace.IFimag.element(i,j)*workspace.MFimag.element(i,j);
+        workspace.PFimag.element(i,j) = workspace.IFreal.element(i,j)*workspace.MFimag.element(i,j) +
+                              workspace.IFimag.element(i,j)*workspace.MFreal.element(i,j);
+      }
+
+      // Invert the product of the two k-space images back to spatial domain.
+      // Regions of high correlation between the mask the image will appear
+      // as sharp peaks in the inverted image.
+      workspace.PIreal.ReSize(xsize,ysize);
+      workspace.PIimag.ReSize(xsize,ysize);
+      FFT2I(workspace.PFreal, workspace.PFimag, workspace.PIreal, workspace.PIimag);
+      // FFTSHIFT: exchange diagonally-opposite image quadrants.
+      Real swaptemp;
+      for(i=0; i<(xsize/2); i++)
+        for(j=0; j<ysize/2; j++)
+        {
+          // Exchange first and fourth quadrants.
+          swaptemp = workspace.PIreal.element(i,j);
+          workspace.PIreal.element(i,j) = workspace.PIreal.element(i+xsize/2,j+ysize/2);
+          workspace.PIreal.element(i+xsize/2,j+ysize/2) = swaptemp;
+
+          // Exchange second and third quadrants.
+          swaptemp = workspace.PIreal.element(i+xsize/2,j);
+          workspace.PIreal.element(i+xsize/2,j) = workspace.PIreal.element(i,j+ysize/2);
+          workspace.PIreal.element(i,j+ysize/2) = swaptemp;
+      }
+      }
 
     // Normalize result.
-    maxabsolute = RealMax(PIreal);
+    maxabsolute = RealMax(workspace.PIreal);
     // RISK: maxabsolute may be close to zero.
     if(maxabsolute<MEPSILON)
     {
@@ -777,7 +886,7 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
       return(false);
     } else
       {
-        PIreal *= (1/maxabsolute);
+        workspace.PIreal *= (1/maxabsolute);
       }
 
     // Find the top 9 peak image values.
@@ -786,7 +895,7 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
     for(i=0; i<9; i++)
     {
       // Find the next peak value.
-      peakval = FindMax(PIreal, Zcoordinates[i][0], Zcoordinates[i][1]);
+      peakval = FindMax(workspace.PIreal, Zcoordinates[i][0], Zcoordinates[i][1]);
 
       // Define a block neighbourhood around the peak value.
       rstart = Zcoordinates[i][0]-10;
@@ -818,10 +927,10 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
       }
       else
         {
-          offpeak1 = (peakval - PIreal.element(rstart,cstart))/peakval;
-          offpeak2 = (peakval - PIreal.element(rstart,cstop))/peakval;
-          offpeak3 = (peakval - PIreal.element(rstop,cstart))/peakval;
-          offpeak4 = (peakval - PIreal.element(rstop,cstop))/peakval;
+          offpeak1 = (peakval - workspace.PIreal.element(rstart,cstart))/peakval;
+          offpeak2 = (peakval - workspace.PIreal.element(rstart,cstop))/peakval;
+          offpeak3 = (peakval - workspace.PIreal.element(rstop,cstart))/peakval;
+          offpeak4 = (peakval - workspace.PIreal.element(rstop,cstop))/peakval;
           if(offpeak1<0.3 || offpeak2<0.3 || offpeak3<0.3 || offpeak4<0.3)
           {
             // Ignore coordinate if the offpeak value is within 30% of the peak.
@@ -836,17 +945,17 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
         {
         // Find the subpixel coordinates of the peak.
         FindSubPixelPeak(&(Zcoordinates[i][0]), &(tZcoordinates[i][0]),
-                        PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]),
-                        PIreal.element(Zcoordinates[i][0]-1,Zcoordinates[i][1]),
-                        PIreal.element(Zcoordinates[i][0]+1,Zcoordinates[i][1]),
-                        PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]-1),
-                        PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]+1));
+                        workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]),
+                        workspace.PIreal.element(Zcoordinates[i][0]-1,Zcoordinates[i][1]),
+                        workspace.PIreal.element(Zcoordinates[i][0]+1,Zcoordinates[i][1]),
+                        workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]-1),
+                        workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]+1));
         }
 
       // Eliminate this peak and search for the next.
       for(int m=rstart; m<=rstop; m++)
         for(int n=cstart; n<=cstop; n++)
-          PIreal.element(m,n) = 0.0;
+          workspace.PIreal.element(m,n) = 0.0;
     }
   }
 
@@ -1774,6 +1883,8 @@ Registration::Registration()
     {
     this->InputImageDim[i] = 0;
     }
+  this->NumberOfThreads = 0;
+  this->FFTBackend = zf::FFT_REAL;
 }
 
 
@@ -1821,6 +1932,22 @@ int Registration::SetOrientationBase(float orientation[4])
 }
 
 
+int Registration::SetNumberOfThreads(int numberOfThreads)
+{
+  // 0 uses one thread per core
+  this->NumberOfThreads = numberOfThreads;
+  return 1;
+}
+
+
+int Registration::SetFFTBackend(int backend)
+{
+  // zf::FFT_REAL falls back to newmat for image sizes that are not powers of two
+  this->FFTBackend = backend;
+  return 1;
+}
+
+
 int Registration::Register(int range[2], float Zposition[3], float Zorientation[4])
 {
 
@@ -1878,9 +2005,6 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
     for (int j = 0; j < 4; j ++)
       T.element(i, j) = 0.0;
 
-  float position[3];
-  float quaternion[4];
-
   zf_7fid::Matrix4x4 matrix;
   matrix[0][0] = ntx;
   matrix[1][0] = nty;
@@ -1892,79 +2016,149 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
   matrix[1][2] = nny;
   matrix[2][2] = nnz;
 
-  for (int slindex = range[0]; slindex < range[1]; slindex ++)
+  // Orientation of the imaging plane; it is the same for all slices.
+  float imageQuaternion[4];
+  zf::MatrixToQuaternion(matrix, imageQuaternion);
+
+  float spacing[3];
+  spacing[0] = psi;
+  spacing[1] = psj;
+  spacing[2] = psk;
+
+  if (range[0] < 0 || range[1] > zsize)
     {
-    
+    return 0;
+    }
+
+  // The slices are registered concurrently. Each thread has its own workspace,
+  // kept from one call to the next, and takes the next slice until all slices
+  // are done. The results are kept
+  // per slice and accumulated in slice order below, so that the average pose
+  // does not depend on the number of threads.
+  int nslices = std::max(range[1] - range[0], 0);
+  std::vector<zf::SliceResult> results(nslices);
+  std::atomic<int> nextSlice(0);
+  std::exception_ptr error;
+  std::mutex errorMutex;
+
+  auto registerSlices = [&](zf::Workspace& workspace)
+    {
+    try
+      {
+      // The mask spectrum only depends on the image size and the FFT backend
+      if (workspace.xsize != xsize || workspace.ysize != ysize || workspace.backend != this->FFTBackend)
+        {
+        Init(workspace, xsize, ysize);
+        workspace.xsize = xsize;
+        workspace.ysize = ysize;
+        workspace.backend = this->FFTBackend;
+        }
+
+      for (int s = nextSlice ++; s < nslices; s = nextSlice ++)
+        {
+        int slindex = range[0] + s;
+
 #ifdef DEBUG_ZFRAME_REGISTRATION
-    std::cerr << "=== Current Slice Index: " << slindex << "===" << std::endl;
+        std::cerr << "=== Current Slice Index: " << slindex << "===" << std::endl;
 #endif
-        
-    // Shift the center
-    // NOTE: The center of the image should be shifted due to different
-    // definitions of image origin between VTK (Slicer) and OpenIGTLink;
-    // OpenIGTLink image has its origin at the center, while VTK image
-    // has one at the corner.
 
-    float hfovi = psi * (this->InputImageDim[0]-1) / 2.0;
-    float hfovj = psj * (this->InputImageDim[1]-1) / 2.0;
-    //float hfovk = psk * (this->InputIMageDim[2]-1) / 2.0;
+        // Shift the center
+        // NOTE: The center of the image should be shifted due to different
+        // definitions of image origin between VTK (Slicer) and OpenIGTLink;
+        // OpenIGTLink image has its origin at the center, while VTK image
+        // has one at the corner.
 
-    // For slice (k) direction, we calculate slice offset based on
-    // the slice index.
-    float offsetk = psk * slindex;
+        float hfovi = psi * (this->InputImageDim[0]-1) / 2.0;
+        float hfovj = psj * (this->InputImageDim[1]-1) / 2.0;
+        //float hfovk = psk * (this->InputImageDim[2]-1) / 2.0;
 
-    float cx = ntx * hfovi + nsx * hfovj + nnx * offsetk;
-    float cy = nty * hfovi + nsy * hfovj + nny * offsetk;
-    float cz = ntz * hfovi + nsz * hfovj + nnz * offsetk;
+        // For slice (k) direction, we calculate slice offset based on
+        // the slice index.
+        float offsetk = psk * slindex;
 
-    // position and quaternion will be overwritten by ZFrameRegistrationQuaternion()
-    zf::MatrixToQuaternion(matrix, quaternion);
+        float cx = ntx * hfovi + nsx * hfovj + nnx * offsetk;
+        float cy = nty * hfovi + nsy * hfovj + nny * offsetk;
+        float cz = ntz * hfovi + nsz * hfovj + nnz * offsetk;
 
-    position[0] = px + cx;
-    position[1] = py + cy;
-    position[2] = pz + cz;
+        // position and quaternion will be overwritten by ZFrameRegistrationQuaternion()
+        float* position = results[s].position;
+        float* quaternion = results[s].quaternion;
+        memcpy(quaternion, imageQuaternion, sizeof(float)*4);
 
-#ifdef DEBUG_ZFRAME_REGISTRATION
-    std::cerr << "=== Image position ===" << std::endl;
-    std::cerr << "x = " << position[0] << std::endl;
-    std::cerr << "y = " << position[1] << std::endl;
-    std::cerr << "z = " << position[2] << std::endl;
-#endif // DEBUG_ZFRAME_REGISTRATION
+        position[0] = px + cx;
+        position[1] = py + cy;
+        position[2] = pz + cz;
 
-    short * currentSlice;
-    if (slindex >= 0 && slindex < zsize)
-      {
-      currentSlice = &(this->InputImage[xsize*ysize*slindex]);
+        short * currentSlice = &(this->InputImage[xsize*ysize*slindex]);
+
+        // Transfer image to a Matrix.
+        workspace.SourceImage.ReSize(xsize,ysize);
+
+        for(int i=0; i<xsize; i++)
+          for(int j=0; j<ysize; j++)
+            workspace.SourceImage.element(i,j) = currentSlice[j*xsize+i];
+
+        results[s].success = RegisterQuaternion(position, quaternion, this->ZOrientationBase,
+                                                workspace, this->InputImageDim, spacing);
+        }
       }
-    else
+    catch (...)
       {
-      return 0;
+      std::lock_guard<std::mutex> lock(errorMutex);
+      if (!error)
+        {
+        error = std::current_exception();
+        }
+      // Let the other threads run out of slices
+      nextSlice = nslices;
       }
+    };
 
-    // Transfer image to a Matrix.
-    SourceImage.ReSize(xsize,ysize);
+  int nthreads = this->NumberOfThreads;
+  if (nthreads <= 0)
+    {
+    nthreads = (int) std::thread::hardware_concurrency();
+    }
+  nthreads = std::max(1, std::min(nthreads, nslices));
 
-    for(int i=0; i<xsize; i++)
-      for(int j=0; j<ysize; j++)
-        SourceImage.element(i,j) = currentSlice[j*xsize+i];
+#ifdef DEBUG_ZFRAME_REGISTRATION
+  std::cerr << "=== Number of threads: " << nthreads << "===" << std::endl;
+#endif
 
-    // if Z-frame position is determined from the slice
-    float spacing[3];
-    spacing[0] = psi;
-    spacing[1] = psj;
-    spacing[2] = psk;
+  while ((int) this->Workspaces.size() < nthreads)
+    {
+    this->Workspaces.push_back(std::unique_ptr<zf::Workspace>(new zf::Workspace()));
+    }
 
-    Init(xsize, ysize);
+  // The calling thread registers slices too.
+  std::vector<std::thread> threads;
+  for (int t = 1; t < nthreads; t ++)
+    {
+    threads.push_back(std::thread(registerSlices, std::ref(*this->Workspaces[t])));
+    }
+  registerSlices(*this->Workspaces[0]);
+  for (size_t t = 0; t < threads.size(); t ++)
+    {
+    threads[t].join();
+    }
+  if (error)
+    {
+    std::rethrow_exception(error);
+    }
 
-    if (RegisterQuaternion(position, quaternion, this->ZOrientationBase,
-                           SourceImage, this->InputImageDim, spacing))
+  for (int s = 0; s < nslices; s ++)
+    {
+    if (results[s].success)
       {
+      float* position = results[s].position;
+      float* quaternion = results[s].quaternion;
+
       P[0] += position[0];
       P[1] += position[1];
       P[2] += position[2];
 
 #ifdef DEBUG_ZFRAME_REGISTRATION
-      std::cerr << "position = ("
+      std::cerr << "slice " << range[0] + s << ": position = ("
                 << position[0] << ", "
                 << position[1] << ", "
                 << position[2] << ")" << std::endl;
@@ -1985,7 +2179,7 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
       n ++;
 
 #ifdef DEBUG_ZFRAME_REGISTRATION
-      std::cerr << "quaternion = ("
+      std::cerr << "slice " << range[0] + s << ": quaternion = ("
                 << quaternion[0] << ", "
                 << quaternion[1] << ", "
                 << quaternion[2] << ", "
@@ -2090,7 +2284,7 @@ int Registration::Register(int range[2], float Zposition[3], float Zorientation[
 }
 
 
-void Registration::Init(int xsize, int ysize)
+void Registration::Init(zf::Workspace& workspace, int xsize, int ysize)
 {
   int i,j,m,n;
 
@@ -2130,38 +2324,47 @@ void Registration::Init(int xsize, int ysize)
   // Create a mask image and initialize elements to zero.
   // The Matrix class is implemented in the newmat library:
   // see: http://www.robertnz.net/
-  MaskImage.ReSize(xsize,ysize);
+  workspace.MaskImage.ReSize(xsize,ysize);
   for(i=0; i<xsize; i++)
     for(j=0; j<ysize; j++)
-        MaskImage.element(i,j) = 0;
+        workspace.MaskImage.element(i,j) = 0;
 
   // Copy the correlation kernel to the centre of the mask image.
   for(i=((xsize/2)-5),m=0; i<=((xsize/2)+5); i++,m++)
     for(j=((ysize/2)-5),n=0; j<=((ysize/2)+5); j++,n++)
     {
-        MaskImage.element(i,j) = kernel[m][n];
+        workspace.MaskImage.element(i,j) = kernel[m][n];
     }
 
   // Correlation will be computed using spatial convolution, and hence
   // multiplication in the frequency domain. This dramatically accelerates
   // fiducial detection. Transform mask to frequency domain; this only
   // has to be done once.
+  if (this->FFTBackend == zf::FFT_REAL && zf::RealCorrelator::Supports(xsize, ysize))
+    {
+    // Real-to-complex transforms with cached plans (see FFT.h); the newmat
+    // matrices below are not needed.
+    workspace.correlator.Init(workspace.MaskImage);
+    return;
+    }
+  workspace.correlator = zf::RealCorrelator();
+
   // Before transforming the mask to the spatial frequency domain, need to
   // create an empty imaginary component, since the mask is real-valued.
-  zeroimag.ReSize(xsize,ysize);
+  workspace.zeroimag.ReSize(xsize,ysize);
   for(i=0; i<xsize; i++)
     for(j=0; j<ysize; j++)
-        zeroimag.element(i,j) = 0;
+        workspace.zeroimag.element(i,j) = 0;
 
   // The Radix-2 FFT algorithm is implemented in the newmat library:
   // see: http://www.robertnz.net/
-  FFT2(MaskImage, zeroimag, MFreal, MFimag);
+  FFT2(workspace.MaskImage, workspace.zeroimag, workspace.MFreal, workspace.MFimag);
 
   // Conjugate and normalize the mask.
-  MFimag *= -1;
-  Real maxabsolute = ComplexMax(MFreal, MFimag);
-  MFreal *= (1/maxabsolute);
-  MFimag *= (1/maxabsolute);
+  workspace.MFimag *= -1;
+  Real maxabsolute = ComplexMax(workspace.MFreal, workspace.MFimag);
+  workspace.MFreal *= (1/maxabsolute);
+  workspace.MFimag *= (1/maxabsolute);
 
   // MFreal and MFimag now contain the real and imaginary matrix elements for
   // the frequency domain representation of the correlation mask.
@@ -2170,14 +2373,14 @@ void Registration::Init(int xsize, int ysize)
 
 int Registration::RegisterQuaternion(float position[3], float quaternion[4],
                                                     float ZquaternionBase[4],
-                                                    Matrix& SourceImage, int dimension[3], float spacing[3])
+                                                    zf::Workspace& workspace, int dimension[3], float spacing[3])
 {
 
   Column3Vector Zposition;
   Quaternion    Zorientation;
   Quaternion    ZorientationBase;
-  static Column3Vector Iposition;
-  static Quaternion Iorientation;
+  Column3Vector Iposition;
+  Quaternion    Iorientation;
   int           Zcoordinates[7][2];
   float         tZcoordinates[7][2];
   bool          frame_lock;
@@ -2199,7 +2402,7 @@ int Registration::RegisterQuaternion(float position[3], float quaternion[4],
 
   // Find the 7 Z-frame fiducial intercept artifacts in the image.
   std::cerr << "ZTrackerTransform - Searching fiducials...\n" << std::endl;
-  if(LocateFiducials(SourceImage, dimension[0], dimension[1], Zcoordinates, tZcoordinates) == false)
+  if(LocateFiducials(workspace, dimension[0], dimension[1], Zcoordinates, tZcoordinates) == false)
   {
   std::cerr << "ZTrackerTransform::onEventGenerated - Ficudials not detected. No frame lock on this image.\n" << std::endl;
   frame_lock = false;
@@ -2291,70 +2494,80 @@ int Registration::RegisterQuaternion(float position[3], float quaternion[4],
  * The Z-frame contains seven line fiducials arranged in such a manner that
  * its position and orientation in the MRI scanner can be determined from a
  * single image. This method detects the seven line fiducial intercepts.
- * @param SourceImage An image matrix containing the latest image.
+ * @param workspace Matrices of the slice; workspace.SourceImage contains the latest image.
  * @param xsize The width of the image in pixels.
  * @param ysize The height of the image in pixels.
  * @param Zcoordinates[][] The resulting list of seven fiducial coordinates.
 
 */
-bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
+bool Registration::LocateFiducials(zf::Workspace &workspace, int xsize,
                   int ysize, int Zcoordinates[7][2], float tZcoordinates[7][2])
 {
   int    i,j;
   Real   peakval, offpeak1, offpeak2, offpeak3, offpeak4;
 
-  // Transform the MR image to the frequency domain (k-space).
-  FFT2(SourceImage, zeroimag, IFreal, IFimag);
+  Real maxabsolute;
+  if (workspace.correlator.IsInitialized())
+    {
+    // Correlate with the real-to-complex FFTs of FFT.h. The FFTSHIFT is
+    // folded into the mask spectrum.
+    workspace.correlator.Correlate(workspace.SourceImage, workspace.PIreal);
+    }
+  else
+    {
+    // Transform the MR image to the frequency domain (k-space).
+    FFT2(workspace.SourceImage, workspace.zeroimag, workspace.IFreal, workspace.IFimag);
 
-  // Normalize the image.
-  Real maxabsolute = ComplexMax(IFreal,IFimag);
-  // RISK: maxabsolute may be close to zero.
-  if(maxabsolute<MEPSILON)
-  {
-  std::cerr << "ZTrackerTransform::LocateFiducials - divide by zero." << std::endl;
-  } else
+    // Normalize the image.
+    maxabsolute = ComplexMax(workspace.IFreal,workspace.IFimag);
+    // RISK: maxabsolute may be close to zero.
+    if(maxabsolute<MEPSILON)
+    {
+    std::cerr << "ZTrackerTransform::LocateFiducials - divide by zero." << std::endl;
+    } else
+      {
+        workspace.IFreal *= (1/maxabsolute);
+        workspace.IFimag *= (1/maxabsolute);
+      }
+
+    // Pointwise multiply the Image and the Mask in k-space.
+    workspace.PFreal.ReSize(xsize,ysize);
+    workspace.PFimag.ReSize(xsize,ysize);
+    for(i=0; i<xsize; i++)
+      for(j=0; j<ysize; j++)
     {
-      IFreal *= (1/maxabsolute);
-      IFimag *= (1/maxabsolute);
+      workspace.PFreal.element(i,j) = workspace.IFreal.element(i,j)*workspace.MFreal.element(i,j) -
+                            workspace.IFimag.element(i,j)*workspace.MFimag.element(i,j);
+      workspace.PFimag.element(i,j) = workspace.IFreal.element(i,j)*workspace.MFimag.element(i,j) +
+                            workspace.IFimag.element(i,j)*workspace.MFreal.element(i,j);
     }
 
-  // Pointwise multiply the Image and the Mask in k-space.
-  PFreal.ReSize(xsize,ysize);
-  PFimag.ReSize(xsize,ysize);
-  for(i=0; i<xsize; i++)
-    for(j=0; j<ysize; j++)
-  {
-    PFreal.element(i,j) = IFreal.element(i,j)*MFreal.element(i,j) -
-                          IFimag.element(i,j)*MFimag.element(i,j);
-    PFimag.element(i,j) = IFreal.element(i,j)*MFimag.element(i,j) +
-                          IFimag.element(i,j)*MFreal.element(i,j);
-  }
+    // Invert the product of the two k-space images back to spatial domain.
+    // Regions of high correlation between the mask the image will appear
+    // as sharp peaks in the inverted image.
+    workspace.PIreal.ReSize(xsize,ysize);
+    workspace.PIimag.ReSize(xsize,ysize);
+    FFT2I(workspace.PFreal, workspace.PFimag, workspace.PIreal, workspace.PIimag);
 
-  // Invert the product of the two k-space images back to spatial domain.
-  // Regions of high correlation between the mask the image will appear
-  // as sharp peaks in the inverted image.
-  PIreal.ReSize(xsize,ysize);
-  PIimag.ReSize(xsize,ysize);
-  FFT2I(PFreal, PFimag, PIreal, PIimag);
-
-  // FFTSHIFT: exchange diagonally-opposite image quadrants.
-  Real swaptemp;
-  for(i=0; i<(xsize/2); i++)
-    for(j=0; j<ysize/2; j++)
-    {
-      // Exchange first and fourth quadrants.
-      swaptemp = PIreal.element(i,j);
-      PIreal.element(i,j) = PIreal.element(i+xsize/2,j+ysize/2);
-      PIreal.element(i+xsize/2,j+ysize/2) = swaptemp;
-
-      // Exchange second and third quadrants.
-      swaptemp = PIreal.element(i+xsize/2,j);
-      PIreal.element(i+xsize/2,j) = PIreal.element(i,j+ysize/2);
-      PIreal.element(i,j+ysize/2) = swaptemp;
-  }
+    // FFTSHIFT: exchange diagonally-opposite image quadrants.
+    Real swaptemp;
+    for(i=0; i<(xsize/2); i++)
+      for(j=0; j<ysize/2; j++)
+      {
+        // Exchange first and fourth quadrants.
+        swaptemp = workspace.PIreal.element(i,j);
+        workspace.PIreal.element(i,j) = workspace.PIreal.element(i+xsize/2,j+ysize/2);
+        workspace.PIreal.element(i+xsize/2,j+ysize/2) = swaptemp;
+
+        // Exchange second and third quadrants.
+        swaptemp = workspace.PIreal.element(i+xsize/2,j);
+        workspace.PIreal.element(i+xsize/2,j) = workspace.PIreal.element(i,j+ysize/2);
+        workspace.PIreal.element(i,j+ysize/2) = swaptemp;
+    }
+    }
 
   // Normalize result.
-  maxabsolute = RealMax(PIreal);
+  maxabsolute = RealMax(workspace.PIreal);
   // RISK: maxabsolute may be close to zero.
   if(maxabsolute<MEPSILON)
   {
@@ -2362,7 +2575,7 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
   return(false);
   } else
     {
-      PIreal *= (1/maxabsolute);
+      workspace.PIreal *= (1/maxabsolute);
     }
 
   // Find the top 7 peak image values.
@@ -2371,7 +2584,7 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
   for(i=0; i<7; i++)
   {
     // Find the next peak value.
-    peakval = FindMax(PIreal, Zcoordinates[i][0], Zcoordinates[i][1]);
+    peakval = FindMax(workspace.PIreal, Zcoordinates[i][0], Zcoordinates[i][1]);
 
     // Define a block neighbourhood around the peak value.
     rstart = Zcoordinates[i][0]-10;
@@ -2403,10 +2616,10 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
     }
     else
       {
-        offpeak1 = (peakval - PIreal.element(rstart,cstart))/peakval;
-        offpeak2 = (peakval - PIreal.element(rstart,cstop))/peakval;
-        offpeak3 = (peakval - PIreal.element(rstop,cstart))/peakval;
-        offpeak4 = (peakval - PIreal.element(rstop,cstop))/peakval;
+        offpeak1 = (peakval - workspace.PIreal.element(rstart,cstart))/peakval;
+        offpeak2 = (peakval - workspace.PIreal.element(rstart,cstop))/peakval;
+        offpeak3 = (peakval - workspace.PIreal.element(rstop,cstart))/peakval;
+        offpeak4 = (peakval - workspace.PIreal.element(rstop,cstop))/peakval;
         if(offpeak1<0.3 || offpeak2<0.3 || offpeak3<0.3 || offpeak4<0.3)
         {
            // Ignore coordinate if the offpeak value is within 30% of the peak.
@@ -2421,17 +2634,17 @@ bool Registration::LocateFiducials(Matrix &SourceImage, int xsize,
       {
       // Find the subpixel coordinates of the peak.
       FindSubPixelPeak(&(Zcoordinates[i][0]), &(tZcoordinates[i][0]),
-                       PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]),
-                       PIreal.element(Zcoordinates[i][0]-1,Zcoordinates[i][1]),
-                       PIreal.element(Zcoordinates[i][0]+1,Zcoordinates[i][1]),
-                       PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]-1),
-                       PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]+1));
+                       workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]),
+                       workspace.PIreal.element(Zcoordinates[i][0]-1,Zcoordinates[i][1]),
+                       workspace.PIreal.element(Zcoordinates[i][0]+1,Zcoordinates[i][1]),
+                       workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]-1),
+                       workspace.PIreal.element(Zcoordinates[i][0],Zcoordinates[i][1]+1));
       }
 
     // Eliminate this peak and search for the next.
     for(int m=rstart; m<=rstop; m++)
       for(int n=cstart; n<=cstop; n++)
-        PIreal.element(m,n) = 0.0;
+        workspace.PIreal.element(m,n) = 0.0;
   }
 
   //=== Determine the correct ordering of the detected fiducial points ===
@@ -15,6 +15,10 @@
 #ifndef __Registration_h
 #define __Registration_h
 
+#include <memory>
+#include <vector>
+
+#include "FFT.h"
 #include "ZLinAlg.h"
 #include "newmatap.h"
 #include "newmat.h"
@@ -28,6 +32,29 @@ namespace zf {
   void MatrixToQuaternion(Matrix4x4& m, float* q);
   void Cross(float *a, float *b, float *c);
   void IdentityMatrix(Matrix4x4 &matrix);
+
+  // Matrices used to locate the fiducials in one slice. Each thread of
+  // Registration::Register() has its own workspace.
+  struct Workspace
+  {
+    Workspace() : xsize(0), ysize(0), backend(-1) {}
+
+    // Image size and FFT backend of the mask spectrum
+    int xsize, ysize, backend;
+    Matrix SourceImage, MaskImage;
+    Matrix IFreal, IFimag, MFreal, MFimag, zeroimag;
+    Matrix PFreal, PFimag;
+    Matrix PIreal, PIimag;
+    RealCorrelator correlator;
+  };
+
+  // Frame pose found in one slice.
+  struct SliceResult
+  {
+    int   success;
+    float position[3];
+    float quaternion[4];
+  };
 }
 
 namespace zf_9fid {
@@ -50,14 +77,16 @@ namespace zf_9fid {
     int SetFrameTopology(float frameTopology[6][3]);
     int SetManualZFrameFiducials(float zFrameFids[9][2], bool manualRegistration);
     int SetAutomaticRegistration(bool manualRegistration);
+    int SetNumberOfThreads(int numberOfThreads);
+    int SetFFTBackend(int backend);
     int Register(int range[2],float Zposition[3], float Zorientation[4]);
 
   protected:
-    void Init(int xsize, int ysize);
+    void Init(zf::Workspace& workspace, int xsize, int ysize);
     int  RegisterQuaternion(float position[3], float quaternion[4],
                             float ZquaternionBase[4],
-                            Matrix& srcImage, int dimension[3], float spacing[3]);
-    bool LocateFiducials(Matrix &image, int xsize, int ysize,
+                            zf::Workspace& workspace, int dimension[3], float spacing[3]);
+    bool LocateFiducials(zf::Workspace &workspace, int xsize, int ysize,
                         int Zcoordinates[9][2], float tZcoordinates[9][2]);
     void FindSubPixelPeak(int Zcoordinate[2], float tZcoordinate[2],
                           Real Y0, Real Yx1, Real Yx2, Real Yy1, Real Yy2);
@@ -92,13 +121,11 @@ namespace zf_9fid {
     float     frameTopology[6][3];
     float     zFrameFids[9][2];
     bool      manualRegistration; 
+    int       NumberOfThreads;
+    int       FFTBackend;
 
-    //BTX
-    Matrix SourceImage, MaskImage;
-    Matrix IFreal, IFimag, MFreal, MFimag, zeroimag;
-    Matrix PFreal, PFimag;
-    Matrix PIreal, PIimag;
-    //ETX
+    // Workspaces of the threads of Register(), kept between calls
+    std::vector<std::unique_ptr<zf::Workspace> > Workspaces;
 
   };
 
@@ -130,14 +157,16 @@ namespace zf_7fid {
     int SetFrameTopology(float frameTopology[6][3]);
     int SetManualZFrameFiducials(float zFrameFids[7][2], bool manualRegistration);
     int SetAutomaticRegistration(bool manualRegistration);
+    int SetNumberOfThreads(int numberOfThreads);
+    int SetFFTBackend(int backend);
     int Register(int range[2],float Zposition[3], float Zorientation[4]);
 
   protected:
-    void Init(int xsize, int ysize);
+    void Init(zf::Workspace& workspace, int xsize, int ysize);
     int  RegisterQuaternion(float position[3], float quaternion[4],
                             float ZquaternionBase[4],
-                            Matrix& srcImage, int dimension[3], float spacing[3]);
-    bool LocateFiducials(Matrix &image, int xsize, int ysize,
+                            zf::Workspace& workspace, int dimension[3], float spacing[3]);
+    bool LocateFiducials(zf::Workspace &workspace, int xsize, int ysize,
                         int Zcoordinates[9][2], float tZcoordinates[9][2]);
     void FindSubPixelPeak(int Zcoordinate[2], float tZcoordinate[2],
                           Real Y0, Real Yx1, Real Yx2, Real Yy1, Real Yy2);
@@ -171,13 +200,11 @@ namespace zf_7fid {
     float     frameTopology[6][3];
     float     zFrameFids[7][2];
     bool      manualRegistration; 
+    int       NumberOfThreads;
+    int       FFTBackend;
 
-    //BTX
-    Matrix SourceImage, MaskImage;
-    Matrix IFreal, IFimag, MFreal, MFimag, zeroimag;
-    Matrix PFreal, PFimag;
-    Matrix PIreal, PIimag;
-    //ETX
+    // Workspaces of the threads of Register(), kept between calls
+    std::vector<std::unique_ptr<zf::Workspace> > Workspaces;
 
   };
 
@@ -4,49 +4,94 @@
 #include "itkAffineTransform.h"
 
 #include "itkPluginUtilities.h"
+#include <itksys/SystemTools.hxx>
 
 #include "Registration.h"
 #include <ZFrameRegistrationCLP.h>
 
+#include <chrono>
+#include <fstream>
+#include <future>
+#include <map>
+#include <sstream>
+
 
 using namespace std;
 
-int main( int argc, char * argv[] )
+namespace
 {
-    PARSE_ARGS;
-    
-    const unsigned int Dimension = 3;
-    
-    typedef short PixelType;
 
-    typedef itk::Image<PixelType, Dimension> ImageType;
-    typedef itk::ImageFileReader<ImageType> ReaderType;
+const unsigned int Dimension = 3;
+
+typedef short PixelType;
+
+typedef itk::Image<PixelType, Dimension> ImageType;
+typedef itk::ImageFileReader<ImageType> ReaderType;
+
+typedef itk::Matrix<double, 4, 4> HomogeneousMatrixType;
+
+// 7- and 9-fiducial registrations, reused for all the volumes of a run so that
+// their FFT workspaces stay initialized.
+struct Registrations
+{
+    zf_7fid::Registration sevenFiducials;
+    zf_9fid::Registration nineFiducials;
+};
+
+// One volume of a batch manifest
+struct BatchCase
+{
+    std::string volume;
+    int range[2];
+    std::string zframeConfig;
+    std::string outputTransform;
+};
+
+// Volume read for a batch case
+struct LoadedVolume
+{
+    ImageType::Pointer image;
+    zf::Matrix4x4 transform;
+    double seconds;
+    std::string error;
+};
+
+//  LPS (ITK)to RAS (Slicer) transform matrix
+HomogeneousMatrixType LPSToRASMatrix()
+{
+    HomogeneousMatrixType lps2RasTransformMatrix;
+    lps2RasTransformMatrix.SetIdentity();
+    lps2RasTransformMatrix[0][0] = -1.0;
+    lps2RasTransformMatrix[1][1] = -1.0;
+    lps2RasTransformMatrix[2][2] =  1.0;
+    lps2RasTransformMatrix[3][3] =  1.0;
+    return lps2RasTransformMatrix;
+}
+
+// Read a volume and compute its IJK to RAS matrix
+ImageType::Pointer ReadVolume(const std::string& fileName, zf::Matrix4x4& imageTransform)
+{
     ReaderType::Pointer reader = ReaderType::New();
-    
-    typedef itk::Matrix<double, 4, 4> MatrixType;
-    
-    reader->SetFileName(inputVolume.c_str());
+
+    reader->SetFileName(fileName.c_str());
     reader->Update();
-    
+
     ImageType::Pointer image = reader->GetOutput();
-    
-    typedef ImageType::SizeType Size3D;
-    Size3D dimensions = image->GetLargestPossibleRegion().GetSize();
-    
+
     ImageType::DirectionType itkDirections = image->GetDirection();
     ImageType::PointType itkOrigin = image->GetOrigin();
     ImageType::SpacingType itkSpacing = image->GetSpacing();
-    
+
     double origin[3] = {itkOrigin[0], itkOrigin[1], itkOrigin[2]};
     double spacing[3] = {itkSpacing[0], itkSpacing[1], itkSpacing[2]};
     double directions[3][3] = {{1.0,0.0,0.0},{0.0,1.0,0.0},{0.0,0.0,1.0}};
     for (unsigned int col=0; col<3; col++)
         for (unsigned int row=0; row<3; row++)
             directions[row][col] = itkDirections[row][col];
-    
-    MatrixType rtimgTransform;
+
+    HomogeneousMatrixType rtimgTransform;
     rtimgTransform.SetIdentity();
-    
+
     int row, col;
     for(row=0; row<3; row++)
     {
@@ -54,268 +99,488 @@ int main( int argc, char * argv[] )
             rtimgTransform[row][col] = spacing[col] * directions[row][col];
         rtimgTransform[row][3] = origin[row];
     }
-    
-    //  LPS (ITK)to RAS (Slicer) transform matrix
-    MatrixType lps2RasTransformMatrix;
-    lps2RasTransformMatrix.SetIdentity();
-    lps2RasTransformMatrix[0][0] = -1.0;
-    lps2RasTransformMatrix[1][1] = -1.0;
-    lps2RasTransformMatrix[2][2] =  1.0;
-    lps2RasTransformMatrix[3][3] =  1.0;
-    
-    MatrixType imageToWorldTransform;
-    imageToWorldTransform = lps2RasTransformMatrix * rtimgTransform;
-    
+
+    HomogeneousMatrixType imageToWorldTransform;
+    imageToWorldTransform = LPSToRASMatrix() * rtimgTransform;
+
     // Convert image position and orientation to zf::Matrix4x4
-    zf::Matrix4x4 imageTransform;
-    imageTransform[0][0] = imageToWorldTransform[0][0];
-    imageTransform[1][0] = imageToWorldTransform[1][0];
-    imageTransform[2][0] = imageToWorldTransform[2][0];
-    imageTransform[0][1] = imageToWorldTransform[0][1];
-    imageTransform[1][1] = imageToWorldTransform[1][1];
-    imageTransform[2][1] = imageToWorldTransform[2][1];
-    imageTransform[0][2] = imageToWorldTransform[0][2];
-    imageTransform[1][2] = imageToWorldTransform[1][2];
-    imageTransform[2][2] = imageToWorldTransform[2][2];
-    imageTransform[0][3] = imageToWorldTransform[0][3];
-    imageTransform[1][3] = imageToWorldTransform[1][3];
-    imageTransform[2][3] = imageToWorldTransform[2][3];
-
-
-    MatrixType ZFrameBaseOrientation;
-    ZFrameBaseOrientation.SetIdentity();
-    
-    // ZFrame base orientation
-    zf::Matrix4x4 ZmatrixBase;
-    ZmatrixBase[0][0] = (float) ZFrameBaseOrientation[0][0];
-    ZmatrixBase[1][0] = (float) ZFrameBaseOrientation[1][0];
-    ZmatrixBase[2][0] = (float) ZFrameBaseOrientation[2][0];
-    ZmatrixBase[0][1] = (float) ZFrameBaseOrientation[0][1];
-    ZmatrixBase[1][1] = (float) ZFrameBaseOrientation[1][1];
-    ZmatrixBase[2][1] = (float) ZFrameBaseOrientation[2][1];
-    ZmatrixBase[0][2] = (float) ZFrameBaseOrientation[0][2];
-    ZmatrixBase[1][2] = (float) ZFrameBaseOrientation[1][2];
-    ZmatrixBase[2][2] = (float) ZFrameBaseOrientation[2][2];
-    ZmatrixBase[0][3] = (float) ZFrameBaseOrientation[0][3];
-    ZmatrixBase[1][3] = (float) ZFrameBaseOrientation[1][3];
-    ZmatrixBase[2][3] = (float) ZFrameBaseOrientation[2][3];
-    
-    // Convert Base Matrix to quaternion
-    float ZquaternionBase[4];
-    zf::MatrixToQuaternion(ZmatrixBase, ZquaternionBase);
-    
-    // Set slice range
-    int range[2];
-    range[0] = startSlice;
-    range[1] = endSlice;
-    
-    float Zposition[3];
-    float Zorientation[4];
-    
-    // Call Z-frame registration
-    // zf::Registration * registration;
-    // registration = new zf::Registration();
-    
-    int dim[3];
-    dim[0] = dimensions[0];
-    dim[1] = dimensions[1];
-    dim[2] = dimensions[2];
-    int r = -1;
-    bool manualRegistration = false;
+    zf::IdentityMatrix(imageTransform);
+    for (row=0; row<3; row++)
+        for (col=0; col<4; col++)
+            imageTransform[row][col] = imageToWorldTransform[row][col];
 
-    // std::cout << "zframeConfig: " << zframeConfig << std::endl;
-    // std::cout << "Frame topology: " << frameTopology << std::endl;
-    // std::cout << "zFrameFids: " << zFrameFids << std::endl;
+    return image;
+}
 
-    // Convert frameTopology string back into an array of floats
-    float frameTopologyArr[6][3];
+// Number of fiducials of a z-frame configuration, 0 if the configuration is unknown
+int NumberOfFiducials(const std::string& zframeConfig)
+{
+    if (zframeConfig == "z001" || zframeConfig == "z004" || zframeConfig == "z005") { return 7; }
+    else if (zframeConfig == "z002" || zframeConfig == "z003") { return 9; }
+    return 0;
+}
+
+std::string Trim(const std::string& text)
+{
+    size_t start = text.find_first_not_of(" \t\r\n");
+    if (start == std::string::npos) { return ""; }
+    return text.substr(start, text.find_last_not_of(" \t\r\n") - start + 1);
+}
+
+// Convert frameTopology string back into an array of floats
+// The first 3 rows contain the origin points in RAS coordinates of Side 1, Base, and Side 2, respectively.
+// The 4th, 5th, and 6th rows contain the diagonal vectors in RAS coordinates of Side 1, Base, and Side 2.
+void ParseFrameTopology(std::string frameTopology, float frameTopologyArr[6][3])
+{
     float x, y, z;
-    std::string substring, z_substr;
+    std::string substring;
     size_t pos, pos_start, pos_end = 0;
 
-    int numFids = 0;
-    if (zframeConfig == "z001") { numFids = 7; }
-    else if (zframeConfig == "z002" || zframeConfig == "z003") { numFids = 9; }
-    //float zFrameFidsArr[numFids][2];
-	auto zFrameFidsArr = new float[numFids][2];
-
     for (int i = 0; i <= 5; ++i)
     {
-        pos_start = frameTopology.find("["); 
-        pos_end = frameTopology.find("]"); 
-        substring = frameTopology.substr(pos_start + 1, pos_end);
+        // The innermost brackets, so that the list may be enclosed in brackets
+        pos_end = frameTopology.find("]");
+        pos_start = frameTopology.rfind("[", pos_end);
+        substring = frameTopology.substr(pos_start + 1, pos_end - pos_start - 1);
         frameTopology.erase(0, pos_end + 1); // Erase the first occurence from frameTopology string
 
-        // std::cout << "frameTopology: " << frameTopology << std::endl;
-        // std::cout << "substring: " << substring << std::endl;
-
         // Separate the substring at the commas twice and use std::stof() to convert the string to float to find x, y, and z
         pos = substring.find(",");
         x = std::stof(substring.substr(0, pos));
-        substring.erase(0, pos + 1);
+        substring = Trim(substring.substr(pos + 1));
 
         pos = substring.find(",");
         y = std::stof(substring.substr(0, pos));
-        z = std::stof(substring.erase(0, pos + 2 ));
+        z = std::stof(Trim(substring.substr(pos + 1)));
 
         frameTopologyArr[i][0] = x;
         frameTopologyArr[i][1] = y;
         frameTopologyArr[i][2] = z;
     }
-    // Final result is stored in frameTopologyArr[6][3]
-    // The first 3 rows contain the origin points in RAS coordinates of Side 1, Base, and Side 2, respectively. 
-    // The 4th, 5th, and 6th rows contain the diagonal vectors in RAS coordinates of Side 1, Base, and Side 2.
+}
 
-    // If zFrameFidsString is not empty, then the user manually selected points to use in registration. 
-    // Convert zFrameFidsString back into an array of floats for use in the registration algorithm
-    if (zFrameFids.length() > 1)
-    {   
-        manualRegistration = true;
-        for (int i = 0; i < numFids; ++i)
-        {
-            pos_start = zFrameFids.find("["); 
-            pos_end = zFrameFids.find("]"); 
-            substring = zFrameFids.substr(pos_start + 1, pos_end);
-            zFrameFids.erase(0, pos_end + 1); // Erase the first occurence from frameTopology string
-
-            // Separate the substring at the commas twice and use std::stof() to convert the string to float to find x, y, and z
-            pos = substring.find(",");
-            x = std::stof(substring.substr(0, pos));
-            substring.erase(0, pos + 1);
-
-            pos = substring.find(",");
-            // y = std::stof(substring.substr(0, pos));
-            y = std::stof(substring.substr(0, pos));
-            // z = std::stof(substring.erase(0, pos + 2 ));
-
-            zFrameFidsArr[i][0] = x;
-            zFrameFidsArr[i][1] = y;
-            // zFrameFidsArr[i][2] = z;
-
-            std::cout << "zFrameFidsArr: " << zFrameFidsArr[i][0] << ", " << zFrameFidsArr[i][1] << std::endl;
-        }
+// Convert zFrameFidsString back into an array of floats for use in the registration algorithm
+void ParseFiducials(std::string zFrameFids, int numFids, float zFrameFidsArr[9][2])
+{
+    float x, y;
+    std::string substring;
+    size_t pos, pos_start, pos_end = 0;
+
+    for (int i = 0; i < numFids; ++i)
+    {
+        // The innermost brackets, so that the list may be enclosed in brackets
+        pos_end = zFrameFids.find("]");
+        pos_start = zFrameFids.rfind("[", pos_end);
+        substring = zFrameFids.substr(pos_start + 1, pos_end - pos_start - 1);
+        zFrameFids.erase(0, pos_end + 1); // Erase the first occurence from frameTopology string
+
+        // Separate the substring at the commas twice and use std::stof() to convert the string to float to find x, y, and z
+        pos = substring.find(",");
+        x = std::stof(substring.substr(0, pos));
+        substring = Trim(substring.substr(pos + 1));
+
+        pos = substring.find(",");
+        y = std::stof(substring.substr(0, pos));
+
+        zFrameFidsArr[i][0] = x;
+        zFrameFidsArr[i][1] = y;
+
+        std::cout << "zFrameFidsArr: " << zFrameFidsArr[i][0] << ", " << zFrameFidsArr[i][1] << std::endl;
     }
+}
+
+// Run the registration algorithm of the z-frame configuration on a volume. Returns the result of
+// Register(), or -1 for an unknown configuration. zFrameFidsArr is NULL for an automatic registration.
+int RegisterVolume(Registrations& registrations, ImageType* image, zf::Matrix4x4& imageTransform,
+                   const std::string& zframeConfig, float frameTopologyArr[6][3], float zFrameFidsArr[9][2],
+                   int range[2], float Zposition[3], float Zorientation[4])
+{
+    ImageType::SizeType dimensions = image->GetLargestPossibleRegion().GetSize();
+    int dim[3];
+    dim[0] = dimensions[0];
+    dim[1] = dimensions[1];
+    dim[2] = dimensions[2];
+    bool manualRegistration = zFrameFidsArr != NULL;
 
     // Toggle registration algorithm based on zframe configuration (currently, only z001 [7 fid], z002 [9 fid], z003 [9fid], and z004 [7fid])
-    if (zframeConfig == "z001" || zframeConfig == "z004" || zframeConfig == "z005")
+    if (NumberOfFiducials(zframeConfig) == 7)
     {
         // Zframe z001 is a 7-fiducial frame; run the 7-fiducial registration [Namespace zf_7fid]
         // Zframe z004 is a 7-fiducial frame; run the 7-fiducial registration [Namespace zf_7fid]
-        zf_7fid::Registration * registration;
-        registration = new zf_7fid::Registration();
-        
+        zf_7fid::Registration * registration = &registrations.sevenFiducials;
+
         registration->SetInputImage(image->GetBufferPointer(), dim, imageTransform);
-        registration->SetOrientationBase(ZquaternionBase);
         registration->SetFrameTopology(frameTopologyArr);
         if (manualRegistration) { registration->SetManualZFrameFiducials(zFrameFidsArr, manualRegistration); }
         else { registration->SetAutomaticRegistration(manualRegistration); }
-        r = registration->Register(range, Zposition, Zorientation);
-        
-        delete registration;
-        cout << r << endl;
+        return registration->Register(range, Zposition, Zorientation);
     }
-    else if (zframeConfig == "z002" || zframeConfig == "z003")
+    else if (NumberOfFiducials(zframeConfig) == 9)
     {
         // Zframe z002 is a 9-fiducial frame with the base Z on the top; run the 9-fiducial registration with baseLocation "top" [Namespace zf_9fid]
         // Zframe z003 is a 9-fiducial frame with the base Z on the bottom; run the 9-fiducial registration with baseLocation "bottom" [Namespace zf_9fid]
-        zf_9fid::Registration * registration;
-        registration = new zf_9fid::Registration();
+        zf_9fid::Registration * registration = &registrations.nineFiducials;
 
         if (zframeConfig == "z002") { registration->SetBaseLocation("top"); }
         else if (zframeConfig == "z003") { registration->SetBaseLocation("bottom"); }
         registration->SetInputImage(image->GetBufferPointer(), dim, imageTransform);
-        registration->SetOrientationBase(ZquaternionBase);
         registration->SetFrameTopology(frameTopologyArr);
         if (manualRegistration) { registration->SetManualZFrameFiducials(zFrameFidsArr, manualRegistration); }
         else { registration->SetAutomaticRegistration(manualRegistration); }
-        r = registration->Register(range, Zposition, Zorientation);
-        
-        delete registration;
-        cout << r << endl;
+        return registration->Register(range, Zposition, Zorientation);
     }
-    else
+    return -1;
+}
+
+// Print the RAS transform of the z-frame and write it in LPS if a file name is given
+bool WriteTransform(float Zposition[3], float Zorientation[4], const std::string& outputTransform)
+{
+    HomogeneousMatrixType lps2RasTransformMatrix = LPSToRASMatrix();
+
+    // Convert quaternion to matrix
+    zf::Matrix4x4 matrix;
+    zf::QuaternionToMatrix(Zorientation, matrix);
+
+    HomogeneousMatrixType zMatrix;
+    zMatrix.SetIdentity();
+    zMatrix[0][0] = matrix[0][0];
+    zMatrix[1][0] = matrix[1][0];
+    zMatrix[2][0] = matrix[2][0];
+    zMatrix[0][1] = matrix[0][1];
+    zMatrix[1][1] = matrix[1][1];
+    zMatrix[2][1] = matrix[2][1];
+    zMatrix[0][2] = matrix[0][2];
+    zMatrix[1][2] = matrix[1][2];
+    zMatrix[2][2] = matrix[2][2];
+    zMatrix[0][3] = Zposition[0];
+    zMatrix[1][3] = Zposition[1];
+    zMatrix[2][3] = Zposition[2];
+
+    cout << "RAS Transformation Matrix:" << endl;
+    cout << zMatrix << endl;
+
+    zMatrix = zMatrix * lps2RasTransformMatrix;
+    zMatrix = (HomogeneousMatrixType)zMatrix.GetInverse() * lps2RasTransformMatrix;
+
+
+    typedef itk::Matrix<double, 3, 3> TransformMatrixType;
+    TransformMatrixType lpsTransformMatrix;
+    lpsTransformMatrix.SetIdentity();
+    lpsTransformMatrix[0][0] = zMatrix[0][0];
+    lpsTransformMatrix[1][0] = zMatrix[1][0];
+    lpsTransformMatrix[2][0] = zMatrix[2][0];
+    lpsTransformMatrix[0][1] = zMatrix[0][1];
+    lpsTransformMatrix[1][1] = zMatrix[1][1];
+    lpsTransformMatrix[2][1] = zMatrix[2][1];
+    lpsTransformMatrix[0][2] = zMatrix[0][2];
+    lpsTransformMatrix[1][2] = zMatrix[1][2];
+    lpsTransformMatrix[2][2] = zMatrix[2][2];
+
+    typedef itk::AffineTransform<double> RegistrationTransformType;
+    RegistrationTransformType::OutputVectorType translation;
+    translation[0] = zMatrix[0][3];
+    translation[1] = zMatrix[1][3];
+    translation[2] = zMatrix[2][3];
+
+    typedef itk::AffineTransform<double, 3> TransformType;
+    TransformType::Pointer transform = TransformType::New();
+    transform->SetMatrix(lpsTransformMatrix);
+    transform->SetTranslation(translation);
+
+    if (outputTransform != "")
     {
-        std::cout << "Invalid z-frame configuration. Cannot run registration algorithm." << std::endl;
-        return EXIT_FAILURE ;
+        itk::TransformFileWriter::Pointer markerTransformWriter = itk::TransformFileWriter::New();
+        markerTransformWriter->SetInput(transform);
+        markerTransformWriter->SetFileName(outputTransform.c_str());
+        try
+        {
+            markerTransformWriter->Update();
+        }
+        catch (itk::ExceptionObject &err)
+        {
+            std::cerr << err << std::endl;
+            return false;
+        }
+
     }
-    
-    //registration->SetInputImage(image->GetBufferPointer(), dim, imageTransform);
-    //registration->SetOrientationBase(ZquaternionBase);
-    // int r = registration->Register(range, Zposition, Zorientation);
-    
-    // delete registration;
-    
-    // cout << r << endl;
-    
-    if (r)
+    return true;
+}
+
+// Read a batch manifest: one case per line, "volume, startSlice, endSlice[, zframeConfig[, outputTransform]]".
+// Empty lines and lines starting with '#' are skipped.
+bool ReadManifest(const std::string& fileName, const std::string& defaultConfig, std::vector<BatchCase>& cases)
+{
+    std::ifstream manifest(fileName.c_str());
+    if (!manifest)
+    {
+        std::cerr << "Cannot read the batch manifest " << fileName << std::endl;
+        return false;
+    }
+
+    std::string line;
+    for (int lineNumber = 1; std::getline(manifest, line); lineNumber++)
     {
-        // Convert quaternion to matrix
-        zf::Matrix4x4 matrix;
-        zf::QuaternionToMatrix(Zorientation, matrix);
-
-        MatrixType zMatrix;
-        zMatrix.SetIdentity();
-        zMatrix[0][0] = matrix[0][0];
-        zMatrix[1][0] = matrix[1][0];
-        zMatrix[2][0] = matrix[2][0];
-        zMatrix[0][1] = matrix[0][1];
-        zMatrix[1][1] = matrix[1][1];
-        zMatrix[2][1] = matrix[2][1];
-        zMatrix[0][2] = matrix[0][2];
-        zMatrix[1][2] = matrix[1][2];
-        zMatrix[2][2] = matrix[2][2];
-        zMatrix[0][3] = Zposition[0];
-        zMatrix[1][3] = Zposition[1];
-        zMatrix[2][3] = Zposition[2];
-
-        cout << "RAS Transformation Matrix:" << endl;
-        cout << zMatrix << endl;
-        
-        zMatrix = zMatrix * lps2RasTransformMatrix;
-        zMatrix = (MatrixType)zMatrix.GetInverse() * lps2RasTransformMatrix;
-
-        
-        typedef itk::Matrix<double, 3, 3> TransformMatrixType;
-        TransformMatrixType lpsTransformMatrix;
-        lpsTransformMatrix.SetIdentity();
-        lpsTransformMatrix[0][0] = zMatrix[0][0];
-        lpsTransformMatrix[1][0] = zMatrix[1][0];
-        lpsTransformMatrix[2][0] = zMatrix[2][0];
-        lpsTransformMatrix[0][1] = zMatrix[0][1];
-        lpsTransformMatrix[1][1] = zMatrix[1][1];
-        lpsTransformMatrix[2][1] = zMatrix[2][1];
-        lpsTransformMatrix[0][2] = zMatrix[0][2];
-        lpsTransformMatrix[1][2] = zMatrix[1][2];
-        lpsTransformMatrix[2][2] = zMatrix[2][2];
-        
-        typedef itk::AffineTransform<double> RegistrationTransformType;
-        RegistrationTransformType::OutputVectorType translation;
-        translation[0] = zMatrix[0][3];
-        translation[1] = zMatrix[1][3];
-        translation[2] = zMatrix[2][3];
-        
-        typedef itk::AffineTransform<double, 3> TransformType;
-        TransformType::Pointer transform = TransformType::New();
-        transform->SetMatrix(lpsTransformMatrix);
-        transform->SetTranslation(translation);
-        
-        if (outputTransform != "")
+        line = Trim(line);
+        if (line.empty() || line[0] == '#') { continue; }
+
+        std::vector<std::string> fields;
+        std::stringstream stream(line);
+        std::string field;
+        while (std::getline(stream, field, ',')) { fields.push_back(Trim(field)); }
+        if (fields.size() < 3)
+        {
+            std::cerr << fileName << ":" << lineNumber << ": expected volume, startSlice, endSlice" << std::endl;
+            return false;
+        }
+
+        BatchCase batchCase;
+        batchCase.volume = fields[0];
+        try
+        {
+            batchCase.range[0] = std::stoi(fields[1]);
+            batchCase.range[1] = std::stoi(fields[2]);
+        }
+        catch (std::exception&)
+        {
+            std::cerr << fileName << ":" << lineNumber << ": invalid slice range" << std::endl;
+            return false;
+        }
+        batchCase.zframeConfig = fields.size() > 3 && !fields[3].empty() ? fields[3] : defaultConfig;
+        batchCase.outputTransform = fields.size() > 4 ? fields[4] : "";
+        cases.push_back(batchCase);
+    }
+    return true;
+}
+
+// Read the topologies of a configs.txt file ("name:topology" per line)
+std::map<std::string, std::string> ReadConfigs(const std::string& fileName)
+{
+    std::map<std::string, std::string> configs;
+    std::ifstream file(fileName.c_str());
+    std::string line;
+    while (std::getline(file, line))
+    {
+        size_t pos = line.find(":");
+        if (pos != std::string::npos) { configs[Trim(line.substr(0, pos))] = Trim(line.substr(pos + 1)); }
+    }
+    return configs;
+}
+
+LoadedVolume LoadVolume(const std::string& fileName)
+{
+    LoadedVolume volume;
+    std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+    try
+    {
+        volume.image = ReadVolume(fileName, volume.transform);
+    }
+    catch (itk::ExceptionObject &err)
+    {
+        volume.error = std::string("cannot read the volume: ") + err.GetDescription();
+    }
+    catch (std::exception &err)
+    {
+        volume.error = std::string("cannot read the volume: ") + err.what();
+    }
+    volume.seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+    return volume;
+}
+
+// Register all the cases of a manifest with the same registration objects. The next volume is read while the
+// current one is registered, and the slices of each volume are registered concurrently. The transforms are
+// written to outputDirectory along with summary.csv, which lists the result and the timing of every case.
+int RunBatch(Registrations& registrations, const std::string& manifest, const std::string& configsFile,
+             const std::string& defaultConfig, const std::string& defaultTopology, const std::string& outputDirectory)
+{
+    std::vector<BatchCase> cases;
+    if (!ReadManifest(manifest, defaultConfig, cases)) { return EXIT_FAILURE; }
+
+    std::map<std::string, std::string> configs;
+    if (configsFile != "") { configs = ReadConfigs(configsFile); }
+
+    itksys::SystemTools::MakeDirectory(outputDirectory.c_str());
+    std::string summaryFileName = outputDirectory + "/summary.csv";
+    std::ofstream summary(summaryFileName.c_str());
+    summary << "volume,zframeConfig,startSlice,endSlice,success,readSeconds,registrationSeconds,"
+            << "x,y,z,qx,qy,qz,qw,outputTransform,error" << std::endl;
+
+    std::chrono::steady_clock::time_point batchStart = std::chrono::steady_clock::now();
+    double readSeconds = 0.0;
+    double registrationSeconds = 0.0;
+    int succeeded = 0;
+
+    std::future<LoadedVolume> next;
+    if (!cases.empty()) { next = std::async(std::launch::async, LoadVolume, cases[0].volume); }
+
+    for (size_t i = 0; i < cases.size(); i++)
+    {
+        BatchCase& batchCase = cases[i];
+        LoadedVolume volume = next.get();
+        if (i + 1 < cases.size()) { next = std::async(std::launch::async, LoadVolume, cases[i + 1].volume); }
+        readSeconds += volume.seconds;
+
+        std::cout << "=== Case " << i + 1 << "/" << cases.size() << ": " << batchCase.volume << " ===" << std::endl;
+
+        std::string outputTransform = batchCase.outputTransform;
+        if (outputTransform == "")
+        {
+            std::stringstream name;
+            name << outputDirectory << "/" << itksys::SystemTools::GetFilenameWithoutExtension(batchCase.volume)
+                 << "_" << batchCase.zframeConfig << "_" << batchCase.range[0] << "-" << batchCase.range[1] << ".txt";
+            outputTransform = name.str();
+        }
+
+        std::string error = volume.error;
+        std::string frameTopology = defaultTopology;
+        if (configs.count(batchCase.zframeConfig)) { frameTopology = configs[batchCase.zframeConfig]; }
+        else if (error == "" && batchCase.zframeConfig != defaultConfig)
+        {
+            error = "no topology for configuration " + batchCase.zframeConfig;
+        }
+
+        float Zposition[3] = {0.0, 0.0, 0.0};
+        float Zorientation[4] = {0.0, 0.0, 0.0, 1.0};
+        int r = 0;
+        double seconds = 0.0;
+        float frameTopologyArr[6][3];
+        if (error == "")
         {
-            itk::TransformFileWriter::Pointer markerTransformWriter = itk::TransformFileWriter::New();
-            markerTransformWriter->SetInput(transform);
-            markerTransformWriter->SetFileName(outputTransform.c_str());
             try
             {
-                markerTransformWriter->Update();
+                ParseFrameTopology(frameTopology, frameTopologyArr);
             }
-            catch (itk::ExceptionObject &err)
+            catch (std::exception&)
             {
-                std::cerr << err << std::endl;
-                return EXIT_FAILURE ;
+                error = "invalid frame topology for configuration " + batchCase.zframeConfig;
             }
-            
         }
+
+        if (error == "")
+        {
+            // An exception thrown by a registration thread fails this case only
+            std::chrono::steady_clock::time_point start = std::chrono::steady_clock::now();
+            try
+            {
+                r = RegisterVolume(registrations, volume.image, volume.transform, batchCase.zframeConfig,
+                                   frameTopologyArr, NULL, batchCase.range, Zposition, Zorientation);
+                if (r < 0) { error = "invalid z-frame configuration " + batchCase.zframeConfig; }
+                else if (r == 0) { error = "registration failed"; }
+                else if (!WriteTransform(Zposition, Zorientation, outputTransform)) { error = "cannot write the transform"; }
+            }
+            catch (std::exception& e)
+            {
+                error = std::string("registration error: ") + e.what();
+            }
+            seconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - start).count();
+            registrationSeconds += seconds;
+        }
+
+        bool success = error == "";
+        succeeded += success ? 1 : 0;
+        if (!success) { std::cerr << batchCase.volume << ": " << error << std::endl; }
+
+        summary << batchCase.volume << "," << batchCase.zframeConfig << "," << batchCase.range[0] << ","
+                << batchCase.range[1] << "," << (success ? 1 : 0) << "," << volume.seconds << "," << seconds;
+        for (int k = 0; k < 3; k++) { summary << "," << (success ? Zposition[k] : 0.0); }
+        for (int k = 0; k < 4; k++) { summary << "," << (success ? Zorientation[k] : 0.0); }
+        summary << "," << (success ? outputTransform : "") << "," << error << std::endl;
     }
-    
+
+    double totalSeconds = std::chrono::duration<double>(std::chrono::steady_clock::now() - batchStart).count();
+    std::cout << "=== Batch: " << succeeded << "/" << cases.size() << " cases registered in " << totalSeconds
+              << " s (reading " << readSeconds << " s, registration " << registrationSeconds << " s, "
+              << (cases.empty() ? 0.0 : registrationSeconds / cases.size()) << " s per case) ===" << std::endl;
+    std::cout << "Summary: " << summaryFileName << std::endl;
+    return EXIT_SUCCESS;
+}
+
+}
+
+int main( int argc, char * argv[] )
+{
+    PARSE_ARGS;
+
+    HomogeneousMatrixType ZFrameBaseOrientation;
+    ZFrameBaseOrientation.SetIdentity();
+
+    // ZFrame base orientation
+    zf::Matrix4x4 ZmatrixBase;
+    ZmatrixBase[0][0] = (float) ZFrameBaseOrientation[0][0];
+    ZmatrixBase[1][0] = (float) ZFrameBaseOrientation[1][0];
+    ZmatrixBase[2][0] = (float) ZFrameBaseOrientation[2][0];
+    ZmatrixBase[0][1] = (float) ZFrameBaseOrientation[0][1];
+    ZmatrixBase[1][1] = (float) ZFrameBaseOrientation[1][1];
+    ZmatrixBase[2][1] = (float) ZFrameBaseOrientation[2][1];
+    ZmatrixBase[0][2] = (float) ZFrameBaseOrientation[0][2];
+    ZmatrixBase[1][2] = (float) ZFrameBaseOrientation[1][2];
+    ZmatrixBase[2][2] = (float) ZFrameBaseOrientation[2][2];
+    ZmatrixBase[0][3] = (float) ZFrameBaseOrientation[0][3];
+    ZmatrixBase[1][3] = (float) ZFrameBaseOrientation[1][3];
+    ZmatrixBase[2][3] = (float) ZFrameBaseOrientation[2][3];
+
+    // Convert Base Matrix to quaternion
+    float ZquaternionBase[4];
+    zf::MatrixToQuaternion(ZmatrixBase, ZquaternionBase);
+
+    int backend = (fftBackend == "newmat") ? zf::FFT_NEWMAT : zf::FFT_REAL;
+
+    Registrations registrations;
+    registrations.sevenFiducials.SetOrientationBase(ZquaternionBase);
+    registrations.sevenFiducials.SetNumberOfThreads(numberOfThreads);
+    registrations.sevenFiducials.SetFFTBackend(backend);
+    registrations.nineFiducials.SetOrientationBase(ZquaternionBase);
+    registrations.nineFiducials.SetNumberOfThreads(numberOfThreads);
+    registrations.nineFiducials.SetFFTBackend(backend);
+
+    // In batch mode, the cases of the manifest are registered instead of the input volume
+    if (!batchManifest.empty())
+    {
+        return RunBatch(registrations, batchManifest, batchConfigs, zframeConfig, frameTopology, batchOutputDirectory);
+    }
+
+    zf::Matrix4x4 imageTransform;
+    ImageType::Pointer image = ReadVolume(inputVolume, imageTransform);
+
+    // Set slice range
+    int range[2];
+    range[0] = startSlice;
+    range[1] = endSlice;
+
+    float Zposition[3];
+    float Zorientation[4];
+
+    // std::cout << "zframeConfig: " << zframeConfig << std::endl;
+    // std::cout << "Frame topology: " << frameTopology << std::endl;
+    // std::cout << "zFrameFids: " << zFrameFids << std::endl;
+
+    float frameTopologyArr[6][3];
+    ParseFrameTopology(frameTopology, frameTopologyArr);
+
+    // If zFrameFidsString is not empty, then the user manually selected points to use in registration.
+    float zFrameFidsArr[9][2];
+    bool manualRegistration = false;
+    if (zFrameFids.length() > 1)
+    {
+        manualRegistration = true;
+        ParseFiducials(zFrameFids, NumberOfFiducials(zframeConfig), zFrameFidsArr);
+    }
+
+    int r = RegisterVolume(registrations, image, imageTransform, zframeConfig, frameTopologyArr,
+                           manualRegistration ? zFrameFidsArr : NULL, range, Zposition, Zorientation);
+    if (r < 0)
+    {
+        std::cout << "Invalid z-frame configuration. Cannot run registration algorithm." << std::endl;
+        return EXIT_FAILURE ;
+    }
+    cout << r << endl;
+
+    if (r)
+    {
+        if (!WriteTransform(Zposition, Zorientation, outputTransform))
+        {
+            return EXIT_FAILURE ;
+        }
+    }
+
     return EXIT_SUCCESS;
 }
@@ -37,10 +37,14 @@ void Throw()
 #endif                                 // end of simulate exceptions
 
 
-unsigned long BaseException::Select;
-char* BaseException::what_error;
-int BaseException::SoFar;
-int BaseException::LastOne;
+thread_local unsigned long BaseException::Select;
+thread_local char* BaseException::what_error;
+thread_local int BaseException::SoFar;
+thread_local int BaseException::LastOne;
+
+// Exceptions may be thrown by several registration threads at once, so
+// each thread writes its messages to its own buffer
+static thread_local char what_error_buffer[512];
 
 BaseException::BaseException(const char* a_what)
 {
@@ -48,12 +52,7 @@ BaseException::BaseException(const char* a_what)
    if (!what_error)                   // make space for exception message
    {
       LastOne = 511;
-      what_error = new char[512];
-      if (!what_error)                // fail to make space
-      {
-         LastOne = 0;
-         what_error = (char *)"No heap space for exception message\n";
-      }
+      what_error = what_error_buffer;
    }
    AddMessage("\n\nAn exception has been thrown\n");
    AddMessage(a_what);
@@ -210,7 +209,7 @@ JanitorInitializer::JanitorInitializer()
 
 #endif                              // end of SimulateExceptions
 
-Tracer* Tracer::last;               // will be set to zero
+thread_local Tracer* Tracer::last;  // will be set to zero
 
 
 void Terminate()
@@ -465,17 +464,17 @@ Bad_alloc::Bad_alloc(const char* a_what) : BaseException()
 
 
 
-unsigned long Logic_error::Select;
-unsigned long Runtime_error::Select;
-unsigned long Domain_error::Select;
-unsigned long Invalid_argument::Select;
-unsigned long Length_error::Select;
-unsigned long Out_of_range::Select;
+thread_local unsigned long Logic_error::Select;
+thread_local unsigned long Runtime_error::Select;
+thread_local unsigned long Domain_error::Select;
+thread_local unsigned long Invalid_argument::Select;
+thread_local unsigned long Length_error::Select;
+thread_local unsigned long Out_of_range::Select;
 //unsigned long Bad_cast::Select;
 //unsigned long Bad_typeid::Select;
-unsigned long Range_error::Select;
-unsigned long Overflow_error::Select;
-unsigned long Bad_alloc::Select;
+thread_local unsigned long Range_error::Select;
+thread_local unsigned long Overflow_error::Select;
+thread_local unsigned long Bad_alloc::Select;
 
 #ifdef use_namespace
 }
@@ -63,7 +63,7 @@ public:
    void ReName(const char*);
    static void PrintTrace();             // for printing trace
    static void AddTrace();               // insert trace in exception record
-   static Tracer* last;                  // points to Tracer list
+   static thread_local Tracer* last;     // points to Tracer list (one per thread)
    friend class BaseException;
 };
 
@@ -71,14 +71,14 @@ public:
 class BaseException                          // The base exception class
 {
 protected:
-   static char* what_error;              // error message
-   static int SoFar;                     // no. characters already entered
-   static int LastOne;                   // last location in error buffer
+   static thread_local char* what_error; // error message (one per thread)
+   static thread_local int SoFar;        // no. characters already entered
+   static thread_local int LastOne;      // last location in error buffer
 public:
    static void AddMessage(const char* a_what);
                                          // messages about exception
    static void AddInt(int value);        // integer to error message
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    BaseException(const char* a_what = 0);
    static const char* what() { return what_error; }
                                          // for getting error message
@@ -347,42 +347,42 @@ public:                                                                    \
 class Logic_error : public BaseException
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Logic_error(const char* a_what = 0);
 };
 
 class Runtime_error : public BaseException
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Runtime_error(const char* a_what = 0);
 };
 
 class Domain_error : public Logic_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Domain_error(const char* a_what = 0);
 };
 
 class Invalid_argument : public Logic_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Invalid_argument(const char* a_what = 0);
 };
 
 class Length_error : public Logic_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Length_error(const char* a_what = 0);
 };
 
 class Out_of_range : public Logic_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Out_of_range(const char* a_what = 0);
 };
 
@@ -403,21 +403,21 @@ public:
 class Range_error : public Runtime_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Range_error(const char* a_what = 0);
 };
 
 class Overflow_error : public Runtime_error
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Overflow_error(const char* a_what = 0);
 };
 
 class Bad_alloc : public BaseException
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    Bad_alloc(const char* a_what = 0);
 };
 
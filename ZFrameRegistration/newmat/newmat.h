@@ -1832,14 +1832,14 @@ public:
 class NPDException : public Runtime_error     // Not positive definite
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    NPDException(const GeneralMatrix&);
 };
 
 class ConvergenceException : public Runtime_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    ConvergenceException(const GeneralMatrix& A);
    ConvergenceException(const char* c);
 };
@@ -1847,14 +1847,14 @@ public:
 class SingularException : public Runtime_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    SingularException(const GeneralMatrix& A);
 };
 
 class OverflowException : public Runtime_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    OverflowException(const char* c);
 };
 
@@ -1863,7 +1863,7 @@ class ProgramException : public Logic_error
 protected:
    ProgramException();
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    ProgramException(const char* c);
    ProgramException(const char* c, const GeneralMatrix&);
    ProgramException(const char* c, const GeneralMatrix&, const GeneralMatrix&);
@@ -1873,7 +1873,7 @@ public:
 class IndexException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    IndexException(int ii, const GeneralMatrix& A);
    IndexException(int ii, int jj, const GeneralMatrix& A);
    // next two are for access via element function
@@ -1884,7 +1884,7 @@ public:
 class VectorException : public Logic_error    // cannot convert to vector
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    VectorException();
    VectorException(const GeneralMatrix& A);
 };
@@ -1892,7 +1892,7 @@ public:
 class NotSquareException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    NotSquareException(const GeneralMatrix& A);
    NotSquareException();
 };
@@ -1900,14 +1900,14 @@ public:
 class SubMatrixDimensionException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    SubMatrixDimensionException();
 };
 
 class IncompatibleDimensionsException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    IncompatibleDimensionsException();
    IncompatibleDimensionsException(const GeneralMatrix&);
    IncompatibleDimensionsException(const GeneralMatrix&, const GeneralMatrix&);
@@ -1916,14 +1916,14 @@ public:
 class NotDefinedException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    NotDefinedException(const char* op, const char* matrix);
 };
 
 class CannotBuildException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    CannotBuildException(const char* matrix);
 };
 
@@ -1931,7 +1931,7 @@ public:
 class InternalException : public Logic_error
 {
 public:
-   static unsigned long Select;          // for identifying exception
+   static thread_local unsigned long Select;          // for identifying exception
    InternalException(const char* c);
 };
 
@@ -11,19 +11,19 @@
 namespace NEWMAT {
 #endif
 
-unsigned long OverflowException::Select;
-unsigned long SingularException::Select;
-unsigned long NPDException::Select;
-unsigned long ConvergenceException::Select;
-unsigned long ProgramException::Select;
-unsigned long IndexException::Select;
-unsigned long VectorException::Select;
-unsigned long NotSquareException::Select;
-unsigned long SubMatrixDimensionException::Select;
-unsigned long IncompatibleDimensionsException::Select;
-unsigned long NotDefinedException::Select;
-unsigned long CannotBuildException::Select;
-unsigned long InternalException::Select;
+thread_local unsigned long OverflowException::Select;
+thread_local unsigned long SingularException::Select;
+thread_local unsigned long NPDException::Select;
+thread_local unsigned long ConvergenceException::Select;
+thread_local unsigned long ProgramException::Select;
+thread_local unsigned long IndexException::Select;
+thread_local unsigned long VectorException::Select;
+thread_local unsigned long NotSquareException::Select;
+thread_local unsigned long SubMatrixDimensionException::Select;
+thread_local unsigned long IncompatibleDimensionsException::Select;
+thread_local unsigned long NotDefinedException::Select;
+thread_local unsigned long CannotBuildException::Select;
+thread_local unsigned long InternalException::Select;
 
 
 
@@ -30,7 +30,7 @@ R1_R1::operator Real()
    return y;
 }
 
-unsigned long SolutionException::Select;
+thread_local unsigned long SolutionException::Select;
 
 SolutionException::SolutionException(const char* a_what) : BaseException()
 {
@@ -44,7 +44,7 @@ public:
 class SolutionException : public BaseException
 {
 public:
-   static unsigned long Select;
+   static thread_local unsigned long Select;
    SolutionException(const char* a_what = 0);
 };
 
@@ -0,0 +1,145 @@
+import functools
+import queue
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from ZFrame.Topology import FrameTopology, registry as topologyRegistry
+from ZFrame.GlobalFit import SOLVER_CLOSED_FORM
+from ZFrame.Registration import ZFrameRegistration
+from ZFrame.VolumeReader import ReadVolume
+
+# One registration job. volume is a numpy array indexed [i, j, k], a callable returning one, so that
+# volumes are only loaded when the batch gets to them, or the path of a NRRD/NIfTI file read with
+# ZFrame.VolumeReader; affine is the 4x4 IJK to RAS matrix (None to take it from the file); topology is a
+# FrameTopology, a configuration name (e.g. 'z001') or a topology string; sliceRange is [start, end).
+BatchJob = namedtuple('BatchJob', ['volume', 'affine', 'topology', 'sliceRange'])
+
+# Result of one job, in job order. error is None on success or the exception message; sliceResults holds the
+# per-slice results of the registration (see ZFrame.Results), or None if it did not run.
+BatchResult = namedtuple('BatchResult', ['index', 'success', 'position', 'orientation', 'matchScores', 'error',
+                                         'seconds', 'sliceResults'], defaults=(None,))
+
+_END = object()
+
+
+def RegisterBatch(jobs, maxVolumesInMemory=2, solver=SOLVER_CLOSED_FORM, orientationBase=(0.0, 0.0, 0.0, 1.0),
+                  verbose=False, progress=None, cancel=None):
+    """Register a series of Z-frame volumes, yielding each result as soon as its job completes.
+
+    All jobs of the batch run in one process and share warm state: one ZFrameRegistration per fiducial
+    count, the mask spectra of each image size (ZFrame.Detection.MaskSpectrum), the FFT plans kept by
+    scipy.fft, and the parsed topologies of the shared registry. Volumes given as callables are loaded by a
+    background thread, at most maxVolumesInMemory of them ahead of the job being registered.
+
+    Args:
+        jobs (iterable): BatchJob or (volume, affine, topology, sliceRange) tuples
+        maxVolumesInMemory (int): number of loaded volumes waiting to be registered, at least 1
+        solver (str): solver of the registrations (see ZFrameRegistration.SetSolver)
+        orientationBase (list): [x, y, z, w] base orientation quaternion
+        verbose (bool): print the per-slice progress of the registrations (see ZFrameRegistration.SetVerbose);
+            only the registrations of the batch are silenced, not the standard output of the process
+        progress (callable): called with the job index and a ZFrame.Results.SliceProgress after each slice of
+            each registration, or None
+        cancel (threading.Event): stops the batch when set, or None. The registration running is abandoned
+            between two slices and reported as cancelled; the remaining jobs are not run.
+
+    Yields:
+        BatchResult: one result per job, in job order
+    """
+    registrations = {}
+    loaded = queue.Queue(maxsize=max(1, int(maxVolumesInMemory)))
+    stop = threading.Event()
+    loaderErrors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                loaded.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def load():
+        try:
+            for index, job in enumerate(jobs):
+                job = BatchJob(*job)
+                try:
+                    if isinstance(job.volume, str):
+                        # Only the slices of the job are read from the file
+                        volume, affine = ReadVolume(job.volume, job.sliceRange)
+                        job = job._replace(affine=affine if job.affine is None else job.affine)
+                    else:
+                        volume = job.volume() if callable(job.volume) else job.volume
+                    item = (index, job, np.asarray(volume), None)
+                except Exception as e:
+                    item = (index, job, None, f"Could not load the volume: {e}")
+                if not put(item):
+                    return
+        except Exception as e:
+            # Raised by the job iterable itself; reported to the caller once the loaded jobs are done
+            loaderErrors.append(e)
+        put(_END)
+
+    loader = threading.Thread(target=load, name="ZFrameBatchLoader", daemon=True)
+    loader.start()
+    try:
+        while True:
+            item = loaded.get()
+            if item is _END:
+                if loaderErrors:
+                    raise loaderErrors[0]
+                break
+            index, job, volume, error = item
+            if cancel is not None and cancel.is_set():
+                break
+            startTime = time.perf_counter()
+            if error is not None:
+                yield BatchResult(index, False, None, None, {}, error, 0.0)
+                continue
+            try:
+                topology = ResolveTopology(job.topology)
+                registration = registrations.get(topology.numFiducials)
+                if registration is None:
+                    registration = registrations[topology.numFiducials] = ZFrameRegistration(topology.numFiducials)
+                registration.SetInputImage(volume, np.asarray(job.affine, dtype=float))
+                registration.SetOrientationBase(list(orientationBase))
+                registration.SetFrameTopology(topology)
+                registration.SetSolver(solver)
+                registration.SetVerbose(verbose)
+                del volume
+                sliceProgress = None if progress is None else functools.partial(progress, index)
+                result = registration.Register(list(job.sliceRange), sliceProgress, cancel)
+                # Release the image before waiting for the next volume
+                registration.InputImage = None
+                if registration.cancelled:
+                    yield BatchResult(index, False, None, None, dict(registration.matchScores),
+                                      "Registration cancelled", time.perf_counter() - startTime,
+                                      registration.sliceResults)
+                    break
+                if not isinstance(result, tuple) or not result[0]:
+                    yield BatchResult(index, False, None, None, dict(registration.matchScores),
+                                      "Registration failed", time.perf_counter() - startTime,
+                                      registration.sliceResults)
+                    continue
+                yield BatchResult(index, True, np.array(result[1]), np.array(result[2]),
+                                  dict(registration.matchScores), None, time.perf_counter() - startTime,
+                                  registration.sliceResults)
+            except Exception as e:
+                yield BatchResult(index, False, None, None, {}, str(e), time.perf_counter() - startTime)
+    finally:
+        stop.set()
+
+
+def ResolveTopology(topology):
+    """Return the shared FrameTopology for a FrameTopology, a configuration name or a topology string."""
+    if isinstance(topology, FrameTopology):
+        return topology
+    if isinstance(topology, str):
+        configs = topologyRegistry.LoadConfigs()
+        if topology.strip() in configs:
+            return configs[topology.strip()]
+    return topologyRegistry.GetTopology(topology)
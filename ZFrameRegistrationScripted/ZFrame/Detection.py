@@ -0,0 +1,512 @@
+import functools
+import itertools
+import threading
+import numpy as np
+
+from ZFrame.GlobalFit import FiducialLines
+from ZFrame.Ordering import OrderFiducials
+
+MEPSILON = 1e-10
+
+# Number of candidate peaks extracted on top of the number of fiducials
+EXTRA_CANDIDATES = 4
+
+# Tolerances of the match score: relative offset of a fiducial from its edge, and relative error of the
+# distance between the two parallel fiducials of a side
+COLLINEARITY_TOLERANCE = 0.05
+SPACING_TOLERANCE = 0.2
+
+# Slices whose best labeling scores below this are rejected
+MIN_MATCH_SCORE = 0.05
+
+# Limits of CheckGeometry: angle in degrees between segments that are parallel in the frame, relative error of
+# their length ratio, and offset of the middle fiducial of a side from the line of the other two, relative to
+# their distance
+MAX_PARALLEL_ANGLE = 5.0
+MAX_SPACING_RATIO_ERROR = 0.1
+MAX_COLLINEARITY = 0.1
+
+# Subpixel refinement fits f = a + b*x + c*y + d*x^2 + e*x*y + f*y^2 to the (2*SUBPIXEL_RADIUS+1)^2
+# neighbourhood of a peak. The correlation peaks are flat-topped, so a 5x5 fit is much less noisy than 3x3.
+SUBPIXEL_RADIUS = 2
+_OFFSETS_X, _OFFSETS_Y = [o.ravel() for o in np.meshgrid(np.arange(-SUBPIXEL_RADIUS, SUBPIXEL_RADIUS + 1),
+                                                          np.arange(-SUBPIXEL_RADIUS, SUBPIXEL_RADIUS + 1),
+                                                          indexing='ij')]
+_QUADRATIC_FIT = np.linalg.pinv(np.stack([np.ones(_OFFSETS_X.shape), _OFFSETS_X, _OFFSETS_Y, _OFFSETS_X ** 2,
+                                          _OFFSETS_X * _OFFSETS_Y, _OFFSETS_Y ** 2], axis=1).astype(float))
+
+
+# 11x11 correlation kernel for fiducial detection
+CORRELATION_KERNEL = np.array([
+    [0.0, 0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 0.0, 0.0, 0.0, 0.0],
+    [0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0, 0.0],
+    [0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0],
+    [0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0],
+    [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
+    [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
+    [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
+    [0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0],
+    [0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0],
+    [0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0, 0.0],
+    [0.0, 0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 0.0, 0.0, 0.0, 0.0]
+])
+
+# Compute precisions: real and complex types of the images, spectra and correlation maps
+PRECISION_DOUBLE = 'double'
+PRECISION_SINGLE = 'single'
+PRECISION_TYPES = {
+    PRECISION_DOUBLE: (np.float64, np.complex128),
+    PRECISION_SINGLE: (np.float32, np.complex64),
+}
+
+# Mask spectra by image size and precision, shared by all registrations in this process
+_maskSpectra = {}
+_maskSpectraLock = threading.Lock()
+
+
+def MaskSpectrum(xsize, ysize, precision=PRECISION_DOUBLE):
+    """Return the correlation mask of an image size and its conjugated, normalized spectrum.
+
+    Only the non-negative frequencies of the last axis are kept (scipy.fft.rfft2), as the mask is real.
+    Spectra are computed once per image size and precision and shared; the returned arrays are read-only.
+
+    Args:
+        xsize (int): Width of the image
+        ysize (int): Height of the image
+        precision (str): PRECISION_DOUBLE or PRECISION_SINGLE
+
+    Returns:
+        tuple: (MaskImage, MaskSpectrum)
+    """
+    # scipy.fft is imported on first use to keep it out of the module import time
+    from scipy.fft import rfft2
+
+    realType, complexType = PRECISION_TYPES[precision]
+    key = (int(xsize), int(ysize), precision)
+    with _maskSpectraLock:
+        spectrum = _maskSpectra.get(key)
+    if spectrum is not None:
+        return spectrum
+
+    # Copy correlation kernel to center of mask image
+    MaskImage = np.zeros(key[:2], dtype=realType)
+    x_start = (xsize // 2) - 5
+    y_start = (ysize // 2) - 5
+    MaskImage[x_start:x_start+11, y_start:y_start+11] = CORRELATION_KERNEL
+
+    # Transform mask to frequency domain, conjugate and normalize
+    mask_fft = np.conj(rfft2(MaskImage))
+    mask_fft /= np.max(np.abs(mask_fft))
+
+    spectrum = (MaskImage, mask_fft.astype(complexType, copy=False))
+    for array in spectrum:
+        array.flags.writeable = False
+    with _maskSpectraLock:
+        _maskSpectra[key] = spectrum
+    return spectrum
+
+
+def CorrelationImage(SourceImage, maskSpectrum):
+    """Correlate an image with the fiducial mask in k-space.
+
+    The image is converted to the real type matching maskSpectrum, so a complex64 spectrum keeps the whole
+    computation in single precision.
+
+    Args:
+        SourceImage (numpy.ndarray): Input image matrix
+        maskSpectrum (numpy.ndarray): mask spectrum returned by MaskSpectrum for the image size
+
+    Returns:
+        numpy.ndarray: correlation image, centred (FFTSHIFT) and normalized to a maximum of 1,
+            or None if the image or the correlation is zero
+    """
+    from scipy.fft import rfft2, irfft2
+
+    realType = np.float32 if maskSpectrum.dtype == np.complex64 else np.float64
+    SourceImage = np.asarray(SourceImage, dtype=realType)
+
+    # Transform the MR image to frequency domain (k-space) and normalize it
+    image_fft = rfft2(SourceImage)
+    max_absolute = np.max(np.abs(image_fft))
+    if max_absolute < MEPSILON:
+        return None
+    image_fft /= max_absolute
+
+    # Pointwise multiply Image and Mask in k-space and invert the product back to spatial domain
+    image_fft *= maskSpectrum
+    PIreal = irfft2(image_fft, s=SourceImage.shape)
+
+    # FFTSHIFT: exchange diagonally-opposite image quadrants
+    PIreal = np.fft.fftshift(PIreal)
+
+    # Normalize result
+    max_absolute = np.max(np.abs(PIreal))
+    if max_absolute < MEPSILON:
+        return None
+    PIreal /= max_absolute
+    return PIreal
+
+
+def ClearMaskSpectra():
+    """Release the cached mask spectra."""
+    with _maskSpectraLock:
+        _maskSpectra.clear()
+
+
+def FindMax(matrix, margin=10):
+    """Find the maximum value in a matrix and its coordinates.
+
+    Searches for the maximum value while avoiding a margin around the edges to avoid image artifacts.
+    Ties resolve to the first position in row-major order.
+
+    Args:
+        matrix (numpy.ndarray): The input matrix
+        margin (int): Number of pixels ignored along each edge
+
+    Returns:
+        tuple: (max_value, [row, col]), or (0, [0, 0]) if no value in the searched region is positive
+    """
+    interior = matrix[margin:matrix.shape[0]-margin, margin:matrix.shape[1]-margin]
+    if interior.size == 0:
+        return 0, [0, 0]
+    index = int(np.argmax(interior))
+    row, col = divmod(index, interior.shape[1])
+    max_val = interior[row, col]
+    if not max_val > 0:
+        return 0, [0, 0]
+    return max_val, [row + margin, col + margin]
+
+
+def RefinePeaks(images, peaks, sliceIndices=None):
+    """Refine integer peak positions to subpixel accuracy, all peaks at once.
+
+    A 2-D quadratic is fitted by least squares to the neighbourhood of each peak and its maximum is taken as
+    the refined position. Peaks whose fit has no maximum within one pixel keep their integer position.
+
+    Args:
+        images (numpy.ndarray): (X, Y) image, or (S, X, Y) stack of images
+        peaks (numpy.ndarray): (K, 2) integer peak coordinates
+        sliceIndices (numpy.ndarray): (K,) index of the image of each peak when images is a stack
+
+    Returns:
+        tuple: (coordinates, refined) where:
+            - coordinates is a (K, 2) array of subpixel coordinates
+            - refined is a (K,) boolean array, False where the integer position was kept
+    """
+    images = np.asarray(images)
+    peaks = np.asarray(peaks, dtype=int).reshape(-1, 2)
+    rows = np.clip(peaks[:, 0, np.newaxis] + _OFFSETS_X, 0, images.shape[-2] - 1)
+    cols = np.clip(peaks[:, 1, np.newaxis] + _OFFSETS_Y, 0, images.shape[-1] - 1)
+    if images.ndim == 3:
+        samples = images[np.asarray(sliceIndices, dtype=int)[:, np.newaxis], rows, cols]
+    else:
+        samples = images[rows, cols]
+
+    _, b, c, d, e, f = (samples.astype(float) @ _QUADRATIC_FIT.T).T
+    det = 4.0 * d * f - e * e
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shifts = np.stack([(e * c - 2.0 * f * b) / det, (e * b - 2.0 * d * c) / det], axis=1)
+    refined = (d < 0) & (det > MEPSILON) & np.all(np.abs(shifts) <= 1.0, axis=1)
+    coordinates = peaks.astype(float)
+    coordinates[refined] += shifts[refined]
+    return coordinates, refined
+
+
+def ExtractPeaks(PIreal, maxPeaks, radius=10, minProminence=0.3, maxBadPeaks=10, verbose=True):
+    """Extract up to maxPeaks prominent peaks from a normalized correlation image, at integer positions.
+
+    Peaks are taken in order of decreasing value. The neighbourhood of every peak, good or bad, is cleared
+    before the next search, so a peak that fails the prominence test is skipped instead of found again.
+
+    Args:
+        PIreal (numpy.ndarray): correlation image normalized to a maximum of 1; modified in place
+        maxPeaks (int): maximum number of peaks to return
+        radius (int): half size of the neighbourhood used for the prominence test and cleared after each peak
+        minProminence (float): minimum relative drop from the peak to the corners of its neighbourhood
+        maxBadPeaks (int): search stops after this many peaks failed the prominence test
+        verbose (bool): print the peaks failing the prominence test
+
+    Returns:
+        tuple: (peaks, values, prominences) where:
+            - peaks is a (K, 2) integer array of the peak coordinates, K <= maxPeaks
+            - values is a (K,) array of the peak values
+            - prominences is a (K,) array of the smallest relative drop from each peak to its corners
+    """
+    xsize, ysize = PIreal.shape
+    peaks = []
+    values = []
+    prominences = []
+    bad_peaks = 0
+    while len(peaks) < maxPeaks:
+        peak_val, peak_coords = FindMax(PIreal)
+        if peak_val < MEPSILON:
+            break
+
+        # Define block neighborhood around peak
+        rstart = max(0, peak_coords[0] - radius)
+        rstop = min(xsize - 1, peak_coords[0] + radius)
+        cstart = max(0, peak_coords[1] - radius)
+        cstop = min(ysize - 1, peak_coords[1] + radius)
+
+        # Check peak prominence against the corners of the neighborhood
+        corners = PIreal[[rstart, rstart, rstop, rstop], [cstart, cstop, cstart, cstop]]
+        prominence = np.min((peak_val - corners) / peak_val)
+        if prominence < minProminence:
+            if verbose:
+                print("Registration::LocateFiducials - Bad Peak.")
+            bad_peaks += 1
+            PIreal[rstart:rstop+1, cstart:cstop+1] = 0.0
+            if bad_peaks > maxBadPeaks:
+                break
+            continue
+
+        peaks.append(peak_coords)
+        values.append(peak_val)
+        prominences.append(prominence)
+
+        # Zero out this peak region
+        PIreal[rstart:rstop+1, cstart:cstop+1] = 0.0
+
+    return (np.array(peaks, dtype=int).reshape(-1, 2), np.array(values, dtype=float),
+            np.array(prominences, dtype=float))
+
+
+def RefineCandidates(correlations, candidates, verbose=True):
+    """Refine the peaks extracted from several correlation images with a single RefinePeaks call.
+
+    Args:
+        correlations (list): correlation images of the same size, before ExtractPeaks cleared them
+        candidates (list): (peaks, values, prominences) returned by ExtractPeaks for each image
+        verbose (bool): print the number of peaks that could not be refined
+
+    Returns:
+        list: (coordinates, values, prominences) of each image, where coordinates is a (K, 2) array of subpixel
+            peak coordinates
+    """
+    if not candidates:
+        return []
+    counts = [len(peaks) for peaks, _, _ in candidates]
+    sliceIndices = np.repeat(np.arange(len(candidates)), counts)
+    coordinates, refined = RefinePeaks(np.stack(correlations), np.concatenate([peaks for peaks, _, _ in candidates]),
+                                       sliceIndices)
+    if verbose and not np.all(refined):
+        print(f"Registration::RefineCandidates - subpixel peak out of range ({np.count_nonzero(~refined)} peaks).")
+    coordinates = np.split(coordinates, np.cumsum(counts)[:-1])
+    return [(points, values, prominences) for points, (_, values, prominences) in zip(coordinates, candidates)]
+
+
+def FindPeaks(PIreal, maxPeaks, radius=10, minProminence=0.3, maxBadPeaks=10, verbose=True):
+    """Extract up to maxPeaks prominent peaks from a normalized correlation image, with subpixel positions.
+
+    The peaks are extracted with ExtractPeaks, then refined together with RefinePeaks.
+
+    Args:
+        PIreal (numpy.ndarray): correlation image normalized to a maximum of 1; modified in place
+        maxPeaks (int): maximum number of peaks to return
+        radius (int): half size of the neighbourhood used for the prominence test and cleared after each peak
+        minProminence (float): minimum relative drop from the peak to the corners of its neighbourhood
+        maxBadPeaks (int): search stops after this many peaks failed the prominence test
+        verbose (bool): print the peaks that fail the prominence test or the refinement
+
+    Returns:
+        tuple: (coordinates, values, prominences) where:
+            - coordinates is a (K, 2) array of subpixel peak coordinates, K <= maxPeaks
+            - values is a (K,) array of the peak values
+            - prominences is a (K,) array of the smallest relative drop from each peak to its corners
+    """
+    correlation = PIreal.copy()
+    candidates = ExtractPeaks(PIreal, maxPeaks, radius, minProminence, maxBadPeaks, verbose)
+
+    # Find subpixel coordinates of all peaks on the unmodified correlation image
+    return RefineCandidates([correlation], [candidates], verbose)[0]
+
+
+def ScoreLabelings(points, values, topology, spacing=None):
+    """Score ordered fiducial point sets against the expected cross-section of a frame.
+
+    The score is the mean peak value, attenuated by how far the in-between fiducials are from the line
+    joining their corners and, when the pixel spacing is known, by how far the distance between the two
+    parallel fiducials of each side is from the frame's parallel spacing.
+
+    Args:
+        points (numpy.ndarray): (..., N, 2) ordered fiducial coordinates in pixels
+        values (numpy.ndarray): (..., N) peak values
+        topology (FrameTopology): frame topology
+        spacing (list): [row, column] pixel spacing in mm, or None to skip the spacing term
+
+    Returns:
+        numpy.ndarray: (...) match scores between 0 and 1
+    """
+    layout = topology.layout
+    points = np.asarray(points, dtype=float)
+    corners = layout.cornerPositions
+
+    # Relative distance of every in-between fiducial from the edge joining its two corners
+    collinearity = np.zeros(points.shape[:-2])
+    for start, end in zip(corners[:-1], corners[1:]):
+        if end - start < 2:
+            continue
+        edge = points[..., end, :] - points[..., start, :]
+        length = np.linalg.norm(edge, axis=-1)
+        offsets = points[..., start+1:end, :] - points[..., start, np.newaxis, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.abs(edge[..., np.newaxis, 0] * offsets[..., 1] -
+                               edge[..., np.newaxis, 1] * offsets[..., 0]) / length[..., np.newaxis]
+            relative = np.max(distances, axis=-1) / length
+        collinearity = np.maximum(collinearity, np.where(length > MEPSILON, relative, np.inf))
+    score = np.mean(values, axis=-1) * np.exp(-(collinearity / COLLINEARITY_TOLERANCE) ** 2)
+
+    if spacing is not None:
+        sides = layout.sides
+        scale = np.asarray(spacing[:2], dtype=float)
+        separation = np.linalg.norm((points[..., sides[:, 2], :] - points[..., sides[:, 0], :]) * scale, axis=-1)
+        spacingError = np.max(np.abs(separation / topology.parallelSpacing - 1.0), axis=-1)
+        score = score * np.exp(-(spacingError / SPACING_TOLERANCE) ** 2)
+    return score
+
+
+# Topologies are shared by the registry, so a few entries cover the configurations in use
+@functools.lru_cache(maxsize=32)
+def GeometryConstraints(topology):
+    """Constraints on the fiducial intercepts of a frame that hold in any slice, for CheckGeometry.
+
+    The parallel fiducials run along the frame z axis, so any slice cuts them in an affine image of their
+    cross-section: segments between them that are parallel in the frame remain parallel, with the same length
+    ratio, whatever the tilt of the slice and the pixel spacing. The three fiducials of a side are coplanar, so
+    their intercepts are collinear; a side is left out if the topology places its fiducials otherwise (see
+    ZFrame.GlobalFit.FiducialLines).
+
+    Args:
+        topology (FrameTopology): frame topology
+
+    Returns:
+        tuple: (segments, ratios, sides) where segments is a (P, 2, 2) array of the [start, end] fiducial indices
+            of P pairs of parallel segments, ratios the (P,) signed length ratios of the second segment of each
+            pair to the first, and sides the (K, 3) fiducial indices of the sides with coplanar fiducials
+    """
+    points, directions = FiducialLines(topology)
+    fixed = np.flatnonzero(np.all(np.abs(directions[:, :2]) < MEPSILON, axis=1))
+    segments = np.array([segment for segment in itertools.combinations(fixed, 2)
+                         if np.linalg.norm(points[segment[1], :2] - points[segment[0], :2]) > MEPSILON], dtype=int)
+    vectors = points[segments[:, 1], :2] - points[segments[:, 0], :2]
+    pairs = []
+    ratios = []
+    for first, second in itertools.combinations(range(len(segments)), 2):
+        a = vectors[first]
+        b = vectors[second]
+        if abs(a[0] * b[1] - a[1] * b[0]) <= 1e-6 * np.linalg.norm(a) * np.linalg.norm(b):
+            pairs.append([segments[first], segments[second]])
+            ratios.append(np.dot(a, b) / np.dot(a, a))
+
+    sides = []
+    for side in topology.layout.sides:
+        first, middle, last = side
+        normal = np.cross(directions[first], points[last] - points[first])
+        offset = points[middle] - points[first]
+        tolerance = 1e-6 * np.linalg.norm(normal)
+        if (abs(np.dot(normal, offset)) <= tolerance * np.linalg.norm(offset)
+                and abs(np.dot(normal, directions[middle])) <= tolerance):
+            sides.append(side)
+    return (np.array(pairs, dtype=int).reshape(-1, 2, 2), np.array(ratios, dtype=float),
+            np.array(sides, dtype=int).reshape(-1, 3))
+
+
+def CheckGeometry(points, topology, shape):
+    """Check that ordered fiducial point sets are a valid cross-section of a frame.
+
+    Unlike ScoreLabelings, which ranks labelings, this is a hard test driven by the constraints of the topology
+    (see GeometryConstraints), vectorized over any number of point sets. A point set is valid if its points lie in
+    the image, the segments that are parallel in the frame are parallel within MAX_PARALLEL_ANGLE and in the same
+    direction, their length ratios are those of the frame within MAX_SPACING_RATIO_ERROR, and the middle fiducial
+    of each side is on the line of the other two within MAX_COLLINEARITY. None of the tests depends on the pixel
+    spacing.
+
+    Args:
+        points (numpy.ndarray): (..., N, 2) ordered fiducial coordinates in pixels
+        topology (FrameTopology): frame topology
+        shape (list): [rows, columns] image size in pixels
+
+    Returns:
+        numpy.ndarray: (...) boolean array, True where the geometry is valid
+    """
+    segments, ratios, sides = GeometryConstraints(topology)
+    points = np.asarray(points, dtype=float)
+    valid = np.all((points >= 0) & (points < np.asarray(shape[:2], dtype=float)), axis=(-2, -1))
+
+    vectors = points[..., segments[:, :, 1], :] - points[..., segments[:, :, 0], :]
+    lengths = np.linalg.norm(vectors, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cosines = np.sum(vectors[..., 0, :] * vectors[..., 1, :], axis=-1) / (lengths[..., 0] * lengths[..., 1])
+        ratioErrors = np.abs(lengths[..., 1] / (lengths[..., 0] * np.abs(ratios)) - 1.0)
+    valid &= np.all(cosines * np.sign(ratios) >= np.cos(np.radians(MAX_PARALLEL_ANGLE)), axis=-1)
+    valid &= np.all(ratioErrors <= MAX_SPACING_RATIO_ERROR, axis=-1)
+
+    edges = points[..., sides[:, 2], :] - points[..., sides[:, 0], :]
+    offsets = points[..., sides[:, 1], :] - points[..., sides[:, 0], :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        collinearity = (np.abs(edges[..., 0] * offsets[..., 1] - edges[..., 1] * offsets[..., 0]) /
+                        np.sum(edges ** 2, axis=-1))
+    valid &= np.all(collinearity <= MAX_COLLINEARITY, axis=-1)
+    return valid
+
+
+def MatchFiducials(candidates, values, topology, spacing=None):
+    """Pick the subset and labeling of candidate peaks that best matches the frame's cross-section.
+
+    Every subset of numFiducials candidates is ordered against the layout of the topology and scored with
+    ScoreLabelings, so spurious peaks are left out and missing prominence on one peak does not fail the slice
+    as long as enough candidates remain.
+
+    Args:
+        candidates (numpy.ndarray): (K, 2) candidate peak coordinates in pixels
+        values (numpy.ndarray): (K,) candidate peak values
+        topology (FrameTopology): frame topology
+        spacing (list): [row, column] pixel spacing in mm, or None
+
+    Returns:
+        tuple: (indices, score) where indices are the candidate indices in fiducial order,
+            or (None, 0.0) if no subset matches the layout
+    """
+    return MatchSliceFiducials([candidates], [values], topology, spacing)[0]
+
+
+def MatchSliceFiducials(candidates, values, topology, spacing=None):
+    """MatchFiducials on the candidate peaks of several slices at once.
+
+    The subsets of all slices are ordered and scored together, so the cost of the vectorized ordering and
+    scoring is paid once for the slice range instead of once per slice.
+
+    Args:
+        candidates (list): (K, 2) candidate peak coordinates in pixels of each slice
+        values (list): (K,) candidate peak values of each slice
+        topology (FrameTopology): frame topology
+        spacing (list): [row, column] pixel spacing in mm, or None
+
+    Returns:
+        list: (indices, score) of each slice, as returned by MatchFiducials
+    """
+    numFiducials = topology.numFiducials
+    matches = [(None, 0.0)] * len(candidates)
+    slices = [index for index, points in enumerate(candidates) if len(points) >= numFiducials]
+    if not slices:
+        return matches
+
+    # Subsets of every slice, as indices into the candidates of all slices
+    offsets = np.cumsum([0] + [len(candidates[index]) for index in slices])
+    subsets = [np.array(list(itertools.combinations(range(len(candidates[index])), numFiducials)), dtype=int)
+               for index in slices]
+    counts = np.cumsum([0] + [len(indices) for indices in subsets])
+    subsets = np.concatenate([indices + offset for indices, offset in zip(subsets, offsets)])
+    points = np.concatenate([np.asarray(candidates[index], dtype=float) for index in slices])
+    peakValues = np.concatenate([np.asarray(values[index], dtype=float) for index in slices])
+
+    order, valid = OrderFiducials(points[subsets], topology.layout)
+    labelings = np.take_along_axis(subsets, order, axis=1)
+    scores = ScoreLabelings(points[labelings], peakValues[labelings], topology, spacing)
+    scores = np.where(valid, scores, 0.0)
+
+    for position, index in enumerate(slices):
+        best = counts[position] + int(np.argmax(scores[counts[position]:counts[position + 1]]))
+        if scores[best] > 0.0:
+            matches[index] = (labelings[best] - offsets[position], float(scores[best]))
+    return matches
@@ -0,0 +1,144 @@
+import numpy as np
+
+from ZFrame.Localization import MatricesToQuaternions, QuaternionsToMatrices, QuaternionsDivide, QuaternionsMultiply
+
+# Solver modes of ZFrameRegistration
+SOLVER_CLOSED_FORM = 'closedForm'
+SOLVER_GLOBAL_FIT = 'globalFit'
+SOLVERS = (SOLVER_CLOSED_FORM, SOLVER_GLOBAL_FIT)
+
+MEPSILON = 1e-10
+
+
+def FiducialLines(topology):
+    """Compute the line fiducials of a frame in frame coordinates.
+
+    For each side, the first parallel fiducial runs through the end of the diagonal fiducial, the second
+    fiducial is the diagonal itself, and the third parallel fiducial runs through the origin of the diagonal.
+    Parallel fiducials run along the frame z axis. A fiducial shared by two sides (the corners of the
+    7-fiducial layout) is taken from the later side; both sides place it on the same line.
+
+    Args:
+        topology (FrameTopology): frame topology
+
+    Returns:
+        tuple: (points, directions), two (N, 3) arrays with a point on and the unit direction of each fiducial,
+            in fiducial order
+    """
+    layout = topology.layout
+    points = np.zeros((layout.numFiducials, 3))
+    directions = np.zeros((layout.numFiducials, 3))
+    for side in range(3):
+        origin = topology.origins[side]
+        diagonal = topology.unitDiagonals[side]
+        first, middle, last = layout.sides[side]
+        points[first] = origin + diagonal * topology.diagonalLengths[side]
+        directions[first] = [0.0, 0.0, 1.0]
+        points[middle] = origin
+        directions[middle] = diagonal
+        points[last] = origin
+        directions[last] = [0.0, 0.0, 1.0]
+    return points, directions
+
+
+def RotationVectorToMatrix(rotation):
+    """Convert a rotation vector (axis times angle, in radians) to a 3x3 rotation matrix (Rodrigues)."""
+    angle = np.linalg.norm(rotation)
+    if angle < MEPSILON:
+        return np.eye(3)
+    k = rotation / angle
+    K = np.array([[0.0, -k[2], k[1]],
+                  [k[2], 0.0, -k[0]],
+                  [-k[1], k[0], 0.0]])
+    return np.eye(3) + np.sin(angle) * K + (1.0 - np.cos(angle)) * (K @ K)
+
+
+def _LineResiduals(points, rotation, translation, linePoints, lineDirections):
+    """Residuals of the points from their lines after mapping the points into frame coordinates."""
+    local = (points - translation) @ rotation
+    offsets = local - linePoints
+    residuals = offsets - np.sum(offsets * lineDirections, axis=1, keepdims=True) * lineDirections
+    return local, residuals
+
+
+def FitFrame(points, labels, topology, rotation, translation, maxIterations=50, tolerance=1e-9):
+    """Fit the frame pose to fiducial intercepts from any number of slices with Levenberg-Marquardt.
+
+    Minimizes the sum of squared distances between every intercept and its line fiducial, the frame pose
+    mapping frame coordinates x to scanner coordinates rotation @ x + translation.
+
+    Args:
+        points (numpy.ndarray): (M, 3) fiducial intercepts in scanner (RAS) coordinates
+        labels (numpy.ndarray): (M,) fiducial index of each intercept
+        topology (FrameTopology): frame topology
+        rotation (numpy.ndarray): 3x3 initial rotation, e.g. from the closed-form solution
+        translation (numpy.ndarray): initial translation
+        maxIterations (int): maximum number of iterations
+        tolerance (float): convergence threshold on the parameter update
+
+    Returns:
+        tuple: (rotation, translation, rms) where rms is the root mean square distance of the intercepts
+            from their line fiducials in mm
+    """
+    points = np.asarray(points, dtype=float)
+    linePoints, lineDirections = FiducialLines(topology)
+    linePoints = linePoints[labels]
+    lineDirections = lineDirections[labels]
+    projectors = np.eye(3) - lineDirections[:, :, np.newaxis] * lineDirections[:, np.newaxis, :]
+
+    rotation = np.array(rotation, dtype=float)
+    translation = np.array(translation, dtype=float)
+    local, residuals = _LineResiduals(points, rotation, translation, linePoints, lineDirections)
+    cost = np.sum(residuals ** 2)
+    damping = 1e-3
+    for _ in range(maxIterations):
+        # Local frame coordinates y = exp(-[w]x) R^T (X - t - dt) ~ y - [w]x y - R^T dt
+        skew = np.zeros((len(local), 3, 3))
+        skew[:, 0, 1], skew[:, 0, 2] = -local[:, 2], local[:, 1]
+        skew[:, 1, 0], skew[:, 1, 2] = local[:, 2], -local[:, 0]
+        skew[:, 2, 0], skew[:, 2, 1] = -local[:, 1], local[:, 0]
+        jacobian = np.concatenate([projectors @ skew, -projectors @ rotation.T], axis=2).reshape(-1, 6)
+        gradient = jacobian.T @ residuals.reshape(-1)
+        hessian = jacobian.T @ jacobian
+
+        while True:
+            step = np.linalg.solve(hessian + damping * np.diag(np.diag(hessian) + MEPSILON), -gradient)
+            newRotation = rotation @ RotationVectorToMatrix(step[:3])
+            newTranslation = translation + step[3:]
+            newLocal, newResiduals = _LineResiduals(points, newRotation, newTranslation, linePoints, lineDirections)
+            newCost = np.sum(newResiduals ** 2)
+            if newCost <= cost:
+                damping = max(damping / 10.0, 1e-12)
+                break
+            damping *= 10.0
+            if damping > 1e12:
+                break
+        if newCost > cost:
+            break
+        rotation, translation, local, residuals, cost = newRotation, newTranslation, newLocal, newResiduals, newCost
+        if np.linalg.norm(step) < tolerance:
+            break
+
+    rms = np.sqrt(cost / max(len(points), 1))
+    return rotation, translation, rms
+
+
+def FitFramePose(points, labels, topology, Zposition, Zorientation, ZorientationBase):
+    """Refine a registration result (as returned by ZFrameRegistration.Register) with FitFrame.
+
+    Args:
+        points (numpy.ndarray): (M, 3) fiducial intercepts in RAS coordinates
+        labels (numpy.ndarray): (M,) fiducial index of each intercept
+        topology (FrameTopology): frame topology
+        Zposition (numpy.ndarray): [x, y, z] initial frame position
+        Zorientation (numpy.ndarray): [x, y, z, w] initial frame orientation, relative to ZorientationBase
+        ZorientationBase (numpy.ndarray): [x, y, z, w] base orientation quaternion
+
+    Returns:
+        tuple: (Zposition, Zorientation, rms) in the same convention as the input
+    """
+    initial = QuaternionsMultiply(Zorientation, ZorientationBase)
+    rotation, translation, rms = FitFrame(points, labels, topology, QuaternionsToMatrices(initial), Zposition)
+    Zorientation = QuaternionsDivide(MatricesToQuaternions(rotation), ZorientationBase)
+    return translation, Zorientation, rms
+
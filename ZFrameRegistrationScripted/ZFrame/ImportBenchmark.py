@@ -0,0 +1,121 @@
+"""Measure the import time of the extension's Python modules with `python -X importtime`.
+
+Each module is imported in a fresh interpreter, after the modules Slicer has already loaded at startup
+(--preload), so the reported time is the module's own contribution to the Slicer launch. Run it with the
+Python of Slicer to measure the real environment, e.g.:
+
+    PythonSlicer ZFrame/ImportBenchmark.py --preload numpy,vtk,qt,ctk,slicer
+
+The exit status is 1 when a module exceeds its budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Import time budget of one module, in milliseconds
+DEFAULT_BUDGET_MS = 100.0
+
+DEFAULT_MODULES = ['ZFrameRegistrationScripted', 'ZFrameRegistrationWithROI']
+
+
+def ParseImportTime(output):
+    """Parse the -X importtime report.
+
+    Args:
+        output (str): standard error of the interpreter
+
+    Returns:
+        list: (name, depth, selfMicroseconds, cumulativeMicroseconds) per imported module, in report order
+    """
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        # The name column is one space, then two spaces per nesting level
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        entries.append((name.strip(), depth, int(fields[0]), int(fields[1])))
+    return entries
+
+
+def MeasureImport(module, preload=(), paths=(), executable=None):
+    """Import a module in a fresh interpreter and return its import time breakdown.
+
+    Args:
+        module (str): module to import
+        preload (list): modules imported first, whose time is not counted
+        paths (list): directories added to sys.path
+        executable (str): Python interpreter, the current one by default
+
+    Returns:
+        tuple: (selfMicroseconds, cumulativeMicroseconds, children) where children lists the
+            (name, cumulativeMicroseconds) of the modules first imported by it, largest first
+    """
+    statements = [f"import sys; sys.path[:0] = {list(paths)!r}"]
+    statements += [f"import {name}" for name in preload]
+    statements.append(f"import {module}")
+    result = subprocess.run([executable or sys.executable, '-X', 'importtime', '-c', '; '.join(statements)],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        errors = [line for line in result.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f"Could not import {module}:\n" + '\n'.join(errors[-20:]))
+    entries = ParseImportTime(result.stderr)
+    for index in range(len(entries) - 1, -1, -1):
+        name, depth, selfTime, cumulative = entries[index]
+        if name == module and depth == 0:
+            break
+    else:
+        raise RuntimeError(f"{module} is missing from the import time report")
+
+    # The modules imported by the module precede it in the report, one level deeper
+    children = []
+    for name, depth, _, childCumulative in reversed(entries[:index]):
+        if depth == 0:
+            break
+        if depth == 1:
+            children.append((name, childCumulative))
+    children.sort(key=lambda child: -child[1])
+    return selfTime, cumulative, children
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import time budget of the Z-frame registration modules")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--preload', default='numpy',
+                        help="comma-separated modules already loaded by Slicer at startup")
+    parser.add_argument('--path', action='append', default=[],
+                        help="directory added to sys.path (the module directories by default)")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per module, the fastest is reported")
+    parser.add_argument('--top', type=int, default=5, help="number of dependencies listed per module")
+    parser.add_argument('--executable', help="Python interpreter (e.g. PythonSlicer)")
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    paths = args.path or [os.path.join(root, module) for module in DEFAULT_MODULES]
+    preload = [name for name in args.preload.split(',') if name]
+
+    overBudget = False
+    for module in args.modules:
+        try:
+            runs = [MeasureImport(module, preload, paths, args.executable) for _ in range(max(1, args.repeat))]
+        except RuntimeError as e:
+            print(f"{module}: import failed\n{e}")
+            overBudget = True
+            continue
+        selfTime, cumulative, children = min(runs, key=lambda run: run[1])
+        status = 'OK' if cumulative <= args.budget_ms * 1000 else 'OVER BUDGET'
+        overBudget |= status != 'OK'
+        print(f"{module}: {cumulative / 1000:.1f} ms (self {selfTime / 1000:.1f} ms, "
+              f"budget {args.budget_ms:.0f} ms) {status}")
+        for name, childCumulative in children[:args.top]:
+            print(f"    {name}: {childCumulative / 1000:.1f} ms")
+    return 1 if overBudget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,188 @@
+import numpy as np
+
+MEPSILON = 1e-10
+
+# Poses with a larger rotation angle (as computed by LocalizeFrame) or out-of-plane displacement are rejected
+MAX_ROTATION_ANGLE = 15.0
+MAX_DISPLACEMENT = 20.0
+
+# Maximum distance of the centred fiducial of a layout from the image centre row, in mm
+MAX_CENTRE_OFFSET = 10.0
+
+
+def MatricesToQuaternions(matrices):
+    """Convert rotation matrices to quaternions, following zf.MatrixToQuaternion.
+
+    Args:
+        matrices (numpy.ndarray): (..., 3, 3) or (..., 4, 4) matrices
+
+    Returns:
+        numpy.ndarray: (..., 4) quaternions [x, y, z, w]
+    """
+    m = np.asarray(matrices, dtype=float)
+    m00, m01, m02 = m[..., 0, 0], m[..., 0, 1], m[..., 0, 2]
+    m10, m11, m12 = m[..., 1, 0], m[..., 1, 1], m[..., 1, 2]
+    m20, m21, m22 = m[..., 2, 0], m[..., 2, 1], m[..., 2, 2]
+    trace = m00 + m11 + m22
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # trace > 0
+        s = 0.5 / np.sqrt(trace + 1.0)
+        qTrace = np.stack([(m21 - m12) * s, (m02 - m20) * s, (m10 - m01) * s, 0.25 / s], axis=-1)
+        # m00 is the largest diagonal element
+        s = 2.0 * np.sqrt(1.0 + m00 - m11 - m22)
+        qX = np.stack([0.25 * s, (m01 + m10) / s, (m02 + m20) / s, (m21 - m12) / s], axis=-1)
+        # m11 is the largest diagonal element
+        s = 2.0 * np.sqrt(1.0 + m11 - m00 - m22)
+        qY = np.stack([(m01 + m10) / s, 0.25 * s, (m12 + m21) / s, (m02 - m20) / s], axis=-1)
+        # m22 is the largest diagonal element
+        s = 2.0 * np.sqrt(1.0 + m22 - m00 - m11)
+        qZ = np.stack([(m02 + m20) / s, (m12 + m21) / s, 0.25 * s, (m10 - m01) / s], axis=-1)
+
+    useX = ((m00 > m11) & (m00 > m22))[..., np.newaxis]
+    useY = (m11 > m22)[..., np.newaxis]
+    q = np.where(useX, qX, np.where(useY, qY, qZ))
+    return np.where((trace > 0)[..., np.newaxis], qTrace, q)
+
+
+def QuaternionsToMatrices(quaternions):
+    """Convert quaternions [x, y, z, w] to (..., 3, 3) rotation matrices, following zf.QuaternionToMatrix."""
+    q = np.asarray(quaternions, dtype=float)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    x, y, z, w = np.moveaxis(q, -1, 0)
+    return np.stack([np.stack([1.0 - 2.0*(y*y + z*z), 2.0*(x*y - z*w), 2.0*(x*z + y*w)], axis=-1),
+                     np.stack([2.0*(x*y + z*w), 1.0 - 2.0*(x*x + z*z), 2.0*(y*z - x*w)], axis=-1),
+                     np.stack([2.0*(x*z - y*w), 2.0*(y*z + x*w), 1.0 - 2.0*(x*x + y*y)], axis=-1)], axis=-2)
+
+
+def QuaternionsMultiply(q1, q2):
+    """Multiply quaternions [x, y, z, w] element-wise over the leading axes."""
+    q1 = np.asarray(q1, dtype=float)
+    q2 = np.asarray(q2, dtype=float)
+    x1, y1, z1, w1 = np.moveaxis(q1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(q2, -1, 0)
+    return np.stack([w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                     w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                     w1*z2 + x1*y2 - y1*x2 + z1*w2,
+                     w1*w2 - x1*x2 - y1*y2 - z1*z2], axis=-1)
+
+
+def QuaternionsDivide(q1, q2):
+    """Divide quaternions (q1/q2 = q1 * inverse(q2)), returning the identity where q2 is zero."""
+    q2 = np.asarray(q2, dtype=float)
+    norm = np.sum(q2 * q2, axis=-1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inverse = q2 * np.array([-1.0, -1.0, -1.0, 1.0]) / norm
+    result = QuaternionsMultiply(q1, inverse)
+    return np.where(norm < MEPSILON, np.array([0.0, 0.0, 0.0, 1.0]), result)
+
+
+def QuaternionsRotateVectors(q, v):
+    """Rotate vectors by quaternions element-wise over the leading axes."""
+    q = np.asarray(q, dtype=float)
+    v = np.asarray(v, dtype=float)
+    t = 2.0 * np.cross(q[..., :3], v)
+    return v + q[..., 3:] * t + np.cross(q[..., :3], t)
+
+
+def _Normalize(vectors, valid):
+    """Normalize (..., 3) vectors; vectors shorter than MEPSILON clear valid."""
+    norms = np.linalg.norm(vectors, axis=-1)
+    valid &= ~(norms < MEPSILON)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return vectors / norms[..., np.newaxis]
+
+
+def LocalizeFrames(coordinates, topology):
+    """Compute the pose of the fiducial frame relative to the image plane for any number of slices.
+
+    Uses an adaptation of an algorithm presented by Susil et al.:
+    "A Single image Registration Method for CT-Guided Interventions", MICCAI 1999.
+    All slices are solved in one broadcasted computation; slices that fail a check are flagged in the
+    validity mask instead of aborting.
+
+    Args:
+        coordinates (numpy.ndarray): (S, N, 2) ordered fiducial coordinates in mm, relative to the image centre
+        topology (FrameTopology): frame topology
+
+    Returns:
+        tuple: (positions, quaternions, valid) where:
+            - positions is an (S, 3) array of frame positions in image coordinates
+            - quaternions is an (S, 4) array of frame orientations [x, y, z, w] in image coordinates
+            - valid is an (S,) boolean array; positions and quaternions of invalid slices are NaN
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    numSlices = len(coordinates)
+    layout = topology.layout
+    points = np.concatenate([coordinates, np.zeros(coordinates.shape[:-1] + (1,))], axis=-1)
+    valid = np.ones(numSlices, dtype=bool)
+
+    # --- Compute diagonal points in the z-frame coordinates ---
+    # Intercepts of the (parallel, diagonal, parallel) fiducials of Side 1, Base and Side 2
+    P1 = points[:, layout.sides[:, 0]]
+    P2 = points[:, layout.sides[:, 1]]
+    P3 = points[:, layout.sides[:, 2]]
+    D12 = np.linalg.norm(P1 - P2, axis=-1)
+    D23 = np.linalg.norm(P2 - P3, axis=-1)
+    valid &= np.all(D12 + D23 >= MEPSILON, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Lc = topology.diagonalLengths * D23 / (D12 + D23)
+    diagonalPoints = topology.origins + topology.unitDiagonals * Lc[..., np.newaxis]
+    P2f, P4f, P6f = diagonalPoints[:, 0], diagonalPoints[:, 1], diagonalPoints[:, 2]
+
+    # --- Compute Transformation Between Image and Frame ---
+    # Compute z-frame cross section coordinate frame
+    Vx = _Normalize(P2f - P6f, valid)
+    Vz = _Normalize(np.cross(Vx, P4f - P6f), valid)
+    Vy = np.cross(Vz, Vx)
+    Qft = MatricesToQuaternions(np.stack([Vx, Vy, Vz], axis=-1))
+
+    # Check that the centred fiducial of the layout is sufficiently centred along the x-axis
+    if layout.centredFiducial is not None:
+        valid &= ~(np.abs(coordinates[:, layout.centredFiducial, 0]) > MAX_CENTRE_OFFSET)
+
+    # Compute image cross-section coordinate frame from the diagonal intercepts
+    Pz1, Pz2, Pz3 = P2[:, 0], P2[:, 1], P2[:, 2]
+    Vx = Pz1 - Pz3
+    Vz = np.cross(Vx, Pz2 - Pz3)
+    Vy = np.cross(Vz, Vx)
+    Qit = MatricesToQuaternions(np.stack([_Normalize(Vx, valid), _Normalize(Vy, valid), _Normalize(Vz, valid)],
+                                         axis=-1))
+
+    # Compute rotation between frame and image
+    quaternions = QuaternionsDivide(Qit, Qft)
+
+    # Check rotation angle
+    with np.errstate(invalid='ignore'):
+        angles = 2 * np.arccos(quaternions[:, 3])
+        valid &= ~(np.abs(angles) > MAX_ROTATION_ANGLE)
+        valid &= ~((angles != 0.0) & (np.abs(np.sqrt(1 - quaternions[:, 3] ** 2)) < MEPSILON))
+
+    # Compute translational component: centroid of the diagonal intercepts in image coordinates
+    # minus the centroid of the frame triangle rotated into the image
+    Cfi = QuaternionsRotateVectors(quaternions, np.mean(diagonalPoints, axis=1))
+    Ci = (Pz1 + Pz2 + Pz3) / 3.0
+    positions = Ci - Cfi
+    valid &= ~(np.abs(positions[:, 2]) > MAX_DISPLACEMENT)
+
+    positions[~valid] = np.nan
+    quaternions[~valid] = np.nan
+    return positions, quaternions, valid
+
+
+def ComposeSlicePoses(slicePositions, sliceQuaternions, framePositions, frameQuaternions, baseQuaternion):
+    """Express frame poses found in image coordinates in the RAS coordinate system.
+
+    Args:
+        slicePositions (numpy.ndarray): (S, 3) RAS positions of the slice centres
+        sliceQuaternions (numpy.ndarray): (S, 4) or (4,) orientation of the slices
+        framePositions (numpy.ndarray): (S, 3) frame positions in image coordinates
+        frameQuaternions (numpy.ndarray): (S, 4) frame orientations in image coordinates
+        baseQuaternion (numpy.ndarray): (4,) base orientation of the frame
+
+    Returns:
+        tuple: (positions, quaternions) of the frame in RAS coordinates
+    """
+    positions = np.asarray(slicePositions, dtype=float) + QuaternionsRotateVectors(sliceQuaternions, framePositions)
+    quaternions = QuaternionsDivide(QuaternionsMultiply(sliceQuaternions, frameQuaternions), baseQuaternion)
+    return positions, quaternions
@@ -0,0 +1,100 @@
+import numpy as np
+
+# Maximum ratio between the detour through an in-between fiducial and the distance of its two corners
+EDGE_TOLERANCE = 1.05
+
+MEPSILON = 1e-10
+
+
+def OrderFiducials(points, layout):
+    """Put detected fiducial intercepts in the sequential order defined by a cross-section layout.
+
+    The four points farthest from the centre of the bounding rectangle are taken as the corners and put in
+    cyclic order. Every other point is assigned to the corner pair it lies between, and the points are then
+    traversed along the three populated edges, starting at one corner of the open edge. All distances come
+    from one pairwise distance matrix per slice, and any number of slices are ordered at once.
+
+    Args:
+        points (numpy.ndarray): (..., N, 2) fiducial coordinates, N being layout.numFiducials
+        layout (FiducialLayout): cross-section pattern of the frame
+
+    Returns:
+        tuple: (order, valid) where:
+            - order is an (..., N) integer array of point indices in sequential order
+            - valid is a (...) boolean array, False where the points do not match the layout
+    """
+    points = np.asarray(points, dtype=float)
+    numFiducials = layout.numFiducials
+    if points.shape[-2:] != (numFiducials, 2):
+        raise ValueError(f"Expected (..., {numFiducials}, 2) points, got {points.shape}")
+    batchShape = points.shape[:-2]
+    P = points.reshape(-1, numFiducials, 2)
+    batch = np.arange(len(P))[:, np.newaxis]
+
+    # Pairwise distances and the centre of the bounding rectangle
+    distances = np.linalg.norm(P[:, :, np.newaxis, :] - P[:, np.newaxis, :, :], axis=-1)
+    centre = (P.min(axis=1) + P.max(axis=1)) / 2.0
+    distanceToCentre = np.linalg.norm(P - centre[:, np.newaxis, :], axis=-1)
+
+    # The four points farthest from the centre are the corners
+    byDistance = np.argsort(-distanceToCentre, axis=1, kind='stable')
+    corners = byDistance[:, :4].copy()
+    others = byDistance[:, 4:]
+
+    # Cyclic corner order: the second corner is the nearer of the next two, the third the nearer of the last two
+    for first, second in ((0, 1), (1, 2)):
+        swap = (distances[batch[:, 0], corners[:, first], corners[:, second]] >
+                distances[batch[:, 0], corners[:, first], corners[:, second + 1]])
+        corners[swap, second], corners[swap, second + 1] = corners[swap, second + 1], corners[swap, second]
+
+    # Edge k joins corner k and corner k+1
+    nextCorners = np.roll(corners, -1, axis=1)
+    edgeLengths = distances[batch, corners, nextCorners]
+    toStart = distances[batch[:, :, np.newaxis], others[:, :, np.newaxis], corners[:, np.newaxis, :]]
+    toEnd = distances[batch[:, :, np.newaxis], others[:, :, np.newaxis], nextCorners[:, np.newaxis, :]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        detour = (toStart + toEnd) / edgeLengths[:, np.newaxis, :]
+        position = toStart / (toStart + toEnd)
+    detour[np.broadcast_to(edgeLengths[:, np.newaxis, :] < MEPSILON, detour.shape)] = np.inf
+    edges = np.argmin(detour, axis=2)
+    valid = np.all(np.take_along_axis(detour, edges[:, :, np.newaxis], axis=2)[:, :, 0] < EDGE_TOLERANCE, axis=1)
+
+    # Exactly one edge must be open, and the others must carry the layout's fiducial counts
+    counts = np.stack([np.sum(edges == k, axis=1) for k in range(4)], axis=1)
+    openEdges = np.argmin(counts, axis=1)
+    valid &= np.sum(counts == 0, axis=1) == 1
+    start = (openEdges + 1) % 4
+    forwardCounts = counts[batch, (start[:, np.newaxis] + np.arange(3)) % 4]
+    backwardCounts = counts[batch, (openEdges[:, np.newaxis] - 1 - np.arange(3)) % 4]
+    forwardMatch = np.all(forwardCounts == layout.edgeCounts, axis=1)
+    backwardMatch = np.all(backwardCounts == layout.edgeCounts, axis=1)
+    valid &= forwardMatch | backwardMatch
+
+    # Sort key: edge number along the traversal starting at corner 'start', plus the position along the edge
+    cornerKeys = (np.arange(4)[np.newaxis, :] - start[:, np.newaxis]) % 4
+    otherPositions = np.take_along_axis(position, edges[:, :, np.newaxis], axis=2)[:, :, 0]
+    otherKeys = (edges - start[:, np.newaxis]) % 4 + np.nan_to_num(otherPositions, nan=0.5)
+    keys = np.concatenate([cornerKeys, otherKeys], axis=1)
+    indices = np.concatenate([corners, others], axis=1)
+    order = np.take_along_axis(indices, np.argsort(keys, axis=1, kind='stable'), axis=1)
+
+    # Choose the traversal direction
+    if layout.orderingRule == 'rotation':
+        d1 = P[batch[:, 0], corners[:, 0]] - centre
+        d2 = P[batch[:, 0], corners[:, 1]] - centre
+        reverse = d1[:, 0] * d2[:, 1] - d2[:, 0] * d1[:, 1] < 0
+    elif layout.orderingRule == 'row':
+        reverse = P[batch[:, 0], order[:, 0], 0] > P[batch[:, 0], order[:, -1], 0]
+    else:
+        raise ValueError(f"Unknown ordering rule: {layout.orderingRule}")
+    # An asymmetric layout can only be traversed in the direction its fiducial counts match
+    reverse = np.where(forwardMatch & backwardMatch, reverse, backwardMatch)
+    order[reverse] = order[reverse, ::-1]
+
+    return order.reshape(batchShape + (numFiducials,)), valid.reshape(batchShape)
+
+
+def ApplyOrder(points, order):
+    """Reorder (..., N, 2) points with the (..., N) index array returned by OrderFiducials."""
+    points = np.asarray(points)
+    return np.take_along_axis(points, np.asarray(order)[..., np.newaxis], axis=-2)
@@ -1,5 +1,16 @@
+import time
+
 import numpy as np
-from scipy.fft import fft2, ifft2
+from ZFrame.Topology import registry as topologyRegistry
+from ZFrame.Ordering import ApplyOrder, OrderFiducials
+from ZFrame.Localization import ComposeSlicePoses, LocalizeFrames
+from ZFrame.GlobalFit import SOLVER_CLOSED_FORM, SOLVER_GLOBAL_FIT, SOLVERS, FitFramePose
+from ZFrame.Detection import (EXTRA_CANDIDATES, MIN_MATCH_SCORE, PRECISION_DOUBLE, PRECISION_TYPES, CheckGeometry,
+                              CorrelationImage, ExtractPeaks, FindMax, FindPeaks, MaskSpectrum, MatchFiducials,
+                              MatchSliceFiducials, RefineCandidates, ScoreLabelings)
+from ZFrame.Results import MatchScores, NewSliceResults, SliceProgress
+from ZFrame.Tracking import (MAX_TRACK_DISTANCE, MIN_TRACKING_SCORE, SEARCH_RADIUS, ExtrapolateTrack,
+                             FramePoseInImage, PredictIntercepts, RejectTrackOutliers, SearchFiducials)
 
 class zf:
     @staticmethod
@@ -190,29 +201,165 @@ class ZFrameRegistration:
         self.InputImageDim = [0, 0, 0]
         self.InputImageTrans = None
         self.frameTopology = None
+        self.topology = None
         self.manualRegistration = False
         self.zFrameFids = None
         self.ZOrientationBase = [0, 0, 0, 1]  # Default quaternion
+        self.matchScore = 0.0  # Match score of the last slice
+        self.matchScores = {}  # Match score of each slice of the last registration
+        self.sliceResults = None  # Per-slice results of the last registration (see ZFrame.Results)
+        self.solver = SOLVER_CLOSED_FORM
+        self.precision = PRECISION_DOUBLE
+        self.fitResidual = None  # RMS distance of the intercepts to the line fiducials after a global fit
+        self.tracking = False
+        self.trackingSearchRadius = SEARCH_RADIUS
+        self.trackingMinScore = MIN_TRACKING_SCORE
+        self.trackingPose = None  # Last frame pose in RAS, before the base orientation: (position, quaternion)
+        self.tracked = False  # True if the fiducials of the last RegisterQuaternion call were tracked
+        self.propagation = False
+        self.detectionCache = None  # {slice index: detection result record} reused by Register
+        self.maxTrackDistance = MAX_TRACK_DISTANCE
+        self.cancelled = False  # True if the last Register call was cancelled
+        self.verbose = True  # Print the progress of the registrations (see SetVerbose)
         
         # Constants
         self.MEPSILON = 1e-10
     
     def SetFrameTopology(self, frameTopology):
-        self.frameTopology = frameTopology
+        """Set the frame topology.
+
+        Args:
+            frameTopology (FrameTopology/str/list): topology from the shared registry, a topology string or
+                a 6x3 list of origins and diagonal vectors
+        """
+        self.topology = topologyRegistry.GetTopology(frameTopology, self.numFiducials)
+        self.frameTopology = self.topology.values
     
+    def SetSolver(self, solver):
+        """Select how the frame pose is computed from the slices.
+
+        Args:
+            solver (str): SOLVER_CLOSED_FORM to average the closed-form pose of each slice, or SOLVER_GLOBAL_FIT
+                to refine it with a least-squares fit of the line fiducials to the intercepts of all slices
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver: {solver}")
+        self.solver = solver
+
+    def SetPrecision(self, precision):
+        """Select the floating point precision of the images, spectra and correlation maps.
+
+        Args:
+            precision (str): PRECISION_DOUBLE (float64/complex128) or PRECISION_SINGLE (float32/complex64)
+        """
+        if precision not in PRECISION_TYPES:
+            raise ValueError(f"Unknown precision: {precision}")
+        self.precision = precision
+
+    def SetVerbose(self, enabled):
+        """Enable the progress output of this registration on the standard output (default).
+
+        The output is switched per instance, so that a quiet registration does not silence the other threads.
+
+        Args:
+            enabled (bool): print the progress of the slices and stages
+        """
+        self.verbose = enabled
+
+    def Print(self, *args):
+        """Print a progress message if the output of this registration is enabled (see SetVerbose)."""
+        if self.verbose:
+            print(*args)
+
+    def SetTracking(self, enabled, searchRadius=SEARCH_RADIUS, minScore=MIN_TRACKING_SCORE):
+        """Enable the real-time tracking mode of RegisterQuaternion.
+
+        When enabled, each call predicts the fiducial intercepts from the frame pose of the previous successful
+        call and only correlates small windows around them. A full detection is run for the first image, and
+        whenever the tracked fiducials leave their windows or their match score drops below minScore.
+
+        Args:
+            enabled (bool): enable tracking
+            searchRadius (int): half size of the search windows in pixels
+            minScore (float): minimum match score of the tracked fiducials
+        """
+        self.tracking = enabled
+        self.trackingSearchRadius = int(searchRadius)
+        self.trackingMinScore = minScore
+        self.ResetTracking()
+
+    def ResetTracking(self):
+        """Forget the previous pose, so that the next RegisterQuaternion call runs a full detection."""
+        self.trackingPose = None
+        self.tracked = False
+
+    def SetPropagation(self, enabled, maxTrackDistance=MAX_TRACK_DISTANCE):
+        """Enable slice-to-slice propagation of the fiducials in Register.
+
+        When enabled, the fiducials are fully detected in the centre slice of the range only. Towards each end
+        of the range, the intercepts of the next slice are predicted by linear extrapolation of the previous
+        slices and searched in small windows (see SetTracking for the window size and minimum match score),
+        with a full detection when the search fails. The intercepts of each fiducial are then fitted with a 3-D
+        line and slices straying from the lines are rejected.
+
+        Args:
+            enabled (bool): enable propagation
+            maxTrackDistance (float): maximum distance of an intercept from its fitted line, in mm
+        """
+        self.propagation = enabled
+        self.maxTrackDistance = maxTrackDistance
+
+    def SetManualZFrameFiducials(self, zFrameFids):
+        """Use pre-supplied fiducial intercepts instead of detecting them.
+
+        In manual mode, Register and RegisterQuaternion skip the correlation (Init, LocateFiducials, FindMax):
+        the intercepts are put in sequential order with ZFrame.Ordering.OrderFiducials and localized directly.
+
+        Args:
+            zFrameFids (list/numpy.ndarray/dict): numFiducials [x,y] pixel coordinates, in any order, used for
+                every slice, or a dict mapping slice indices to the coordinates of each slice. Register only uses
+                the slices of the range found in the dict; RegisterQuaternion only uses a single set of coordinates.
+        """
+        shape = (self.numFiducials, 2)
+        if isinstance(zFrameFids, dict):
+            fiducials = {int(slindex): np.array(points, dtype=float) for slindex, points in zFrameFids.items()}
+            points = list(fiducials.values())
+        else:
+            fiducials = np.array(zFrameFids, dtype=float)
+            points = [fiducials]
+        for p in points:
+            if p.shape != shape:
+                raise ValueError(f"Expected {shape} fiducial coordinates, got {p.shape}")
+        self.zFrameFids = fiducials
+        self.manualRegistration = True
+
+    def SetAutomaticRegistration(self):
+        """Detect the fiducial intercepts in the images (default)."""
+        self.zFrameFids = None
+        self.manualRegistration = False
+
     def SetInputImage(self, inputImage, transform):
-        self.InputImage = inputImage.astype(int)
+        # Slices are converted to the compute type when they are processed
+        self.InputImage = np.asarray(inputImage)
         self.InputImageDim = list(inputImage.shape)
         self.InputImageTrans = transform
         
     def SetOrientationBase(self, orientation):
         self.ZOrientationBase = orientation
 
-    def Register(self, sliceRange):
+    def Register(self, sliceRange, progress=None, cancel=None):
         """Register Z-frame fiducials across multiple slices and compute average transformation.
         
+        The results of each processed slice are stored in self.sliceResults (see ZFrame.Results) and their
+        match scores in self.matchScores.
+        
         Args:
             range (list): [start_slice, end_slice] range of slices to process
+            progress (callable): called with a ZFrame.Results.SliceProgress after each slice, or None. The frame
+                is localized in each slice as soon as it is processed to give the partial pose; with
+                propagation, the outlier rejection can still drop slices reported as successful.
+            cancel (threading.Event): checked between slices and between stages, or None. When it is set, the
+                registration stops, self.cancelled is set and (False, None, None) is returned.
             
         Returns:
             tuple: (success, Zposition, Zorientation) where:
@@ -221,82 +368,156 @@ class ZFrameRegistration:
                 - Zorientation is a numpy array [x,y,z,w] quaternion of the estimated orientation
         """
         xsize, ysize, zsize = self.InputImageDim
+        self.cancelled = False
+        spacing = self.ImageSpacing()
+        
+        # Detect the fiducials of each slice in range
+        results = NewSliceResults(range(sliceRange[0], sliceRange[1]), self.numFiducials)
+        self.sliceResults = results
+        self.matchScores = {}
+        self.Print(f"Processing slices from {sliceRange[0]} to {sliceRange[1]}")
+        if self.manualRegistration:
+            if self.CheckCancelled(cancel):
+                return False, None, None
+            start = time.perf_counter()
+            self.ManualFiducials(results, self.InputImageDim, spacing)
+            if progress is not None:
+                # The slices are ordered together; each is reported with an even share of the time
+                seconds = (time.perf_counter() - start) / max(1, len(results))
+                for index in range(len(results)):
+                    self.ReportSlice(progress, results, index, seconds)
+        elif self.propagation:
+            if not self.PropagateFiducials(results, spacing, progress, cancel):
+                return False, None, None
+        else:
+            slices = results['slice'].tolist()
+            if any(not 0 <= slindex < zsize for slindex in slices):
+                return False, None, None
+            cache = self.detectionCache or {}
+
+            # Extract and match the candidate peaks of the slices not detected in advance, all slices at once; each
+            # slice is reported with an even share of the extraction time
+            start = time.perf_counter()
+            candidates = self.FindSliceCandidates([slindex for slindex in slices if slindex not in cache],
+                                                  self.numFiducials + EXTRA_CANDIDATES, cancel)
+            if self.CheckCancelled(cancel):
+                return False, None, None
+            matches = self.MatchCandidates(candidates, spacing)
+            extraction = (time.perf_counter() - start) / max(1, len(candidates))
+            for index, slindex in enumerate(slices):
+                if self.CheckCancelled(cancel):
+                    return False, None, None
+                self.Print(f"=== Current Slice Index: {slindex} ===")
+                start = time.perf_counter()
+                if slindex in cache:
+                    self.Print("Registration::Register - fiducials detected in advance.")
+                    results[index] = cache[slindex]
+                elif candidates[slindex] is not None:
+                    self.DetectFiducials(None, self.InputImageDim, spacing, results[index], candidates[slindex],
+                                         matches[slindex])
+                else:
+                    self.Print("ZTrackerTransform::onEventGenerated - Fiducials not detected. "
+                               "No frame lock on this image.")
+                if progress is not None:
+                    seconds = time.perf_counter() - start + (extraction if slindex in candidates else 0.0)
+                    self.ReportSlice(progress, results, index, seconds)
+                self.Print(f"=== End Slice Index: {slindex} ===\n")
+        self.matchScores = MatchScores(results)
+        if self.CheckCancelled(cancel):
+            return False, None, None
         
-        # Get image transformation matrix components
-        tx = self.InputImageTrans[0][0]
-        ty = self.InputImageTrans[1][0]
-        tz = self.InputImageTrans[2][0]
-        sx = self.InputImageTrans[0][1]
-        sy = self.InputImageTrans[1][1]
-        sz = self.InputImageTrans[2][1]
-        nx = self.InputImageTrans[0][2]
-        ny = self.InputImageTrans[1][2]
-        nz = self.InputImageTrans[2][2]
-        px = self.InputImageTrans[0][3]
-        py = self.InputImageTrans[1][3]
-        pz = self.InputImageTrans[2][3]
-        
-        # Normalize vectors
-        psi = np.sqrt(tx*tx + ty*ty + tz*tz)
-        psj = np.sqrt(sx*sx + sy*sy + sz*sz)
-        psk = np.sqrt(nx*nx + ny*ny + nz*nz)
-        ntx, nty, ntz = tx/psi, ty/psi, tz/psi
-        nsx, nsy, nsz = sx/psj, sy/psj, sz/psj
-        nnx, nny, nnz = nx/psk, ny/psk, nz/psk
-
-        # Initialize matrices for averaging quaternions
-        n = 0
-        T = np.zeros((4, 4))  # Symmetric matrix for quaternion averaging
-        P = np.zeros(3)  # Position accumulator
-        
-        # Create transformation matrix
-        matrix = np.eye(4)
-        matrix[0:3, 0] = [ntx, nty, ntz]
-        matrix[0:3, 1] = [nsx, nsy, nsz]
-        matrix[0:3, 2] = [nnx, nny, nnz]
-        
-        # Process each slice in range
-        print(f"Processing slices from {sliceRange[0]} to {sliceRange[1]}")
-        for slindex in range(sliceRange[0], sliceRange[1]):
-            print(f"=== Current Slice Index: {slindex} ===")
-            # Calculate image center offset
-            hfovi = psi * (self.InputImageDim[0]-1) / 2.0
-            hfovj = psj * (self.InputImageDim[1]-1) / 2.0
-            offsetk = psk * slindex
-            
-            # Calculate center coordinates
-            cx = ntx * hfovi + nsx * hfovj + nnx * offsetk
-            cy = nty * hfovi + nsy * hfovj + nny * offsetk
-            cz = ntz * hfovi + nsz * hfovj + nnz * offsetk
-            
-            # Initialize position and quaternion for this slice
-            quaternion = zf.MatrixToQuaternion(matrix)
-            position = [px + cx, py + cy, pz + cz]
-            
-            # Get current slice data
-            if 0 <= slindex < zsize:
-                current_slice = self.InputImage[:, :, slindex]
+        detected = np.flatnonzero(results['detected'])
+        if len(detected) == 0:
+            return False, None, None
+        slices = results['slice'][detected]
+        
+        # Compute the relative pose between the Z-frame and all slices at once, then in RAS
+        framePositions, frameQuaternions, slicePositions, valid = self.LocalizeSlices(results, detected)
+        for slindex, isValid, framePosition, frameQuaternion in zip(slices, valid, framePositions, frameQuaternions):
+            if isValid:
+                self.Print(f"Slice {slindex}:")
+                self.PrintPose(framePosition, frameQuaternion)
             else:
-                return False
-            
-            # Initialize for this slice
-            self.Init(xsize, ysize)
-            
-            # Register this slice
-            spacing = [psi, psj, psk]
-            if self.RegisterQuaternion(position, quaternion, self.ZOrientationBase,
-                                    current_slice, self.InputImageDim, spacing):
-                # Accumulate position
-                P += np.array(position)
-                
-                # Update moment of inertia matrix T
-                q = np.array(quaternion)
-                T += np.outer(q, q)
-                n += 1
-            print(f"=== End Slice Index: {slindex} ===\n")
-                
-        if n <= 0:
+                self.Print(f"Slice {slindex}: could not localize the frame. Skipping this one.")
+        
+        localized = detected[valid]
+        if len(localized) <= 0:
             return False, None, None
+        Zposition, Zorientation = self.AveragePose(results['position'][localized], results['quaternion'][localized])
+        
+        if self.solver == SOLVER_GLOBAL_FIT:
+            if self.CheckCancelled(cancel):
+                return False, None, None
+            # Lift the intercepts of all localized slices into RAS coordinates and fit the frame to all of them,
+            # starting from the averaged closed-form pose
+            coordinates = results['coordinates'][localized]
+            intercepts = np.concatenate([coordinates, np.zeros(coordinates.shape[:-1] + (1,))], axis=-1)
+            points = slicePositions[valid][:, np.newaxis, :] + intercepts @ self.ImageAxes()[:3, :3].T
+            labels = np.tile(np.arange(self.numFiducials), len(coordinates))
+            Zposition, Zorientation, self.fitResidual = FitFramePose(
+                points.reshape(-1, 3), labels, self.topology, Zposition, Zorientation,
+                np.array(self.ZOrientationBase, dtype=float))
+            self.Print(f"ZFrameRegistration - Global fit RMS distance to the line fiducials [mm]: {self.fitResidual}")
+        
+        return True, Zposition, self.AlignSuperior(Zorientation)
+
+    def CheckCancelled(self, cancel):
+        """Return True, and set self.cancelled, if the cancellation event of Register is set."""
+        if cancel is not None and cancel.is_set() and not self.cancelled:
+            self.Print("Registration::Register - cancelled.")
+            self.cancelled = True
+        return self.cancelled
+
+    def ReportSlice(self, progress, results, index, seconds):
+        """Localize the frame in a processed slice and pass its status and the partial pose to progress."""
+        result = results[index]
+        if result['detected']:
+            self.LocalizeSlices(results, np.array([index]))
+        position = quaternion = None
+        localized = results['localized']
+        if np.any(localized):
+            position, quaternion = self.AveragePose(results['position'][localized], results['quaternion'][localized])
+            quaternion = self.AlignSuperior(quaternion)
+        progress(SliceProgress(index, int(result['slice']), bool(result['localized']), seconds, position, quaternion))
+
+    def LocalizeSlices(self, results, indices):
+        """Compute the frame pose in slices with detected fiducials and write it to their records, in place.
+
+        Args:
+            results (numpy.ndarray): results of the slices (see ZFrame.Results)
+            indices (numpy.ndarray): indices of the slices in results
+
+        Returns:
+            tuple: (framePositions, frameQuaternions, slicePositions, valid) where:
+                - framePositions and frameQuaternions are the frame poses relative to the slices
+                - slicePositions are the RAS positions of the slice centres
+                - valid is a boolean array of the slices where the frame was localized
+        """
+        slicePositions = self.SlicePositions(results['slice'][indices])
+        framePositions, frameQuaternions, valid = LocalizeFrames(results['coordinates'][indices], self.topology)
+        positions, quaternions = ComposeSlicePoses(slicePositions, zf.MatrixToQuaternion(self.ImageAxes()),
+                                                   framePositions, frameQuaternions,
+                                                   np.array(self.ZOrientationBase, dtype=float))
+        results['localized'][indices] = valid
+        results['position'][indices[valid]] = positions[valid]
+        results['quaternion'][indices[valid]] = quaternions[valid]
+        return framePositions, frameQuaternions, slicePositions, valid
+
+    @staticmethod
+    def AveragePose(positions, quaternions):
+        """Average the positions and, through the moment of inertia matrix, the quaternions of slices.
+
+        Args:
+            positions (numpy.ndarray): (S, 3) positions, S > 0
+            quaternions (numpy.ndarray): (S, 4) quaternions [x, y, z, w]
+
+        Returns:
+            tuple: (position, quaternion) averages
+        """
+        # Average position and the moment of inertia matrix T of the quaternions
+        n = len(positions)
+        P = np.sum(positions, axis=0)
+        T = np.einsum('si,sj->ij', quaternions, quaternions)
             
         # Average position and normalize T matrix
         P /= float(n)
@@ -307,12 +528,10 @@ class ZFrameRegistration:
         
         # Find maximum eigenvalue index
         max_idx = np.argmax(eigenvals)
+        return P, eigenvecs[:, max_idx]
 
-        # Create output arrays
-        Zposition = P
-        Zorientation = eigenvecs[:, max_idx]
-        
-        # Force alignment with Superior direction (0,0,1)
+    def AlignSuperior(self, Zorientation):
+        """Flip a frame orientation [x, y, z, w] whose Z axis points inferior, so that it points superior."""
         # TODO: This is to ensure orientation is correct. There should be some kind of parameter for this.
         # Convert quaternion to rotation matrix to check orientation
         transform_matrix = np.eye(4)
@@ -323,7 +542,7 @@ class ZFrameRegistration:
         
         # If Z direction is pointing opposite to superior direction (0,0,1)
         if np.dot(z_direction, np.array([0, 0, 1])) < 0:
-            print("ZFrameRegistration - Correcting orientation to point superior")
+            self.Print("ZFrameRegistration - Correcting orientation to point superior")
             rot_matrix = np.array([
                 [-1, 0, 0, 0],
                 [0, 1, 0, 0],
@@ -334,56 +553,240 @@ class ZFrameRegistration:
             new_transform = np.dot(transform_matrix, rot_matrix)
             # Convert back to quaternion
             Zorientation = zf.MatrixToQuaternion(new_transform)
-        
-        return True, Zposition, Zorientation
+        return Zorientation
+
+    def ImageAxes(self):
+        """Return a 4x4 matrix whose first three columns are the unit [i, j, k] axes of the input image in RAS."""
+        matrix = np.eye(4)
+        for c, ps in enumerate(self.ImageSpacing()):
+            matrix[0:3, c] = [self.InputImageTrans[r][c] / ps for r in range(3)]
+        return matrix
+
+    def SlicePositions(self, slices):
+        """Return the (S, 3) RAS positions of the centres of slices of the input image."""
+        psi, psj, psk = self.ImageSpacing()
+        axes = self.ImageAxes()
+        hfovi = psi * (self.InputImageDim[0]-1) / 2.0
+        hfovj = psj * (self.InputImageDim[1]-1) / 2.0
+        offsetk = psk * np.asarray(slices).astype(float)
+        centers = axes[0:3, 0] * hfovi + axes[0:3, 1] * hfovj + np.outer(offsetk, axes[0:3, 2])
+        return np.array([self.InputImageTrans[r][3] for r in range(3)]) + centers
+
+    def ImageSpacing(self):
+        """Return the [x, y, z] pixel spacing of the input image, from the columns of its transform."""
+        T = self.InputImageTrans
+        return [np.sqrt(T[0][c]*T[0][c] + T[1][c]*T[1][c] + T[2][c]*T[2][c]) for c in range(3)]
+
+    def SetDetectionCache(self, results):
+        """Reuse fiducials detected in advance in the same image.
+
+        For the slices found in the cache, Register copies the cached records instead of detecting the fiducials
+        again, so only the localization and averaging run for them. The cache must come from DetectSlices on
+        the same image, topology and precision; the propagation and manual modes do not use it.
+
+        Args:
+            results (numpy.ndarray): results from DetectSlices (see ZFrame.Results), or None to clear the cache
+        """
+        if results is None:
+            self.detectionCache = None
+        else:
+            self.detectionCache = {int(slindex): record for slindex, record in zip(results['slice'], results)}
+
+    def DetectSlices(self, slices, stop=None):
+        """Run the detection stage alone on slices of the input image, e.g. ahead of Register.
+
+        Args:
+            slices (iterable): slice indices; the indices outside the image are left out
+            stop (threading.Event): checked between slices to stop early, or None
+
+        Returns:
+            numpy.ndarray: results of the slices processed (see ZFrame.Results), for SetDetectionCache
+        """
+        zsize = self.InputImageDim[2]
+        slices = [slindex for slindex in slices if 0 <= slindex < zsize]
+        candidates = self.FindSliceCandidates(slices, self.numFiducials + EXTRA_CANDIDATES, stop)
+        results = NewSliceResults(slices[:len(candidates)], self.numFiducials)
+        spacing = self.ImageSpacing()
+        matches = self.MatchCandidates(candidates, spacing)
+        for result in results:
+            slindex = int(result['slice'])
+            if candidates[slindex] is not None:
+                self.DetectFiducials(None, self.InputImageDim, spacing, result, candidates[slindex], matches[slindex])
+        return results
+
+    def FindSliceCandidates(self, slices, maxPeaks, stop=None):
+        """Correlate slices of the input image with the fiducial mask and extract their candidate peaks.
+
+        The peaks of all slices are refined to subpixel accuracy together (see ZFrame.Detection.RefineCandidates).
+
+        Args:
+            slices (list): slice indices inside the image
+            maxPeaks (int): maximum number of peaks per slice
+            stop (threading.Event): checked between slices to stop early, or None
+
+        Returns:
+            dict: candidate peaks of each slice processed, as returned by FindCandidates, in slice order
+        """
+        self.Init(self.InputImageDim[0], self.InputImageDim[1])
+        processed = []
+        correlations = []
+        peaks = []
+        for slindex in slices:
+            if stop is not None and stop.is_set():
+                break
+            current_slice = self.InputImage[:, :, slindex]
+            if self.precision == PRECISION_DOUBLE:
+                current_slice = current_slice.astype(int)
+            processed.append(slindex)
+            PIreal = CorrelationImage(current_slice, self.MaskSpectrum)
+            if PIreal is None:
+                self.Print("ZTrackerTransform::LocateFiducials - divide by zero.")
+                continue
+            correlations.append(PIreal.copy())
+            peaks.append((slindex, ExtractPeaks(PIreal, maxPeaks, verbose=self.verbose)))
+        candidates = dict.fromkeys(processed)
+        refined = RefineCandidates(correlations, [slicePeaks for _, slicePeaks in peaks], self.verbose)
+        candidates.update(zip([slindex for slindex, _ in peaks], refined))
+        return candidates
+
+    def MatchCandidates(self, candidates, spacing=None):
+        """Match the candidate peaks of several slices to the frame topology, all slices at once.
+
+        Args:
+            candidates (dict): candidate peaks of each slice, as returned by FindSliceCandidates
+            spacing (list): [x, y, z] pixel spacing, or None
+
+        Returns:
+            dict: (indices, score) of each slice with candidates (see ZFrame.Detection.MatchFiducials), for
+                DetectFiducials
+        """
+        slices = [slindex for slindex, peaks in candidates.items() if peaks is not None]
+        maxPeaks = self.numFiducials + EXTRA_CANDIDATES
+        matches = MatchSliceFiducials([candidates[slindex][0][:maxPeaks] for slindex in slices],
+                                      [candidates[slindex][1][:maxPeaks] for slindex in slices], self.topology,
+                                      spacing)
+        return dict(zip(slices, matches))
+
+    def PropagateFiducials(self, results, spacing, progress=None, cancel=None):
+        """Detect the fiducials in the centre slice and propagate them through the slice range.
+
+        Args:
+            results (numpy.ndarray): results of consecutive slices (see ZFrame.Results), written in place
+            spacing (list): [x, y, z] pixel spacing
+            progress (callable): progress callback of Register, or None
+            cancel (threading.Event): cancellation event of Register, or None
+
+        Returns:
+            bool: False if the slices are out of the image or the propagation was cancelled
+        """
+        xsize, ysize, zsize = self.InputImageDim
+        slices = results['slice']
+        if len(slices) == 0:
+            return True
+        if slices[0] < 0 or slices[-1] >= zsize:
+            return False
+        self.Init(xsize, ysize)
+
+        # Propagate from the centre slice towards each end of the range; each direction has its own track of
+        # pixel coordinates, starting from the centre slice
+        centre = (len(results) - 1) // 2
+        for indices in (range(centre, len(results)), range(centre - 1, -1, -1)):
+            track = [(int(slices[centre]), results[centre]['pixels'])] if results[centre]['detected'] else []
+            for index in indices:
+                if self.CheckCancelled(cancel):
+                    return False
+                result = results[index]
+                slindex = int(result['slice'])
+                self.Print(f"=== Current Slice Index: {slindex} ===")
+                start = time.perf_counter()
+                current_slice = self.InputImage[:, :, slindex]
+                if self.precision == PRECISION_DOUBLE:
+                    current_slice = current_slice.astype(int)
+
+                predicted = ExtrapolateTrack(track, slindex)
+                if predicted is not None:
+                    if self.SearchPredictedFiducials(current_slice, self.InputImageDim, spacing, predicted, result):
+                        self.Print(f"Registration::PropagateFiducials - match score: {self.matchScore:.3f}")
+                    else:
+                        self.Print("Registration::PropagateFiducials - lost track, running a full detection.")
+                if not result['tracked']:
+                    self.DetectFiducials(current_slice, self.InputImageDim, spacing, result)
+                if result['detected']:
+                    track.append((slindex, result['pixels']))
+                if progress is not None:
+                    self.ReportSlice(progress, results, index, time.perf_counter() - start)
+                self.Print(f"=== End Slice Index: {slindex} ===\n")
+
+        # Reject the slices whose intercepts stray from the 3-D lines fitted to the fiducial tracks
+        detected = np.flatnonzero(results['detected'])
+        if len(detected) > 2:
+            kept = RejectTrackOutliers(slices[detected], results['coordinates'][detected], spacing[2],
+                                       self.maxTrackDistance)
+            for slindex in slices[detected[~kept]]:
+                self.Print(f"Slice {slindex}: intercepts off the fiducial tracks. Skipping this one.")
+            results['detected'][detected[~kept]] = False
+            results['localized'][detected[~kept]] = False
+        return True
+
+    def ManualFiducials(self, results, dimension, spacing):
+        """Order the manual fiducial intercepts of slices and convert them to spatial coordinates.
+
+        The points of all slices are ordered and their geometry checked at once (see CheckFiducialGeometry), so
+        slices with misplaced points are left out before the frame is localized. Their match score is the
+        geometric part of ZFrame.Detection.ScoreLabelings, with all peak values set to 1.
+
+        Args:
+            results (numpy.ndarray): results of the slices (see ZFrame.Results), written in place
+            dimension (list): [x, y, z] image dimensions
+            spacing (list): [x, y, z] pixel spacing
+        """
+        slices = results['slice'].tolist()
+        if isinstance(self.zFrameFids, dict):
+            indices = np.array([index for index, slindex in enumerate(slices) if slindex in self.zFrameFids],
+                               dtype=int)
+            for slindex in np.delete(results['slice'], indices):
+                self.Print(f"Slice {slindex}: no manual fiducials. Skipping this one.")
+            if len(indices) == 0:
+                return
+            results['pixels'][indices] = [self.zFrameFids[slices[index]] for index in indices]
+        else:
+            indices = np.arange(len(results))
+            results['pixels'] = self.zFrameFids
+
+        order, valid = OrderFiducials(results['pixels'][indices], self.topology.layout)
+        pixels = ApplyOrder(results['pixels'][indices], order)
+        for slindex in results['slice'][indices[~valid]]:
+            self.Print(f"Slice {slindex}: manual fiducials do not match the frame layout. Skipping this one.")
+        geometry = self.CheckFiducialGeometry(pixels, dimension[0], dimension[1])
+        for slindex in results['slice'][indices[valid & ~geometry]]:
+            self.Print(f"Slice {slindex}: bad manual fiducial geometry. Skipping this one.")
+        valid &= geometry
+        results['pixels'][indices] = pixels
+        results['order'][indices] = order
+        results['values'][indices] = 1.0
+        results['score'][indices] = np.where(valid, ScoreLabelings(pixels, results['values'][indices],
+                                                                   self.topology, spacing), 0.0)
+        results['detected'][indices] = valid
+
+        # Same convention as DetectFiducials: image origin at the center, scaled by the pixel size
+        centre = np.array([dimension[0] / 2, dimension[1] / 2], dtype=float)
+        results['coordinates'][indices] = (pixels - centre) * np.array(spacing[:2], dtype=float)
 
     def Init(self, xsize, ysize):
-        """Initialize correlation kernel and perform FFT operations for fiducial detection.
+        """Initialize the correlation mask and its spectrum for fiducial detection.
         
         Args:
             xsize (int): Width of the image
             ysize (int): Height of the image
         """
-        # Define 11x11 correlation kernel for fiducial detection
-        kernel = np.array([
-            [0.0, 0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 0.0, 0.0, 0.0, 0.0],
-            [0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0, 0.0],
-            [0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0],
-            [0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0],
-            [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
-            [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
-            [0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5],
-            [0.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.0],
-            [0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0],
-            [0.0, 0.0, 0.5, 1.0, 1.0, 1.0, 1.0, 1.0, 0.5, 0.0, 0.0],
-            [0.0, 0.0, 0.0, 0.0, 0.5, 0.5, 0.5, 0.0, 0.0, 0.0, 0.0]
-        ])
-
-        # Create mask image and initialize to zero
-        self.MaskImage = np.zeros((xsize, ysize))
-        
-        # Copy correlation kernel to center of mask image
-        x_start = (xsize // 2) - 5
-        y_start = (ysize // 2) - 5
-        self.MaskImage[x_start:x_start+11, y_start:y_start+11] = kernel
-
-        # Transform mask to frequency domain using FFT
-        # Note: numpy's fft2 automatically handles the complex components
-        mask_fft = fft2(self.MaskImage)
-        
-        # Get real and imaginary components
-        self.MFreal = np.real(mask_fft)
-        self.MFimag = np.imag(mask_fft)
-        
-        # Conjugate and normalize the mask
-        self.MFimag *= -1
-        max_absolute = np.max(np.abs(mask_fft))
-        self.MFreal /= max_absolute
-        self.MFimag /= max_absolute
+        # The conjugated, normalized spectrum of the correlation mask is shared by all instances
+        self.MaskImage, self.MaskSpectrum = MaskSpectrum(xsize, ysize, self.precision)
 
     def RegisterQuaternion(self, position, quaternion, ZquaternionBase, SourceImage, dimension, spacing):
         """Register the Z-frame using quaternion representation.
         
+        The results of the image are stored in self.sliceResults, as slice 0 (see ZFrame.Results).
+        
         Args:
             position (list): [x, y, z] position vector
             quaternion (list): [x, y, z, w] current orientation quaternion
@@ -400,33 +803,31 @@ class ZFrameRegistration:
         Iorientation = np.array(quaternion)
         ZorientationBase = np.array(ZquaternionBase)
         
-        # Find the self.numFiducials Z-frame fiducial intercept artifacts in the image
-        print("ZTrackerTransform - Searching fiducials...")
-        Zcoordinates, tZcoordinates = self.LocateFiducials(SourceImage, dimension[0], dimension[1])
-        if Zcoordinates is None:
-            print("ZTrackerTransform::onEventGenerated - Fiducials not detected. No frame lock on this image.")
-            return False
-        
-        # Check that the fiducial geometry makes sense
-        print("ZTrackerTransform - Checking the fiducial geometries...")
-        if not self.CheckFiducialGeometry(Zcoordinates, dimension[0], dimension[1]):
-            print("ZTrackerTransform::onEventGenerated - Bad fiducial geometry. No frame lock on this image.")
+        # Find the Z-frame fiducial intercepts in the image, in mm from the image centre
+        self.sliceResults = NewSliceResults([0], self.numFiducials)
+        result = self.sliceResults[0]
+        self.tracked = False
+        if self.manualRegistration:
+            if isinstance(self.zFrameFids, dict):
+                self.Print("Registration::RegisterQuaternion - manual fiducials given per slice can only be used by "
+                           "Register.")
+            else:
+                self.ManualFiducials(self.sliceResults, dimension, spacing)
+        else:
+            if self.tracking and self.trackingPose is not None:
+                self.TrackFiducials(SourceImage, dimension, spacing, Iposition, Iorientation, result)
+            self.tracked = bool(result['tracked'])
+            if not self.tracked:
+                self.DetectFiducials(SourceImage, dimension, spacing, result)
+        if not result['detected']:
+            self.trackingPose = None
             return False
         
-        # Transform pixel coordinates into spatial coordinates
-        for i in range(self.numFiducials):
-            # Put the image origin at the center
-            tZcoordinates[i][0] = float(tZcoordinates[i][0]) - float(dimension[0]/2)
-            tZcoordinates[i][1] = float(tZcoordinates[i][1]) - float(dimension[1]/2)
-            
-            # Scale coordinates by pixel size
-            tZcoordinates[i][0] *= spacing[0]
-            tZcoordinates[i][1] *= spacing[1]
-        
         # Compute relative pose between the Z-frame and the current image
-        Zposition, Zorientation = self.LocalizeFrame(tZcoordinates)
+        Zposition, Zorientation = self.LocalizeFrame(result['coordinates'])
         if Zposition is None or Zorientation is None:
-            print("ZTrackerTransform::onEventGenerated - Could not localize the frame. Skipping this one.")
+            self.Print("ZTrackerTransform::onEventGenerated - Could not localize the frame. Skipping this one.")
+            self.trackingPose = None
             return False
         
         # Compute the Z-frame position in the image (RAS) coordinate system
@@ -436,9 +837,14 @@ class ZFrameRegistration:
         
         # Combine orientations
         Zorientation = zf.QuaternionMultiply(Iorientation, Zorientation)
+        if self.tracking:
+            self.trackingPose = (Zposition, Zorientation)
         
         # Calculate rotation from the base orientation
         Zorientation = zf.QuaternionDivide(Zorientation, ZorientationBase)
+        result['localized'] = True
+        result['position'] = Zposition
+        result['quaternion'] = Zorientation
         
         # Update the output parameters
         position[0] = Zposition[0]
@@ -451,436 +857,228 @@ class ZFrameRegistration:
         
         return True
 
-    def LocateFiducials(self, SourceImage, xsize, ysize):
-        """Locate the seven line fiducial intercepts in the Z-frame.
-        
+    def TrackFiducials(self, SourceImage, dimension, spacing, position, quaternion, result=None):
+        """Search the fiducial intercepts around the positions predicted from the previous frame pose.
+
         Args:
-            SourceImage (numpy.ndarray): Input image matrix
-            xsize (int): Width of the image in pixels
-            ysize (int): Height of the image in pixels
-            
+            SourceImage (numpy.ndarray): Input image data
+            dimension (list): [x, y, z] image dimensions
+            spacing (list): [x, y, z] pixel spacing
+            position (numpy.ndarray): [x, y, z] RAS position of the image centre
+            quaternion (numpy.ndarray): [x, y, z, w] orientation of the image
+            result (numpy.void): record of the image (see ZFrame.Results), written in place, or None
+
         Returns:
-            tuple: (Zcoordinates, tZcoordinates) where each is a list of 7 [x,y] coordinates,
-                or (None, None) if detection fails
+            numpy.ndarray: (numFiducials, 2) coordinates in mm relative to the image centre, or None to fall back
+                to a full detection
         """
-        # Initialize coordinate arrays
-        Zcoordinates = [[0, 0] for _ in range(self.numFiducials)]
-        tZcoordinates = [[0.0, 0.0] for _ in range(self.numFiducials)]
+        if result is None:
+            result = NewSliceResults([0], self.numFiducials)[0]
+        framePosition, frameQuaternion = FramePoseInImage(self.trackingPose[0], self.trackingPose[1], position,
+                                                          quaternion)
+        predicted, valid = PredictIntercepts(framePosition, frameQuaternion, self.topology)
+        if not valid:
+            return None
         
-        # Transform the MR image to frequency domain (k-space)
-        image_fft = fft2(SourceImage)
-        IFreal = np.real(image_fft)
-        IFimag = np.imag(image_fft)
+        # Same pixel convention as DetectFiducials: image origin at the center, scaled by the pixel size
+        centre = np.array([dimension[0] / 2, dimension[1] / 2], dtype=float)
+        predicted = predicted / np.array(spacing[:2], dtype=float) + centre
+        if not self.SearchPredictedFiducials(SourceImage, dimension, spacing, predicted, result):
+            self.Print(f"Registration::TrackFiducials - lost track (match score: {self.matchScore:.3f}), "
+                       f"running a full detection.")
+            return None
+        self.Print(f"Registration::TrackFiducials - match score: {self.matchScore:.3f}")
+        return result['coordinates']
+
+    def SearchPredictedFiducials(self, SourceImage, dimension, spacing, predicted, result):
+        """Search the fiducial intercepts in small windows around predicted pixel positions.
+
+        The match score is stored in self.matchScore.
+
+        Args:
+            SourceImage (numpy.ndarray): Input image data
+            dimension (list): [x, y, z] image dimensions
+            spacing (list): [x, y, z] pixel spacing
+            predicted (numpy.ndarray): (numFiducials, 2) predicted intercepts in pixels, in fiducial order
+            result (numpy.void): record of the image (see ZFrame.Results), written in place
+
+        Returns:
+            bool: True if the intercepts were found with a match score of at least self.trackingMinScore
+        """
+        pixels, self.matchScore = SearchFiducials(np.asarray(SourceImage), predicted, self.topology, spacing,
+                                                  self.trackingSearchRadius)
+        result['score'] = self.matchScore
+        if pixels is None or self.matchScore < self.trackingMinScore:
+            return False
+        if not self.CheckFiducialGeometry(pixels, dimension[0], dimension[1]):
+            self.Print("Registration::SearchPredictedFiducials - bad fiducial geometry.")
+            return False
+        centre = np.array([dimension[0] / 2, dimension[1] / 2], dtype=float)
+        result['pixels'] = pixels
+        result['coordinates'] = (pixels - centre) * np.array(spacing[:2], dtype=float)
+        result['detected'] = True
+        result['tracked'] = True
+        return True
+
+    def DetectFiducials(self, SourceImage, dimension, spacing, result=None, candidates=None, match=None):
+        """Locate and check the fiducial intercepts of one slice.
         
-        # Normalize the image
-        max_absolute = np.max(np.abs(image_fft))
-        if max_absolute < self.MEPSILON:
-            print("ZTrackerTransform::LocateFiducials - divide by zero.")
-            return None, None
+        Args:
+            SourceImage (numpy.ndarray): Input image data
+            dimension (list): [x, y, z] image dimensions
+            spacing (list): [x, y, z] pixel spacing
+            result (numpy.void): record of the slice (see ZFrame.Results), written in place, or None
+            candidates (tuple): candidate peaks of the slice found in advance (see FindCandidates), or None
+            match (tuple): match of the candidates found in advance (see MatchCandidates), or None
             
-        IFreal /= max_absolute
-        IFimag /= max_absolute
+        Returns:
+            numpy.ndarray: (numFiducials, 2) coordinates in mm relative to the image centre, or None if
+                detection fails
+        """
+        if result is None:
+            result = NewSliceResults([0], self.numFiducials)[0]
         
-        # Pointwise multiply Image and Mask in k-space
-        PFreal = IFreal * self.MFreal - IFimag * self.MFimag
-        PFimag = IFreal * self.MFimag + IFimag * self.MFreal
+        # Find the self.numFiducials Z-frame fiducial intercept artifacts in the image
+        self.Print("ZTrackerTransform - Searching fiducials...")
+        Zcoordinates, tZcoordinates = self.LocateFiducials(SourceImage, dimension[0], dimension[1], spacing, result,
+                                                           candidates, match)
+        if Zcoordinates is None:
+            self.Print("ZTrackerTransform::onEventGenerated - Fiducials not detected. No frame lock on this image.")
+            return None
         
-        # Invert product back to spatial domain
-        product_ifft = ifft2(PFreal + 1j * PFimag)
-        PIreal = np.real(product_ifft)
+        # Check that the fiducial geometry makes sense
+        self.Print("ZTrackerTransform - Checking the fiducial geometries...")
+        if not self.CheckFiducialGeometry(tZcoordinates, dimension[0], dimension[1]):
+            self.Print("ZTrackerTransform::onEventGenerated - Bad fiducial geometry. No frame lock on this image.")
+            return None
         
-        # FFTSHIFT: exchange diagonally-opposite image quadrants
-        PIreal = np.fft.fftshift(PIreal)
+        # Transform pixel coordinates into spatial coordinates: put the image origin at the center and scale
+        # the coordinates by the pixel size
+        centre = np.array([dimension[0] / 2, dimension[1] / 2], dtype=float)
+        result['coordinates'] = (result['pixels'] - centre) * np.array(spacing[:2], dtype=float)
+        result['detected'] = True
+        return result['coordinates']
+
+    def LocateFiducials(self, SourceImage, xsize, ysize, spacing=None, result=None, candidates=None, match=None):
+        """Locate the line fiducial intercepts in the Z-frame.
         
-        # Normalize result
-        max_absolute = np.max(np.abs(PIreal))
-        if max_absolute < self.MEPSILON:
-            print("ZTrackerTransform::LocateFiducials - divide by zero.")
-            return None, None
-            
-        PIreal /= max_absolute
+        The match score of the detected fiducials is stored in self.matchScore.
         
-        # Find the top self.numFiducials peak image values
-        peak_count = 0
-        for i in range(self.numFiducials):
-            # Find next peak value and its coordinates
-            peak_val, peak_coords = self.FindMax(PIreal)
-            Zcoordinates[i] = list(peak_coords)
-            
-            # Define block neighborhood around peak
-            rstart = max(0, peak_coords[0] - 10)
-            rstop = min(xsize - 1, peak_coords[0] + 10)
-            cstart = max(0, peak_coords[1] - 10)
-            cstop = min(ysize - 1, peak_coords[1] + 10)
+        Args:
+            SourceImage (numpy.ndarray): Input image matrix
+            xsize (int): Width of the image in pixels
+            ysize (int): Height of the image in pixels
+            spacing (list): Optional [x, y] pixel spacing, used to check the distance between fiducials
+            result (numpy.void): record of the slice (see ZFrame.Results), whose pixels, values, prominence,
+                order and score are written in place, or None
+            candidates (tuple): (coordinates, values, prominences) peaks returned by FindCandidates for the
+                image, used instead of correlating SourceImage, or None
+            match (tuple): (indices, score) of the candidates returned by MatchCandidates, used instead of
+                matching them here, or None
             
-            # Check if this is a local maximum
-            if peak_val < self.MEPSILON:
-                print("Registration::OrderFidPoints - peak value is zero.")
+        Returns:
+            tuple: (Zcoordinates, tZcoordinates) where Zcoordinates is a (numFiducials, 2) array of integer
+                pixel coordinates and tZcoordinates the (numFiducials, 2) subpixel coordinates of the record,
+                or (None, None) if detection fails
+        """
+        self.matchScore = 0.0
+        if result is None:
+            result = NewSliceResults([0], self.numFiducials)[0]
+        result['score'] = 0.0
+        
+        # Extract more peaks than fiducials and keep the subset and labeling that best matches the frame
+        if candidates is None:
+            candidates = self.FindCandidates(SourceImage, self.numFiducials + EXTRA_CANDIDATES)
+            if candidates is None:
                 return None, None
-                
-            # Check peak prominence
-            offpeak1 = (peak_val - PIreal[rstart, cstart]) / peak_val
-            offpeak2 = (peak_val - PIreal[rstart, cstop]) / peak_val
-            offpeak3 = (peak_val - PIreal[rstop, cstart]) / peak_val
-            offpeak4 = (peak_val - PIreal[rstop, cstop]) / peak_val
-            
-            if offpeak1 < 0.3 or offpeak2 < 0.3 or offpeak3 < 0.3 or offpeak4 < 0.3:
-                i -= 1  # Try again for this index
-                print("Registration::LocateFiducials - Bad Peak.")
-                peak_count += 1
-                if peak_count > 10:
-                    return None, None
-                continue
-                
-            # Find subpixel coordinates of the peak
-            tZcoordinates[i] = self.FindSubPixelPeak(
-                peak_coords,
-                peak_val,
-                PIreal[peak_coords[0]-1, peak_coords[1]],
-                PIreal[peak_coords[0]+1, peak_coords[1]],
-                PIreal[peak_coords[0], peak_coords[1]-1],
-                PIreal[peak_coords[0], peak_coords[1]+1]
-            )
-            
-            # Zero out this peak region
-            PIreal[rstart:rstop+1, cstart:cstop+1] = 0.0
-        
-        # Find center of the pattern
-        center = self.FindFidCentre(tZcoordinates)
-        
-        # Find corner points and order all points
-        self.FindFidCorners(tZcoordinates, center)
-        self.OrderFidPoints(tZcoordinates, center[0], center[1])
-        
-        # Update integer coordinates
-        for i in range(self.numFiducials):
-            Zcoordinates[i] = [int(tZcoordinates[i][0]), int(tZcoordinates[i][1])]
+        # Peaks come in decreasing order and each one is found regardless of how many follow, so the first
+        # peaks of a longer list are those extracted for this frame
+        candidates, values, prominences = (a[:self.numFiducials + EXTRA_CANDIDATES] for a in candidates)
+        if len(candidates) < self.numFiducials:
+            self.Print("Registration::LocateFiducials - not enough peaks.")
+            return None, None
+        if match is None:
+            match = MatchFiducials(candidates, values, self.topology, spacing)
+        indices, self.matchScore = match
+        result['score'] = self.matchScore
+        self.Print(f"Registration::LocateFiducials - match score: {self.matchScore:.3f}")
+        if indices is None or self.matchScore < MIN_MATCH_SCORE:
+            self.Print("Registration::LocateFiducials - fiducial points do not match the frame layout.")
+            return None, None
+        result['pixels'] = candidates[indices]
+        result['values'] = values[indices]
+        result['prominence'] = prominences[indices]
+        result['order'] = indices
         
-        return Zcoordinates, tZcoordinates
+        # Integer coordinates
+        return result['pixels'].astype(int), result['pixels']
+
+    def FindCandidates(self, SourceImage, maxPeaks):
+        """Correlate an image with the fiducial mask (see Init) and extract its candidate peaks.
 
-    def FindSubPixelPeak(self, peak_coords, Y0, Yx1, Yx2, Yy1, Yy2):
-        """Find the subpixel coordinates of the peak using parabolic fitting.
-        
         Args:
-            peak_coords (list): [x, y] integer coordinates of the peak
-            Y0 (float): Peak value
-            Yx1 (float): Value at x+1
-            Yx2 (float): Value at x-1
-            Yy1 (float): Value at y+1
-            Yy2 (float): Value at y-1
-        
+            SourceImage (numpy.ndarray): Input image matrix
+            maxPeaks (int): maximum number of peaks
+
         Returns:
-            list: [x, y] coordinates with subpixel accuracy
+            tuple: (coordinates, values, prominences) from ZFrame.Detection.FindPeaks, or None if the
+                correlation fails
         """
-        # Calculate subpixel shifts using parabolic fitting
-        Xshift = (0.5 * (Yx1 - Yx2)) / (Yx1 + Yx2 - 2.0 * Y0)
-        Yshift = (0.5 * (Yy1 - Yy2)) / (Yy1 + Yy2 - 2.0 * Y0)
-        
-        # Check if shifts are within valid range
-        if abs(Xshift) > 1.0 or abs(Yshift) > 1.0:
-            print("Registration::FindSubPixelPeak - subpixel peak out of range.")
-            return [float(peak_coords[0]), float(peak_coords[1])]
-        
-        # Return coordinates with subpixel accuracy
-        return [float(peak_coords[0]) + Xshift, float(peak_coords[1]) + Yshift]
+        # Correlate the image with the fiducial mask
+        PIreal = CorrelationImage(SourceImage, self.MaskSpectrum)
+        if PIreal is None:
+            self.Print("ZTrackerTransform::LocateFiducials - divide by zero.")
+            return None
+        return FindPeaks(PIreal, maxPeaks, verbose=self.verbose)
 
     def CheckFiducialGeometry(self, Zcoordinates, xsize, ysize):
         """Check the geometry of the fiducial pattern to be sure that it is valid.
         
+        The test is driven by the frame topology (see ZFrame.Detection.CheckGeometry) and runs on the point sets
+        of any number of slices at once.
+        
         Args:
-            Zcoordinates (list): List of seven [x,y] fiducial coordinates
+            Zcoordinates (numpy.ndarray): (numFiducials, 2) [x,y] fiducial coordinates in pixels, in fiducial
+                order, or (S, numFiducials, 2) for S slices
             xsize (int): Width of the image in pixels
             ysize (int): Height of the image in pixels
             
         Returns:
-            bool: True if the point geometry is valid, False otherwise
+            numpy.ndarray: True where the point geometry is valid, False otherwise
         """
-        # First check that the coordinates are in range
-        for coord in Zcoordinates:
-            if (coord[0] < 0 or coord[0] >= ysize or 
-                coord[1] < 0 or coord[1] >= xsize):
-                print("Registration::CheckFiducialGeometry - fiducial coordinates out of range.")
-                return False
-
-        # Helper function to create normalized vector between two points
-        def get_normalized_vector(p1, p2):
-            vector = np.array([p2[0] - p1[0], p2[1] - p1[1]])
-            norm = np.linalg.norm(vector)
-            return vector / norm if norm != self.MEPSILON else vector
-
-        # Get corner points
-        P1 = np.array(Zcoordinates[0])
-        P3 = np.array(Zcoordinates[2])
-        P5 = np.array(Zcoordinates[4])
-        P7 = np.array(Zcoordinates[6])
-
-        # Calculate normalized direction vectors
-        D71 = get_normalized_vector(P1, P7)
-        D53 = get_normalized_vector(P3, P5)
-        D13 = get_normalized_vector(P3, P1)
-        D75 = get_normalized_vector(P5, P7)
-
-        # Check that opposite edges are within 10 degrees of parallel
-        # using dot product (cos of angle between vectors)
-        dotp = np.dot(D71, D53)
-        dotp = abs(dotp)
-        if dotp < np.cos(5.0 * np.pi / 180.0):
-            return False
+        return CheckGeometry(Zcoordinates, self.topology, [xsize, ysize])
 
-        dotp = np.dot(D13, D75)
-        dotp = abs(dotp)
-        if dotp < np.cos(5.0 * np.pi / 180.0):
-            return False
+    def OrderFidPoints(self, points):
+        """Put the fiducial coordinate point list in sequential order.
 
-        return True
+        Corners and in-between fiducials are matched against the cross-section layout of the frame
+        topology (see ZFrame.Ordering.OrderFiducials).
 
-    def FindFidCentre(self, points):
-        """Find the centre of the fiducial pattern.
-        
-        A cross-sectional image will intercept each of the Z-frame's seven line fiducials.
-        Once these seven intercepts are detected, this method computes the centre of the
-        region bounded by these points.
-        
         Args:
-            points (list): List of seven [x,y] fiducial coordinates
-            
-        Returns:
-            list: [x, y] coordinates of the center point
-        """
-        # Initialize min/max values with the first point
-        minrow = maxrow = points[0][0]
-        mincol = maxcol = points[0][1]
-        
-        # Find the bounding rectangle
-        for point in points:
-            # Find minimum and maximum row coordinates
-            minrow = min(minrow, point[0])
-            maxrow = max(maxrow, point[0])
-            
-            # Find minimum and maximum column coordinates
-            mincol = min(mincol, point[1])
-            maxcol = max(maxcol, point[1])
-        
-        # Return center of bounding rectangle
-        rmid = (minrow + maxrow)/2.0
-        cmid = (mincol + maxcol)/2.0
-        return rmid, cmid
+            points (list/numpy.ndarray): numFiducials [x,y] fiducial coordinates, reordered in place
 
-    def FindFidCorners(self, points, pmid):
-        """Identify the four corner fiducials based on Z-frame geometry.
-        
-        Args:
-            points (list): List of seven [x,y] fiducial coordinates
-            pmid (tuple): (x,y) coordinates of the center point
-        """
-        # Compute distances between each fiducial and the midpoint
-        distances = [self.CoordDistance(point, pmid) for point in points]
-        
-        # Sort points by distance from center (descending order)
-        # Use bubble sort to match original implementation
-        swapped = True
-        while swapped:
-            swapped = False
-            for i in range(6):  # len(points)-1
-                if distances[i] < distances[i+1]:
-                    # Swap distances
-                    distances[i], distances[i+1] = distances[i+1], distances[i]
-                    # Swap corresponding coordinates
-                    points[i], points[i+1] = points[i+1], points[i]
-                    swapped = True
-        
-        # Choose the order of the corners based on their separation distance
-        # First find the closest point to first corner in the list
-        pdist1 = self.CoordDistance(points[0], points[1])
-        pdist2 = self.CoordDistance(points[0], points[2])
-        
-        # Swap points[1] and points[2] if needed
-        if pdist1 > pdist2:
-            points[1], points[2] = points[2], points[1]
-        
-        # Find closest point (of third or fourth) to second corner in list
-        pdist1 = self.CoordDistance(points[1], points[2])
-        pdist2 = self.CoordDistance(points[1], points[3])
-        
-        # Swap points[2] and points[3] if needed
-        if pdist1 > pdist2:
-            points[2], points[3] = points[3], points[2]
-
-    def CoordDistance(self, p1, p2):
-        """Calculate Euclidean distance between two points.
-        
-        Args:
-            p1 (list/array): First point coordinates [x, y]
-            p2 (list/array): Second point coordinates [x, y]
-            
         Returns:
-            float: Euclidean distance between the points
-        """
-        dx = p1[0] - p2[0]
-        dy = p1[1] - p2[1]
-        return np.sqrt(dx*dx + dy*dy)
-
-    def OrderFidPoints(self, points, rmid, cmid):
-        """Put the fiducial coordinate point list in sequential order by matching the
-        three remaining points to their neighboring ordered corner points.
-        
-        Args:
-            points (list): List of seven [x,y] fiducial coordinates
-            rmid (float): The center of the fiducial pattern in the row coordinate
-            cmid (float): The center of the fiducial pattern in the column coordinate
+            bool: True if the points match the layout, False otherwise
         """
-        if self.numFiducials == 7:
-            # Initialize prototype index lists
-            pall = [0, -1, 1, -1, 2, -1, 3, -1, 0]  # prototype index list for all points
-            pother = [4, 5, 6]  # indices of points other than corners
-                
-            # Find fiducial points that fit between the corners
-            for i in range(0, 7, 2):
-                for j in range(3):
-                    if pother[j] == -1:
-                        # This point has already been placed
-                        continue
-                        
-                    cdist = self.CoordDistance(points[pall[i]], points[pall[i+2]])
-                    pdist1 = self.CoordDistance(points[pall[i]], points[pother[j]])
-                    pdist2 = self.CoordDistance(points[pall[i+2]], points[pother[j]])
-                    
-                    # Check for divide by zero
-                    if cdist < self.MEPSILON:
-                        print("Registration::OrderFidPoints - divide by zero.")
-                        continue
-                        
-                    if ((pdist1 + pdist2) / cdist) < 1.05:
-                        pall[i+1] = pother[j]
-                        pother[j] = -1
-                        break
-            
-            # Find the -1 that marks the two corner points without an intermediate fiducial
-            for i in range(1, 9):
-                if pall[i] == -1:
-                    break
-            
-            # Determine direction to order points (clockwise in image)
-            d1x = points[pall[0]][0] - rmid
-            d1y = points[pall[0]][1] - cmid
-            d2x = points[pall[2]][0] - rmid
-            d2y = points[pall[2]][1] - cmid
-            nvecz = (d1x * d2y - d2x * d1y)
-            
-            # Set direction based on z-coordinate
-            direction = -1 if nvecz < 0 else 1
-            
-            # Create new ordered point list
-            pall2 = []
-            curr_i = i
-            for _ in range(7):
-                curr_i += direction
-                if curr_i == -1:
-                    curr_i = 7
-                if curr_i == 9:
-                    curr_i = 1
-                pall2.append(pall[curr_i])
-            
-            # Create temporary points array and copy ordered points
-            points_temp = [[points[idx][0], points[idx][1]] for idx in pall2]
-            
-            # Update original points array with ordered points
-            for i in range(7):
-                points[i][0] = points_temp[i][0]
-                points[i][1] = points_temp[i][1]
-        elif self.numFiducials == 9:
-            # Initialize arrays for sorting
-            sorter_array = [9, 1, 4, 6, 0, 0, 0, 0, 0]  # Initial indices for corner points
-            sorted_points = [True, True, True, True, False, False, False, False, False]
-            
-            # Find the 5 remaining non-corner fiducial points (Fid 2, 3, 5, 7, 8)
-            
-            # First, find point closest to points[1] (either Fid #1 or Fid #9)
-            shortest_dist = 10000
-            closest_index = 0
-            
-            for i in range(4, 9):
-                coord_dist = self.CoordDistance(points[1], points[i])
-                if coord_dist < shortest_dist:
-                    shortest_dist = coord_dist
-                    closest_index = i
-            
-            sorter_array[closest_index] = 2  # Label index in sorter array
-            sorted_points[closest_index] = True
-            
-            # Find second closest point to points[1] (either Fid #2 or Fid #8)
-            shortest_dist = 10000
-            for i in range(4, 9):
-                if not sorted_points[i]:
-                    coord_dist = self.CoordDistance(points[1], points[i])
-                    if coord_dist < shortest_dist:
-                        shortest_dist = coord_dist
-                        closest_index = i
-            
-            sorter_array[closest_index] = 3
-            sorted_points[closest_index] = True
-            
-            # Find point closest to points[2] (center of top row - Fid #5)
-            shortest_dist = 10000
-            for i in range(4, 9):
-                if not sorted_points[i]:
-                    coord_dist = self.CoordDistance(points[2], points[i])
-                    if coord_dist < shortest_dist:
-                        shortest_dist = coord_dist
-                        closest_index = i
-            
-            sorter_array[closest_index] = 5
-            sorted_points[closest_index] = True
-            
-            # Find point closest to points[0] (Fid #8 if points[0] is Fid #9; Fid #2 otherwise)
-            shortest_dist = 10000
-            for i in range(4, 9):
-                if not sorted_points[i]:
-                    coord_dist = self.CoordDistance(points[0], points[i])
-                    if coord_dist < shortest_dist:
-                        shortest_dist = coord_dist
-                        closest_index = i
-            
-            sorter_array[closest_index] = 8
-            sorted_points[closest_index] = True
-            
-            # Last unsorted point is Fid #7 or Fid #3
-            for i in range(4, 9):
-                if not sorted_points[i]:
-                    sorter_array[i] = 7
-                    sorted_points[i] = True
-            
-            # Sort points based on sorter_array
-            # Create list of (index, point) pairs
-            pairs = [(sorter_array[i], [points[i][0], points[i][1]]) 
-                    for i in range(9)]
-            
-            # Sort pairs based on index
-            pairs.sort(key=lambda x: x[0])
-            
-            # Update points with sorted coordinates
-            for i in range(9):
-                points[i][0] = pairs[i][1][0]
-                points[i][1] = pairs[i][1][1]
-            
-            # Order points so first fiducial is at bottom left corner
-            if points[0][0] > points[8][0]:
-                # Reverse array if x-coordinate of first point is greater than last
-                points.reverse()
-            
-            # Debug output
-            print("points[]:")
-            for i in range(9):
-                print(f"sorted points[{points[i][0]}][{points[i][1]}]")
+        order, valid = OrderFiducials(np.asarray(points, dtype=float), self.topology.layout)
+        if not valid:
+            self.Print("Registration::OrderFidPoints - fiducial points do not match the frame layout.")
+            return False
+        if isinstance(points, np.ndarray):
+            points[...] = points[order]
+        else:
+            points[:] = [list(points[i]) for i in order]
+        return True
 
     def LocalizeFrame(self, Zcoordinates):
         """Compute the pose of the fiducial frame relative to the image plane.
         
         Uses an adaptation of an algorithm presented by Susil et al.:
         "A Single image Registration Method for CT-Guided Interventions", MICCAI 1999.
+        Single-slice form of ZFrame.Localization.LocalizeFrames.
         
         Args:
-            Zcoordinates (list): List of seven [x,y] fiducial coordinates
+            Zcoordinates (list/numpy.ndarray): numFiducials [x,y] fiducial coordinates
             
         Returns:
             tuple: (Zposition, Zorientation) where:
@@ -888,376 +1086,25 @@ class ZFrameRegistration:
                 - Zorientation is a numpy array [x,y,z,w] quaternion of the estimated orientation
                 Returns (None, None) if computation fails
         """
-        # Initialize vectors for computations
-        def make_vector(x, y, z=0.0):
-            return np.array([x, y, z])
-        
-        # 7 fiducial version
-        if self.numFiducials == 7:
-            # --- Compute diagonal points in the z-frame coordinates ---
-            # SIDE 1
-            # Map the three points for this z-fiducial
-            Pz1 = make_vector(Zcoordinates[0][0], Zcoordinates[0][1])
-            Pz2 = make_vector(Zcoordinates[1][0], Zcoordinates[1][1])
-            Pz3 = make_vector(Zcoordinates[2][0], Zcoordinates[2][1])
-            
-            # Origin and direction vector of diagonal fiducial
-            Oz = make_vector(*self.frameTopology[0])
-            Vz = make_vector(*self.frameTopology[3])
-            
-            # Solve for the diagonal intercept in Z-frame coordinates
-            # Assume distance between parallel fiducials is self.frameTopology[0][1]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[0][1]*2)
-            P2f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P2f is None:
-                return None, None
-                
-            # BASE
-            Pz1 = make_vector(Zcoordinates[2][0], Zcoordinates[2][1])
-            Pz2 = make_vector(Zcoordinates[3][0], Zcoordinates[3][1])
-            Pz3 = make_vector(Zcoordinates[4][0], Zcoordinates[4][1])
-            
-            Oz = make_vector(*self.frameTopology[1])
-            Vz = make_vector(*self.frameTopology[4])
-            
-            # Assume distance between parallel fiducials is self.frameTopology[1][0]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[1][0]*2)
-            P4f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P4f is None:
-                return None, None
-                
-            # SIDE 2
-            Pz1 = make_vector(Zcoordinates[4][0], Zcoordinates[4][1])
-            Pz2 = make_vector(Zcoordinates[5][0], Zcoordinates[5][1])
-            Pz3 = make_vector(Zcoordinates[6][0], Zcoordinates[6][1])
-            
-            Oz = make_vector(*self.frameTopology[2])
-            Vz = make_vector(*self.frameTopology[5])
-            
-            # Assume distance between parallel fiducials is self.frameTopology[2][1]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[2][1]*2)
-            P6f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P6f is None:
-                return None, None
-            
-            # --- Compute Transformation Between Image and Frame ---
-            # Compute z-frame cross section coordinate frame
-            Vx = P2f - P6f
-            Vy = P4f - P6f
-
-            # Normalize Vx first
-            Vx = Vx / np.linalg.norm(Vx)
-
-            # Compute Vz using normalized Vx
-            Vz = np.cross(Vx, Vy)
-            Vz = Vz / np.linalg.norm(Vz)
-
-            # Recompute Vy to ensure perfect orthogonality
-            Vy = np.cross(Vz, Vx)
-            # Vy is automatically normalized since it's cross product of two unit vectors
-            
-            # Create rotation matrix and convert to quaternion
-            rotation_matrix = np.column_stack((Vx, Vy, Vz))
-            transform_matrix = np.eye(4)  # Initialize 4x4 matrix
-            transform_matrix[:3, :3] = rotation_matrix
-            Qft = zf.MatrixToQuaternion(transform_matrix) 
-            
-            # Compute image cross-section coordinate frame
-            Pz1 = make_vector(Zcoordinates[1][0], Zcoordinates[1][1])
-            Pz2 = make_vector(Zcoordinates[3][0], Zcoordinates[3][1])
-            Pz3 = make_vector(Zcoordinates[5][0], Zcoordinates[5][1])
-            
-            Vx = Pz1 - Pz3
-            Vy = Pz2 - Pz3
-            Vz = np.cross(Vx, Vy)
-            Vy = np.cross(Vz, Vx)
-
-            Vx_norm = np.linalg.norm(Vx)
-            Vy_norm = np.linalg.norm(Vy)
-            Vz_norm = np.linalg.norm(Vz)
-
-            if Vx_norm < self.MEPSILON or Vy_norm < self.MEPSILON or Vz_norm < self.MEPSILON:
-                print("Registration::LocalizeFrame - Vx, Vy, or Vz is too small, something is wrong.")
-                return None, None
-
-            # Normalize vectors
-            Vx = Vx / Vx_norm
-            Vy = Vy / Vy_norm
-            Vz = Vz / Vz_norm
-            
-            # Create rotation matrix and convert to quaternion
-            rotation_matrix = np.column_stack((Vx, Vy, Vz))
-            transform_matrix = np.eye(4)
-            transform_matrix[:3, :3] = rotation_matrix
-            Qit = zf.MatrixToQuaternion(transform_matrix)
-            
-            # Compute rotation between frame and image
-            Zorientation = zf.QuaternionDivide(Qit, Qft)
-            
-            # Check rotation angle
-            angle = 2 * np.arccos(Zorientation[3])  # w component
-            if abs(angle) > 15.0:
-                print("Registration::LocalizeFrame - Rotation angle too large, something is wrong.")
-                return None, None
-            
-            # Compute axis of rotation
-            if angle == 0.0:
-                axis = np.array([1.0, 0.0, 0.0])
-            else:
-                denom = np.sqrt(1 - Zorientation[3] * Zorientation[3])
-                if abs(denom) < self.MEPSILON:
-                    print("Registration::LocalizeFrame - Division by zero in axis calculation.")
-                    return None, None
-                axis = Zorientation[:3] / denom
-                axis = axis / np.linalg.norm(axis)
-            
-            print(f"Rotation Angle [degrees]: {angle * 180.0 / np.pi}")
-            print(f"Rotation Axis: [{axis[0]}, {axis[1]}, {axis[2]}]")
-            
-            # Compute translational component
-            # Centroid of triangle in frame coordinates
-            Cf = (P2f + P4f + P6f) / 3.0
-            
-            # Centroid of frame triangle in image coordinates
-            Cfi = zf.QuaternionRotateVector(Zorientation, Cf)
-            
-            # Centroid of triangle in image coordinates
-            Ci = (Pz1 + Pz2 + Pz3) / 3.0
-            
-            # Displacement of frame in image coordinates
-            Zposition = Ci - Cfi
-            if abs(Zposition[2]) > 20.0:
-                print("Registration::LocalizeFrame - Displacement too large, something is wrong.")
-                return None, None
-            
-            print(f"Displacement [mm]: [{Zposition[0]}, {Zposition[1]}, {Zposition[2]}]")
-            
-            return Zposition, Zorientation
-        # 9 fiducial version
-        elif self.numFiducials == 9:
-            # --- Compute diagonal points in the z-frame coordinates ---
-            # SIDE 1
-            Pz1 = make_vector(Zcoordinates[0][0], Zcoordinates[0][1])
-            Pz2 = make_vector(Zcoordinates[1][0], Zcoordinates[1][1])
-            Pz3 = make_vector(Zcoordinates[2][0], Zcoordinates[2][1])
-            
-            # Origin and direction vector of diagonal fiducial
-            Oz = make_vector(*self.frameTopology[0])
-            Vz = make_vector(*self.frameTopology[3])
-            
-            # Solve for the diagonal intercept in Z-frame coordinates
-            # Assume distance between parallel fiducials is self.frameTopology[0][1]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[0][1]*2)
-            P2f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P2f is None:
-                return None, None
-            
-            # BASE
-            Pz1 = make_vector(Zcoordinates[3][0], Zcoordinates[3][1])
-            Pz2 = make_vector(Zcoordinates[4][0], Zcoordinates[4][1])
-            Pz3 = make_vector(Zcoordinates[5][0], Zcoordinates[5][1])
-            
-            Oz = make_vector(*self.frameTopology[1])
-            Vz = make_vector(*self.frameTopology[4])
-            
-            # Assume distance between parallel fiducials is self.frameTopology[1][0]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[1][0]*2)
-            P4f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P4f is None:
-                return None, None
-            
-            # SIDE 2
-            Pz1 = make_vector(Zcoordinates[6][0], Zcoordinates[6][1])
-            Pz2 = make_vector(Zcoordinates[7][0], Zcoordinates[7][1])
-            Pz3 = make_vector(Zcoordinates[8][0], Zcoordinates[8][1])
-            
-            Oz = make_vector(*self.frameTopology[2])
-            Vz = make_vector(*self.frameTopology[5])
-            
-            # Assume distance between parallel fiducials is self.frameTopology[2][1]*2
-            # TODO: Perhaps the distance should be a parameter?
-            fiducialDistance = np.abs(self.frameTopology[2][1]*2)
-            P6f = self.SolveZ(Pz1, Pz2, Pz3, Oz, Vz, fiducialDistance)
-            if P6f is None:
-                return None, None
-            
-            # --- Compute Transformation Between Image and Frame ---
-            # Compute z-frame cross section coordinate frame
-            Vx = P2f - P6f
-            Vy = P4f - P6f
-            
-            # Normalize Vx first
-            Vx_norm = np.linalg.norm(Vx)
-            if Vx_norm < self.MEPSILON:
-                print("Registration::LocalizeFrame - Vx is too small, something is wrong.")
-                return None, None
-            Vx = Vx / Vx_norm
-            
-            # Compute Vz using normalized Vx
-            Vz = np.cross(Vx, Vy)
-            Vz_norm = np.linalg.norm(Vz)
-            if Vz_norm < self.MEPSILON:
-                print("Registration::LocalizeFrame - Vz is too small, something is wrong.")
-                return None, None
-            Vz = Vz / Vz_norm
-            
-            # Recompute Vy to ensure perfect orthogonality
-            Vy = np.cross(Vz, Vx)
-            
-            # Create rotation matrix and convert to quaternion
-            rotation_matrix = np.column_stack((Vx, Vy, Vz))
-            transform_matrix = np.eye(4)
-            transform_matrix[:3, :3] = rotation_matrix
-            Qft = zf.MatrixToQuaternion(transform_matrix)
-            
-            # Check that the fiducial in the center of the top row is sufficiently centered
-            if abs(Zcoordinates[4][0]) > 10:
-                print("Registration::LocalizeFrame - Center & uppermost fiducial is not sufficiently centered along the x-axis")
-                return None, None
-            
-            # Compute image cross-section coordinate frame
-            Pz1 = make_vector(Zcoordinates[1][0], Zcoordinates[1][1])
-            Pz2 = make_vector(Zcoordinates[4][0], Zcoordinates[4][1])
-            Pz3 = make_vector(Zcoordinates[7][0], Zcoordinates[7][1])
-            
-            Vx = Pz1 - Pz3
-            Vy = Pz2 - Pz3
-            Vz = np.cross(Vx, Vy)
-            Vy = np.cross(Vz, Vx)
-
-            Vx_norm = np.linalg.norm(Vx)
-            Vy_norm = np.linalg.norm(Vy)
-            Vz_norm = np.linalg.norm(Vz)
-
-            if Vx_norm < self.MEPSILON or Vy_norm < self.MEPSILON or Vz_norm < self.MEPSILON:
-                print("Registration::LocalizeFrame - Vx, Vy, or Vz is too small, something is wrong.")
-                return None, None
-            
-            # Normalize vectors
-            Vx = Vx / Vx_norm
-            Vy = Vy / Vy_norm
-            Vz = Vz / Vz_norm
-            
-            # Create rotation matrix and convert to quaternion
-            rotation_matrix = np.column_stack((Vx, Vy, Vz))
-            transform_matrix = np.eye(4)
-            transform_matrix[:3, :3] = rotation_matrix
-            Qit = zf.MatrixToQuaternion(transform_matrix)
-            
-            # Compute rotation between frame and image
-            Zorientation = zf.QuaternionDivide(Qit, Qft)
-            
-            # Check rotation angle
-            angle = 2 * np.arccos(Zorientation[3])  # w component
-            if abs(angle) > 15.0:
-                print("Registration::LocalizeFrame - Rotation angle too large, something is wrong.")
-                return None, None
-            
-            # Compute axis of rotation
-            if angle == 0.0:
-                axis = np.array([1.0, 0.0, 0.0])
-            else:
-                denom = np.sqrt(1 - Zorientation[3] * Zorientation[3])
-                if abs(denom) < self.MEPSILON:
-                    print("Registration::LocalizeFrame - Division by zero in axis calculation.")
-                    return None, None
-                axis = Zorientation[:3] / denom
-                axis = axis / np.linalg.norm(axis)
-            
-            print(f"Rotation Angle [degrees]: {angle * 180.0 / np.pi}")
-            print(f"Rotation Axis: [{axis[0]}, {axis[1]}, {axis[2]}]")
-            
-            # Compute translational component
-            Cf = (P2f + P4f + P6f) / 3.0
-            Cfi = zf.QuaternionRotateVector(Zorientation, Cf)
-            Ci = (Pz1 + Pz2 + Pz3) / 3.0
-            
-            # Displacement of frame in image coordinates
-            Zposition = Ci - Cfi
-            if abs(Zposition[2]) > 20.0:
-                print("Registration::LocalizeFrame - Displacement too large, something is wrong.")
-                return None, None
-            
-            print(f"Displacement [mm]: [{Zposition[0]}, {Zposition[1]}, {Zposition[2]}]")
-            
-            return Zposition, Zorientation
+        positions, quaternions, valid = LocalizeFrames(np.asarray(Zcoordinates, dtype=float)[np.newaxis],
+                                                       self.topology)
+        if not valid[0]:
+            self.Print("Registration::LocalizeFrame - Could not compute a valid frame pose, something is wrong.")
+            return None, None
+        self.PrintPose(positions[0], quaternions[0])
+        return positions[0], quaternions[0]
 
-    def SolveZ(self, P1, P2, P3, Oz, Vz, fiducialDistance):
-        """Find the point at which the diagonal line fiducial is intercepted.
-        
-        Uses the three intercepts for a single set of planar line fiducials
-        contained in one side of the Z-frame.
-        
-        Args:
-            P1 (numpy.ndarray): Intercept point of first line fiducial in image
-            P2 (numpy.ndarray): Intercept point of second line fiducial in image
-            P3 (numpy.ndarray): Intercept point of third line fiducial in image
-            Oz (numpy.ndarray): Origin of this side of the Z-frame, in Z-frame coordinates
-            Vz (numpy.ndarray): Vector representing orientation of this side of Z-frame
-            fiducialDistance (float): Distance between parallel fiducials (used to calculate diagonal length)
-            
-        Returns:
-            numpy.ndarray: Diagonal intercept in physical Z-frame coordinates (P2f),
-                        or None if computation fails
-        """
-        try:
-            # Normalize the direction vector of the diagonal fiducial
-            Vz = Vz / np.linalg.norm(Vz)
-            
-            # Compute distances between points
-            D12 = np.linalg.norm(P1 - P2)
-            D23 = np.linalg.norm(P2 - P3)
-            
-            if D12 + D23 < self.MEPSILON:
-                print("Registration::SolveZ - Division by zero in distance calculation.")
-                return None
-                
-            # Length of diagonal - Diagonal distance between parallel fiducials
-            Ld = fiducialDistance * np.sqrt(2.0)
-            
-            # Compute intercept length
-            Lc = Ld * D23 / (D12 + D23)
-            
-            # Compute P2 in frame coordinates
-            P2f = Oz + Vz * Lc
-            
-            return P2f
-            
-        except Exception as e:
-            print(f"Registration::SolveZ - Error in computation: {str(e)}")
-            return None
+    def PrintPose(self, Zposition, Zorientation):
+        """Print the rotation angle, rotation axis and displacement of a frame pose."""
+        angle = 2 * np.arccos(np.clip(Zorientation[3], -1.0, 1.0))
+        if angle == 0.0:
+            axis = np.array([1.0, 0.0, 0.0])
+        else:
+            axis = Zorientation[:3] / np.linalg.norm(Zorientation[:3])
+        self.Print(f"Rotation Angle [degrees]: {angle * 180.0 / np.pi}")
+        self.Print(f"Rotation Axis: [{axis[0]}, {axis[1]}, {axis[2]}]")
+        self.Print(f"Displacement [mm]: [{Zposition[0]}, {Zposition[1]}, {Zposition[2]}]")
         
     def FindMax(self, matrix):
-        """Find the maximum value in a matrix and its coordinates.
-        
-        Searches for the maximum value while avoiding a 10-pixel margin around the edges
-        to avoid image artifacts.
-        
-        Args:
-            matrix (numpy.ndarray): The input matrix
-            
-        Returns:
-            tuple: (max_value, [row, col]) where:
-                - max_value is the maximum value found in the matrix
-                - [row, col] are the coordinates where the maximum occurs
-        """
-        # Get matrix dimensions
-        rows, cols = matrix.shape
-        
-        # Initialize max value and coordinates
-        max_val = 0
-        max_coords = [0, 0]
-        
-        # Avoid 10-pixel margin due to image artifacts
-        for i in range(10, rows-10):
-            for j in range(10, cols-10):
-                if max_val < matrix[i, j]:
-                    max_val = matrix[i, j]
-                    max_coords = [i, j]
-        
-        return max_val, max_coords
\ No newline at end of file
+        """Find the maximum value in a matrix and its coordinates, avoiding a 10-pixel margin (see ZFrame.Detection)."""
+        return FindMax(matrix)
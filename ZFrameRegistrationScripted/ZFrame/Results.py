@@ -0,0 +1,85 @@
+import functools
+from collections import namedtuple
+
+import numpy as np
+
+# Status of one slice, passed to the progress callback of ZFrameRegistration.Register once the slice is processed.
+# index is the position of the slice in the results and slice its slice index; success is True if the frame was
+# localized in the slice; seconds is the time spent detecting the fiducials of the slice; position ([x, y, z]) and
+# quaternion ([x, y, z, w]) are the frame pose averaged over the slices localized so far, or None before the first.
+SliceProgress = namedtuple('SliceProgress', ['index', 'slice', 'success', 'seconds', 'position', 'quaternion'])
+
+
+@functools.lru_cache(maxsize=None)
+def SliceResultsDtype(numFiducials):
+    """Structured dtype of the per-slice results of a frame with numFiducials line fiducials.
+
+    Fields:
+        slice (int32): slice index
+        detected (bool): True if the fiducial intercepts were found (and kept by the track outlier rejection)
+        tracked (bool): True if the intercepts were found around predicted positions instead of a full detection
+        localized (bool): True if a frame pose was computed from the intercepts
+        score (float64): match score of the intercepts (see ZFrame.Detection.ScoreLabelings)
+        pixels ((N, 2) float64): subpixel intercept coordinates in pixels, in fiducial order
+        coordinates ((N, 2) float64): intercept coordinates in mm relative to the image centre, in fiducial order
+        values ((N,) float64): normalized correlation peak value of each intercept (full detections only; 1 for
+            manual fiducials)
+        prominence ((N,) float64): smallest relative drop from each peak to the corners of its neighbourhood
+            (full detections only)
+        order ((N,) int32): index of each fiducial among the candidate peaks or the manual fiducials
+        position ((3,) float64): [x, y, z] frame position in RAS
+        quaternion ((4,) float64): [x, y, z, w] frame orientation in RAS, relative to the base orientation
+
+    Args:
+        numFiducials (int): number of line fiducials
+
+    Returns:
+        numpy.dtype: structured dtype, shared by all results with the same number of fiducials
+    """
+    return np.dtype([
+        ('slice', np.int32),
+        ('detected', np.bool_),
+        ('tracked', np.bool_),
+        ('localized', np.bool_),
+        ('score', np.float64),
+        ('pixels', np.float64, (numFiducials, 2)),
+        ('coordinates', np.float64, (numFiducials, 2)),
+        ('values', np.float64, (numFiducials,)),
+        ('prominence', np.float64, (numFiducials,)),
+        ('order', np.int32, (numFiducials,)),
+        ('position', np.float64, (3,)),
+        ('quaternion', np.float64, (4,)),
+    ])
+
+
+def NewSliceResults(slices, numFiducials):
+    """Allocate the results of a series of slices, with nothing detected yet.
+
+    The detection, tracking, ordering and localization stages of ZFrameRegistration write their output into
+    the records in place; a single record (results[i]) is a view of the array.
+
+    Args:
+        slices (iterable): slice indices
+        numFiducials (int): number of line fiducials
+
+    Returns:
+        numpy.ndarray: (S,) structured array of SliceResultsDtype(numFiducials)
+    """
+    slices = np.fromiter(slices, dtype=np.int32)
+    results = np.zeros(len(slices), dtype=SliceResultsDtype(numFiducials))
+    results['slice'] = slices
+    results['order'] = np.arange(numFiducials)
+    results['quaternion'][:, 3] = 1.0
+    return results
+
+
+def MatchScores(results):
+    """Match score of each slice of a results array.
+
+    Args:
+        results (numpy.ndarray): structured array from NewSliceResults
+
+    Returns:
+        dict: {slice index: match score}
+    """
+    return dict(zip(results['slice'].tolist(), results['score'].tolist()))
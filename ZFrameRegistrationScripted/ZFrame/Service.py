@@ -0,0 +1,368 @@
+import asyncio
+import contextlib
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from ZFrame.Batch import ResolveTopology
+from ZFrame.Detection import PRECISION_DOUBLE
+from ZFrame.GlobalFit import SOLVER_CLOSED_FORM
+from ZFrame.Registration import ZFrameRegistration
+
+# Every message is a header (JSON length, payload length) followed by a UTF-8 JSON object and a binary payload.
+# A request carries the volume as a C-ordered buffer of shape 'shape' and type 'dtype' (numpy notation) indexed
+# [i, j, k], with the metadata:
+#   affine (4x4 IJK to RAS matrix), topology (configuration name or topology string), sliceRange ([start, end)),
+#   and optionally id, solver, precision and orientationBase ([x, y, z, w]).
+# The response has no payload and contains id, success, position, orientation, matchScores, error and timing
+# (seconds spent queued, in the registration and in total since the request was received).
+_HEADER = struct.Struct('!II')
+
+# Largest accepted JSON part of a message
+MAX_METADATA_BYTES = 1 << 20
+
+# Largest accepted binary part of a message. Every queued request holds its payload, so this bounds the memory
+# of the requests waiting in the queue of a service
+MAX_PAYLOAD_BYTES = 1 << 30
+
+
+async def ReadMessage(reader):
+    """Read one message from an asyncio stream; returns (metadata, payload) or None at the end of the stream."""
+    try:
+        header = await reader.readexactly(_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise
+        return None
+    metadataLength, payloadLength = _HEADER.unpack(header)
+    if metadataLength > MAX_METADATA_BYTES:
+        raise ValueError(f"Message metadata too large: {metadataLength} bytes")
+    if payloadLength > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Message payload too large: {payloadLength} bytes")
+    metadata = json.loads((await reader.readexactly(metadataLength)).decode('utf-8'))
+    payload = await reader.readexactly(payloadLength)
+    return metadata, payload
+
+
+def RequestVolumeLayout(metadata, payloadLength):
+    """Return the (shape, dtype) of the volume of a request, checked against the length of its payload.
+
+    Raises:
+        ValueError: if the metadata does not describe a numeric volume of payloadLength bytes
+    """
+    if not isinstance(metadata, dict):
+        raise ValueError("Request metadata is not a JSON object")
+    try:
+        shape = tuple(int(v) for v in metadata['shape'])
+        dtype = np.dtype(metadata['dtype'])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid volume shape or type: {e}")
+    if len(shape) != 3 or min(shape) < 0 or dtype.kind not in 'biuf':
+        raise ValueError(f"Invalid volume shape or type: {list(shape)}, {dtype.str}")
+    if math.prod(shape) * dtype.itemsize != payloadLength:
+        raise ValueError(f"Payload of {payloadLength} bytes does not match a {list(shape)} {dtype.str} volume")
+    return shape, dtype
+
+
+def EncodeMessage(metadata, payload=b''):
+    """Return the bytes of one message."""
+    metadata = json.dumps(metadata).encode('utf-8')
+    return _HEADER.pack(len(metadata), len(payload)) + metadata + bytes(payload)
+
+
+class RegistrationService:
+    """Long-running registration server on a Unix or TCP socket.
+
+    Requests from all connections go through one bounded queue and are registered one at a time in a worker
+    thread, so the event loop keeps accepting and answering connections. When the queue is full, connections
+    stop being read until a slot frees up, which pushes back on the clients through the socket. When a connection
+    closes, its queued requests are dropped and its registration in progress is cancelled between two slices, so
+    clients must read all their responses before closing. A request whose payload does not match the shape and
+    type of its volume is answered with an error without taking a slot in the queue, and a message larger than
+    MAX_METADATA_BYTES or MAX_PAYLOAD_BYTES closes its connection.
+    The warm state (one ZFrameRegistration per fiducial count, the mask spectra of ZFrame.Detection, the FFT
+    plans of scipy.fft and the topology registry) is kept for the lifetime of the service. The progress output
+    of the registrations goes to the standard output of the service; it is not silenced because redirecting
+    sys.stdout from the worker thread would also swallow the output of the other threads.
+
+    Example:
+        service = RegistrationService()
+        address = service.Start(socketPath='/tmp/zframe.sock')
+        ...
+        service.Stop()
+    """
+
+    def __init__(self, maxQueuedRequests=4):
+        self.maxQueuedRequests = max(1, int(maxQueuedRequests))
+        self.address = None
+        self.registrations = {}
+        self.loop = None
+        self.thread = None
+        self.server = None
+        self.queue = None
+        self.worker = None
+        self.socketPath = None
+
+    async def Serve(self, socketPath=None, host='127.0.0.1', port=0):
+        """Start listening on the event loop of the caller.
+
+        Args:
+            socketPath (str): path of a Unix socket, or None to listen on TCP
+            host (str): TCP host
+            port (int): TCP port, 0 for any free port
+
+        Returns:
+            str or tuple: the socket path or the (host, port) address
+        """
+        self.queue = asyncio.Queue(maxsize=self.maxQueuedRequests)
+        self.worker = asyncio.ensure_future(self._Work())
+        if socketPath is not None:
+            if os.path.exists(socketPath):
+                os.unlink(socketPath)
+            self.server = await asyncio.start_unix_server(self._HandleConnection, path=socketPath)
+            self.socketPath = socketPath
+            self.address = socketPath
+        else:
+            self.server = await asyncio.start_server(self._HandleConnection, host=host, port=port)
+            self.address = self.server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def Close(self):
+        """Stop listening and cancel the worker; the registration running is stopped and queued requests are dropped."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.worker is not None:
+            self.worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self.worker
+            self.worker = None
+        if self.socketPath is not None and os.path.exists(self.socketPath):
+            os.unlink(self.socketPath)
+        self.socketPath = None
+
+    def Start(self, socketPath=None, host='127.0.0.1', port=0):
+        """Run the service on its own event loop in a background thread; returns the address once listening."""
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.Serve(socketPath, host, port))
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.Close())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, name="ZFrameRegistrationService", daemon=True)
+        self.thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self.address
+
+    def Stop(self):
+        """Stop a service started with Start."""
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+
+    async def _HandleConnection(self, reader, writer):
+        # Responses of one connection are sent in request order
+        previous = None
+        pending = []
+        try:
+            while True:
+                message = await ReadMessage(reader)
+                if message is None:
+                    break
+                future = asyncio.get_running_loop().create_future()
+                try:
+                    RequestVolumeLayout(message[0], len(message[1]))
+                except ValueError as e:
+                    # Answered in order without taking a slot in the queue
+                    response = self._NewResponse(message[0])
+                    response['error'] = str(e)
+                    response['timing'] = {'queued': 0.0, 'registration': 0.0, 'total': 0.0}
+                    future.set_result(response)
+                    previous = asyncio.ensure_future(self._Respond(writer, future, previous))
+                    continue
+                pending = [f for f in pending if not f.done()] + [future]
+                # Waits while the queue is full, which stops reading from this connection
+                await self.queue.put((message, time.perf_counter(), future))
+                previous = asyncio.ensure_future(self._Respond(writer, future, previous))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            print(f"Registration::Service - Connection closed: {e}")
+        finally:
+            # Nobody is left to read the responses: drop the queued requests and stop the one being registered
+            for future in pending:
+                future.cancel()
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    @staticmethod
+    async def _Respond(writer, future, previous):
+        # A failed write of an earlier response reaches the connection handler without waiting for this one
+        if previous is not None:
+            await previous
+        response = await future
+        writer.write(EncodeMessage(response))
+        await writer.drain()
+
+    async def _Work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            (metadata, payload), receiveTime, future = await self.queue.get()
+            if future.cancelled():
+                continue
+            cancel = threading.Event()
+            future.add_done_callback(lambda f, cancel=cancel: cancel.set())
+            startTime = time.perf_counter()
+            try:
+                response = await loop.run_in_executor(None, self._Register, metadata, payload, cancel)
+            except asyncio.CancelledError:
+                cancel.set()
+                raise
+            endTime = time.perf_counter()
+            response['timing'] = {'queued': startTime - receiveTime, 'registration': endTime - startTime,
+                                  'total': endTime - receiveTime}
+            if not future.cancelled():
+                future.set_result(response)
+
+    @staticmethod
+    def _NewResponse(metadata):
+        return {'id': metadata.get('id') if isinstance(metadata, dict) else None, 'success': False,
+                'position': None, 'orientation': None, 'matchScores': {}, 'error': None}
+
+    def _Register(self, metadata, payload, cancel=None):
+        response = self._NewResponse(metadata)
+        try:
+            shape, dtype = RequestVolumeLayout(metadata, len(payload))
+            volume = np.frombuffer(payload, dtype=dtype).reshape(shape)
+            topology = ResolveTopology(metadata['topology'])
+            registration = self.registrations.get(topology.numFiducials)
+            if registration is None:
+                registration = self.registrations[topology.numFiducials] = ZFrameRegistration(topology.numFiducials)
+            registration.SetInputImage(volume, np.asarray(metadata['affine'], dtype=float))
+            registration.SetOrientationBase(list(metadata.get('orientationBase', [0.0, 0.0, 0.0, 1.0])))
+            registration.SetFrameTopology(topology)
+            registration.SetSolver(metadata.get('solver', SOLVER_CLOSED_FORM))
+            registration.SetPrecision(metadata.get('precision', PRECISION_DOUBLE))
+            result = registration.Register(list(metadata['sliceRange']), cancel=cancel)
+            registration.InputImage = None
+            response['matchScores'] = {str(k): float(v) for k, v in registration.matchScores.items()}
+            if isinstance(result, tuple) and result[0]:
+                response['success'] = True
+                response['position'] = [float(v) for v in result[1]]
+                response['orientation'] = [float(v) for v in result[2]]
+            elif registration.cancelled:
+                response['error'] = "Registration cancelled"
+            else:
+                response['error'] = "Registration failed"
+        except Exception as e:
+            response['error'] = str(e)
+        return response
+
+
+class RegistrationClient:
+    """Blocking client of a RegistrationService.
+
+    Args:
+        address (str or tuple): Unix socket path or (host, port) address of the service
+        timeout (float): socket timeout in seconds, None to wait forever
+    """
+
+    def __init__(self, address, timeout=None):
+        if isinstance(address, str):
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            address = tuple(address)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+
+    def Close(self):
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Send(self, volume, affine, topology, sliceRange, **options):
+        """Send a registration request without waiting for its response (see Receive)."""
+        volume = np.ascontiguousarray(volume)
+        metadata = dict(options, shape=list(volume.shape), dtype=volume.dtype.str,
+                        affine=np.asarray(affine, dtype=float).tolist(), topology=topology,
+                        sliceRange=[int(v) for v in sliceRange])
+        self.socket.sendall(EncodeMessage(metadata, memoryview(volume).cast('B')))
+
+    def Receive(self):
+        """Wait for the next response, in request order."""
+        metadataLength, payloadLength = _HEADER.unpack(self._ReceiveExactly(_HEADER.size))
+        metadata = json.loads(self._ReceiveExactly(metadataLength).decode('utf-8'))
+        self._ReceiveExactly(payloadLength)
+        return metadata
+
+    def Register(self, volume, affine, topology, sliceRange, **options):
+        """Register a volume on the service.
+
+        Args:
+            volume (numpy.ndarray): image indexed [i, j, k]
+            affine (numpy.ndarray): 4x4 IJK to RAS matrix
+            topology (str): configuration name (e.g. 'z001') or topology string
+            sliceRange (list): [start, end) slice range
+            **options: id, solver, precision or orientationBase
+
+        Returns:
+            dict: response of the service
+        """
+        self.Send(volume, affine, topology, sliceRange, **options)
+        return self.Receive()
+
+    def _ReceiveExactly(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self.socket.recv(min(size - len(data), 1 << 20))
+            if not chunk:
+                raise ConnectionError("Connection closed by the registration service")
+            data += chunk
+        return bytes(data)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Z-frame registration service")
+    parser.add_argument('--socket', help="Unix socket path (default: TCP)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18950)
+    parser.add_argument('--max-queued', type=int, default=4)
+    args = parser.parse_args()
+
+    async def main():
+        service = RegistrationService(args.max_queued)
+        print(f"Registration::Service - Listening on {await service.Serve(args.socket, args.host, args.port)}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await service.Close()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(main())
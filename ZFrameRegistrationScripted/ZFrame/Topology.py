@@ -0,0 +1,221 @@
+import os
+import re
+import logging
+import numpy as np
+
+# Configuration file shipped with the scripted module
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Resources', 'configs.txt')
+
+# Fiducial count of the known frames, as used by the ZFrameRegistration CLI. Frames not listed have 7 fiducials.
+FIDUCIAL_COUNTS = {'z002': 9, 'z003': 9}
+
+SIDE_NAMES = ('Side 1', 'Base', 'Side 2')
+
+_NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+
+def ParseFrameTopology(frameTopology):
+    """Convert a frame topology string into a 6x3 array of floats.
+
+    Args:
+        frameTopology (str): "[x, y, z], [x, y, z], ..." with six 3-vectors
+
+    Returns:
+        numpy.ndarray: 6x3 array. The first 3 rows contain the origin points in RAS coordinates of
+            Side 1, Base, and Side 2, respectively. The 4th, 5th, and 6th rows contain the diagonal
+            vectors in RAS coordinates of Side 1, Base, and Side 2.
+
+    Raises:
+        ValueError: if the string does not contain exactly six 3-vectors
+    """
+    values = [float(v) for v in _NUMBER.findall(frameTopology)]
+    if len(values) != 18:
+        raise ValueError(f"Frame topology must contain six 3-vectors, got {len(values)} values: {frameTopology}")
+    return np.array(values).reshape(6, 3)
+
+
+class FiducialLayout:
+    """Cross-section pattern of a Z-frame with a given number of line fiducials.
+
+    The ordered fiducials run along three edges of the rectangular cross-section, starting and ending at the
+    two corners of the open edge, which carries no fiducial.
+
+    Attributes:
+        numFiducials (int): number of line fiducials
+        sides (numpy.ndarray): 3x3 ordered fiducial indices (parallel, diagonal, parallel) of Side 1, Base and Side 2
+        cornerPositions (numpy.ndarray): ordered indices of the four corner fiducials
+        edgeCounts (numpy.ndarray): number of in-between fiducials on each of the three populated edges
+        orderingRule (str): how the traversal direction of a symmetric pattern is chosen:
+            'rotation' - consecutive corners turn counter-clockwise around the pattern centre in (row, column)
+            'row' - the first fiducial has the smaller row coordinate of the two open-edge corners
+        centredFiducial (int): index of a fiducial that must lie near the image centre row, or None
+    """
+
+    def __init__(self, numFiducials, sides, cornerPositions, orderingRule, centredFiducial=None):
+        self.numFiducials = numFiducials
+        self.sides = np.array(sides, dtype=int).reshape(3, 3)
+        self.cornerPositions = np.array(cornerPositions, dtype=int)
+        if (len(self.cornerPositions) != 4 or self.cornerPositions[0] != 0
+                or self.cornerPositions[-1] != numFiducials - 1):
+            raise ValueError("The four corners must include the first and the last fiducial")
+        self.edgeCounts = np.diff(self.cornerPositions) - 1
+        self.orderingRule = orderingRule
+        self.centredFiducial = centredFiducial
+        for array in (self.sides, self.cornerPositions, self.edgeCounts):
+            array.flags.writeable = False
+
+    def __repr__(self):
+        return f"FiducialLayout(numFiducials={self.numFiducials})"
+
+
+# Known cross-section layouts, by number of fiducials. New frame designs only need a new entry here.
+LAYOUTS = {
+    7: FiducialLayout(7, sides=[[0, 1, 2], [2, 3, 4], [4, 5, 6]], cornerPositions=[0, 2, 4, 6],
+                      orderingRule='rotation'),
+    9: FiducialLayout(9, sides=[[0, 1, 2], [3, 4, 5], [6, 7, 8]], cornerPositions=[0, 3, 5, 8],
+                      orderingRule='row', centredFiducial=4),
+}
+
+
+class FrameTopology:
+    """Immutable, validated frame topology with the per-side constants used by the pose solver.
+
+    Attributes:
+        name (str): configuration name (e.g. 'z001'), or None for a topology typed in by the user
+        numFiducials (int): number of line fiducials of the frame
+        layout (FiducialLayout): cross-section pattern of the frame
+        text (str): topology string as found in configs.txt
+        values (numpy.ndarray): 6x3 topology array (origins followed by diagonal vectors)
+        origins (numpy.ndarray): 3x3 origins of the diagonal fiducial of Side 1, Base and Side 2
+        diagonals (numpy.ndarray): 3x3 direction vectors of the diagonal fiducials, as configured
+        unitDiagonals (numpy.ndarray): 3x3 normalized diagonal directions
+        parallelSpacing (numpy.ndarray): distance between the two parallel fiducials of each side
+        diagonalLengths (numpy.ndarray): length of the diagonal fiducial of each side
+    """
+
+    def __init__(self, values, numFiducials=7, name=None, text=None):
+        values = np.array(values, dtype=float).reshape(6, 3)
+        if not np.all(np.isfinite(values)):
+            raise ValueError("Frame topology contains non-finite values")
+        diagonals = values[3:]
+        diagonalNorms = np.linalg.norm(diagonals, axis=1)
+        if np.any(diagonalNorms < 1e-10):
+            raise ValueError("Frame topology contains a zero-length diagonal vector")
+        if numFiducials not in LAYOUTS:
+            raise ValueError(f"Unsupported number of fiducials: {numFiducials}")
+
+        self.name = name
+        self.numFiducials = numFiducials
+        self.layout = LAYOUTS[numFiducials]
+        self.text = text if text is not None else ", ".join(
+            "[" + ", ".join(str(v) for v in row) + "]" for row in values)
+        self.values = values
+        self.origins = values[:3]
+        self.diagonals = diagonals
+        self.unitDiagonals = diagonals / diagonalNorms[:, np.newaxis]
+
+        # Assume distance between parallel fiducials is twice the in-plane offset of the diagonal origin:
+        # origin y for the sides and origin x for the base
+        self.parallelSpacing = np.abs(np.array([values[0][1], values[1][0], values[2][1]]) * 2)
+        if np.any(self.parallelSpacing < 1e-10):
+            raise ValueError("Frame topology implies a zero spacing between parallel fiducials")
+        # Length of diagonal - Diagonal distance between parallel fiducials
+        self.diagonalLengths = self.parallelSpacing * np.sqrt(2.0)
+
+        for array in (self.values, self.unitDiagonals, self.parallelSpacing, self.diagonalLengths):
+            array.flags.writeable = False
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"FrameTopology(name={self.name!r}, numFiducials={self.numFiducials}, text={self.text!r})"
+
+
+class TopologyRegistry:
+    """Parses frame topologies once and shares them between the widget, the logic and the engines.
+
+    Configuration files are re-read only when their modification time or size changes, and topology
+    strings typed in by the user are parsed once per distinct string. Topologies given as sequences or arrays
+    are shared per distinct set of values.
+    """
+
+    def __init__(self):
+        self._configFiles = {}
+        self._topologies = {}
+
+    def LoadConfigs(self, configPath=DEFAULT_CONFIG_PATH):
+        """Load the Z-frame configurations of a configs.txt file.
+
+        Args:
+            configPath (str): path of the configuration file
+
+        Returns:
+            dict: configuration name -> FrameTopology, in file order
+        """
+        stat = os.stat(configPath)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._configFiles.get(configPath)
+        if cached is not None and cached[0] == signature:
+            return dict(cached[1])
+
+        configs = {}
+        with open(configPath, 'r') as f:
+            lines = f.readlines()
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):  # Skip empty lines and comments
+                continue
+            try:
+                configName, text = line.split(':', 1)
+                configName = configName.strip()
+                configs[configName] = self.GetTopology(text.strip(), FIDUCIAL_COUNTS.get(configName, 7), configName)
+            except ValueError:
+                logging.warning(f"Skipping invalid line in configs.txt: {line}")
+                continue
+
+        self._configFiles[configPath] = (signature, configs)
+        return dict(configs)
+
+    def GetTopology(self, frameTopology, numFiducials=7, name=None):
+        """Return the FrameTopology for a topology string, a 6x3 sequence or an existing FrameTopology.
+
+        Args:
+            frameTopology (str/list/numpy.ndarray/FrameTopology): topology definition
+            numFiducials (int): number of line fiducials of the frame
+            name (str): optional configuration name
+
+        Returns:
+            FrameTopology: the shared, immutable topology
+        """
+        if isinstance(frameTopology, FrameTopology):
+            if frameTopology.numFiducials == numFiducials:
+                return frameTopology
+            frameTopology = frameTopology.text
+        if isinstance(frameTopology, str):
+            text = frameTopology.strip()
+            key = (text, numFiducials, name)
+            topology = self._topologies.get(key)
+            if topology is None:
+                topology = FrameTopology(ParseFrameTopology(text), numFiducials, name, text)
+                self._topologies[key] = topology
+            return topology
+        # Sequences and arrays are shared by value, as equal topologies given as lists are not identical
+        values = tuple(np.ravel(np.asarray(frameTopology, dtype=float)).tolist())
+        key = (values, numFiducials, name)
+        topology = self._topologies.get(key)
+        if topology is None:
+            topology = FrameTopology(frameTopology, numFiducials, name)
+            self._topologies[key] = topology
+        return topology
+
+    def Clear(self):
+        self._configFiles.clear()
+        self._topologies.clear()
+
+
+# Registry shared by all engines in this session
+registry = TopologyRegistry()
@@ -0,0 +1,118 @@
+from collections import namedtuple
+
+import numpy as np
+
+from ZFrame.Detection import EXTRA_CANDIDATES, MEPSILON, MIN_MATCH_SCORE, PRECISION_DOUBLE
+from ZFrame.GlobalFit import FiducialLines
+from ZFrame.Localization import LocalizeFrames, QuaternionsRotateVectors
+from ZFrame.Registration import ZFrameRegistration
+from ZFrame.Results import NewSliceResults
+from ZFrame.Topology import registry as topologyRegistry
+
+# RMS reprojection residual, in mm, at which the match score of a slice is attenuated by a factor e. The frame
+# poses of the right topology reproduce the intercepts within a fraction of a millimetre; a topology with
+# displaced fiducials leaves residuals of several millimetres even when its cross-section matches.
+RESIDUAL_TOLERANCE = 1.0
+
+# Evaluation of one frame topology on the candidate peaks of a slice range. score is the mean over the slices
+# of the match score attenuated by the reprojection residual (0 for slices without a plausible pose); residual
+# is the mean RMS reprojection residual in mm of the localized slices (NaN if none); sliceResults holds the
+# detection results of the slices (see ZFrame.Results), for ZFrameRegistration.SetDetectionCache.
+TopologyMatch = namedtuple('TopologyMatch', ['topology', 'score', 'residual', 'sliceResults'])
+
+
+def ReprojectionResiduals(coordinates, positions, quaternions, topology):
+    """RMS distance between the intercepts of slices and the intercepts predicted from their frame poses.
+
+    Vectorized form of ZFrame.Tracking.PredictIntercepts over the slices.
+
+    Args:
+        coordinates (numpy.ndarray): (S, N, 2) intercepts in mm relative to the image centre, in fiducial order
+        positions (numpy.ndarray): (S, 3) frame positions in image coordinates (see LocalizeFrames)
+        quaternions (numpy.ndarray): (S, 4) frame orientations [x, y, z, w] in image coordinates
+        topology (FrameTopology): frame topology
+
+    Returns:
+        numpy.ndarray: (S,) RMS distances in mm, infinite where a fiducial is parallel to the slice
+    """
+    points, directions = FiducialLines(topology)
+    quaternions = np.asarray(quaternions, dtype=float)[:, np.newaxis, :]
+    points = QuaternionsRotateVectors(quaternions, points) + np.asarray(positions, dtype=float)[:, np.newaxis, :]
+    directions = QuaternionsRotateVectors(quaternions, directions)
+    crossing = np.all(np.abs(directions[..., 2]) >= MEPSILON, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        distances = -points[..., 2] / directions[..., 2]
+        predicted = points[..., :2] + distances[..., np.newaxis] * directions[..., :2]
+        residuals = np.sqrt(np.mean(np.sum((predicted - coordinates) ** 2, axis=-1), axis=-1))
+    return np.where(crossing, residuals, np.inf)
+
+
+def SelectFrameTopology(image, transform, sliceRange, topologies=None, precision=PRECISION_DOUBLE):
+    """Find the frame topology of an image among several, from a single detection pass.
+
+    The correlation and peak extraction of ZFrameRegistration do not depend on the topology, so they run once
+    per slice, extracting the candidate peaks of the frame with the most fiducials. Every topology is then
+    matched against the same peaks (see ZFrameRegistration.LocateFiducials), its frame is localized in all the
+    matched slices at once, and each slice scores its match score attenuated by the reprojection residual of its
+    pose (see RESIDUAL_TOLERANCE). The detection results of a topology are those of a detection with that
+    topology alone, so a registration can reuse them through SetDetectionCache.
+
+    Args:
+        image (numpy.ndarray): image indexed [i, j, k]
+        transform (numpy.ndarray): 4x4 IJK to RAS matrix
+        sliceRange (list): [start_slice, end_slice] range of slices; the slices outside the image are left out
+        topologies (iterable): FrameTopology to choose from, or None for the configurations of configs.txt
+        precision (str): PRECISION_DOUBLE or PRECISION_SINGLE
+
+    Returns:
+        tuple: (best, matches) where matches is the TopologyMatch of every topology by decreasing score, and best
+            the first of them, or None if no topology scores at least ZFrame.Detection.MIN_MATCH_SCORE
+    """
+    topologies = list(topologyRegistry.LoadConfigs().values() if topologies is None else topologies)
+    if not topologies:
+        raise ValueError("No frame topology to select from")
+
+    # One registration per fiducial count; the first one extracts the candidates of all slices
+    registrations = {}
+    for topology in topologies:
+        if topology.numFiducials not in registrations:
+            registration = ZFrameRegistration(numFiducials=topology.numFiducials)
+            registration.SetInputImage(image, transform)
+            registration.SetPrecision(precision)
+            registrations[topology.numFiducials] = registration
+    registration = next(iter(registrations.values()))
+    zsize = registration.InputImageDim[2]
+    spacing = registration.ImageSpacing()
+    slices = [slindex for slindex in range(sliceRange[0], sliceRange[1]) if 0 <= slindex < zsize]
+    candidates = registration.FindSliceCandidates(slices, max(registrations) + EXTRA_CANDIDATES)
+
+    matches = []
+    for topology in topologies:
+        registration = registrations[topology.numFiducials]
+        registration.SetFrameTopology(topology)
+        results = NewSliceResults(slices, topology.numFiducials)
+        sliceMatches = registration.MatchCandidates(candidates, spacing)
+        for index, slindex in enumerate(slices):
+            if candidates[slindex] is not None:
+                registration.DetectFiducials(None, registration.InputImageDim, spacing, results[index],
+                                             candidates[slindex], sliceMatches[slindex])
+
+        sliceScores = np.zeros(len(slices))
+        residual = np.nan
+        detected = np.flatnonzero(results['detected'])
+        if len(detected) > 0:
+            coordinates = results['coordinates'][detected]
+            positions, quaternions, valid = LocalizeFrames(coordinates, topology)
+            if np.any(valid):
+                residuals = ReprojectionResiduals(coordinates[valid], positions[valid], quaternions[valid], topology)
+                sliceScores[detected[valid]] = (results['score'][detected[valid]] *
+                                                np.exp(-(residuals / RESIDUAL_TOLERANCE) ** 2))
+                residual = float(np.mean(residuals))
+        score = float(np.mean(sliceScores)) if len(slices) > 0 else 0.0
+        print(f"Registration::SelectFrameTopology - {topology.name or topology.text}: score {score:.3f}, "
+              f"residual {residual:.3f} mm")
+        matches.append(TopologyMatch(topology, score, residual, results))
+
+    matches.sort(key=lambda match: -match.score)
+    best = matches[0] if matches[0].score >= MIN_MATCH_SCORE else None
+    return best, matches
@@ -0,0 +1,171 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from ZFrame.Detection import CORRELATION_KERNEL, MEPSILON, RefinePeaks, ScoreLabelings
+from ZFrame.GlobalFit import FiducialLines
+from ZFrame.Localization import QuaternionsDivide, QuaternionsMultiply, QuaternionsRotateVectors
+
+# Half size of the window searched around each predicted intercept, in pixels
+SEARCH_RADIUS = 8
+
+# Match score (see ZFrame.Detection.ScoreLabelings) below which tracking falls back to a full detection
+MIN_TRACKING_SCORE = 0.5
+
+# Maximum distance of a propagated intercept from the 3-D line fitted to its fiducial across slices, in mm
+MAX_TRACK_DISTANCE = 1.0
+
+_KERNEL_RADIUS = CORRELATION_KERNEL.shape[0] // 2
+
+
+def FramePoseInImage(framePosition, frameQuaternion, imagePosition, imageQuaternion):
+    """Express a frame pose given in RAS coordinates in the coordinates of an image plane.
+
+    Inverse of the composition done by ZFrameRegistration.RegisterQuaternion (before the base orientation).
+
+    Args:
+        framePosition (numpy.ndarray): [x, y, z] frame position in RAS
+        frameQuaternion (numpy.ndarray): [x, y, z, w] frame orientation in RAS
+        imagePosition (numpy.ndarray): [x, y, z] RAS position of the image centre
+        imageQuaternion (numpy.ndarray): [x, y, z, w] orientation of the image
+
+    Returns:
+        tuple: (position, quaternion) of the frame in image coordinates
+    """
+    inverse = QuaternionsDivide([0.0, 0.0, 0.0, 1.0], imageQuaternion)
+    position = QuaternionsRotateVectors(inverse, np.asarray(framePosition, dtype=float) - imagePosition)
+    return position, QuaternionsMultiply(inverse, frameQuaternion)
+
+
+def PredictIntercepts(position, quaternion, topology):
+    """Predict where the line fiducials of a frame cross an image plane.
+
+    Args:
+        position (numpy.ndarray): [x, y, z] frame position in image coordinates
+        quaternion (numpy.ndarray): [x, y, z, w] frame orientation in image coordinates
+        topology (FrameTopology): frame topology
+
+    Returns:
+        tuple: (intercepts, valid) where intercepts is an (N, 2) array of [x, y] coordinates in mm relative to
+            the image centre, in fiducial order, and valid is False if a fiducial is parallel to the plane
+    """
+    points, directions = FiducialLines(topology)
+    points = QuaternionsRotateVectors(quaternion, points) + position
+    directions = QuaternionsRotateVectors(quaternion, directions)
+    if np.any(np.abs(directions[:, 2]) < MEPSILON):
+        return None, False
+    distances = -points[:, 2] / directions[:, 2]
+    return points[:, :2] + distances[:, np.newaxis] * directions[:, :2], True
+
+
+def LocalCorrelation(image, centres, radius=SEARCH_RADIUS):
+    """Correlate the fiducial kernel with the image in small windows.
+
+    Args:
+        image (numpy.ndarray): (X, Y) image
+        centres (numpy.ndarray): (N, 2) integer window centres in pixels
+        radius (int): half size of the windows
+
+    Returns:
+        numpy.ndarray: (N, 2*radius+1, 2*radius+1) correlation windows, or None if a window does not fit
+            in the image
+    """
+    centres = np.asarray(centres, dtype=int)
+    extent = radius + _KERNEL_RADIUS
+    if (np.any(centres - extent < 0) or np.any(centres[:, 0] + extent >= image.shape[0]) or
+            np.any(centres[:, 1] + extent >= image.shape[1])):
+        return None
+    offsets = np.arange(-extent, extent + 1)
+    patches = np.asarray(image, dtype=float)[centres[:, 0, np.newaxis, np.newaxis] + offsets[:, np.newaxis],
+                                             centres[:, 1, np.newaxis, np.newaxis] + offsets]
+    windows = sliding_window_view(patches, CORRELATION_KERNEL.shape, axis=(1, 2))
+    return np.einsum('nijkl,kl->nij', windows, CORRELATION_KERNEL)
+
+
+def SearchFiducials(image, predicted, topology, spacing=None, radius=SEARCH_RADIUS):
+    """Find the fiducial intercepts near their predicted positions.
+
+    The strongest correlation peak of each window is refined with ZFrame.Detection.RefinePeaks. Peaks are
+    normalized to the strongest one, as in a full detection, and the labeling given by the prediction is
+    scored with ZFrame.Detection.ScoreLabelings.
+
+    Args:
+        image (numpy.ndarray): (X, Y) image
+        predicted (numpy.ndarray): (N, 2) predicted intercepts in pixels, in fiducial order
+        topology (FrameTopology): frame topology
+        spacing (list): [row, column] pixel spacing in mm, or None
+        radius (int): half size of the search windows
+
+    Returns:
+        tuple: (coordinates, score) where coordinates is an (N, 2) array of pixel coordinates in fiducial order,
+            or (None, 0.0) if a window leaves the image or a peak lies on the border of its window
+    """
+    centres = np.rint(np.asarray(predicted, dtype=float)).astype(int)
+    correlation = LocalCorrelation(image, centres, radius)
+    if correlation is None:
+        return None, 0.0
+    flat = correlation.reshape(len(centres), -1)
+    peaks = np.stack(np.unravel_index(np.argmax(flat, axis=1), correlation.shape[1:]), axis=1)
+    values = flat[np.arange(len(centres)), np.argmax(flat, axis=1)]
+    # A peak on the border of its window is the slope of a fiducial outside the window
+    if np.any((peaks == 0) | (peaks == 2 * radius)) or not np.all(values > MEPSILON):
+        return None, 0.0
+
+    refined, _ = RefinePeaks(correlation, peaks, np.arange(len(centres)))
+    coordinates = centres - radius + refined
+    score = float(ScoreLabelings(coordinates, values / np.max(values), topology, spacing))
+    return coordinates, score
+
+
+def ExtrapolateTrack(track, sliceIndex):
+    """Predict the intercepts of a slice by linear extrapolation of the last two slices of a track.
+
+    Args:
+        track (list): (sliceIndex, (N, 2) intercepts) of the slices already processed, in processing order
+        sliceIndex (int): slice to predict
+
+    Returns:
+        numpy.ndarray: (N, 2) predicted intercepts, or None if the track is empty
+    """
+    if not track:
+        return None
+    lastIndex, last = track[-1]
+    if len(track) < 2:
+        return np.array(last, dtype=float)
+    previousIndex, previous = track[-2]
+    step = (np.asarray(last, dtype=float) - previous) / float(lastIndex - previousIndex)
+    return last + step * (sliceIndex - lastIndex)
+
+
+def RejectTrackOutliers(slices, coordinates, sliceSpacing, maxDistance=MAX_TRACK_DISTANCE):
+    """Fit a 3-D line to the intercepts of each fiducial across slices and reject the slices that stray from it.
+
+    The slice with the largest distance of any of its intercepts from its line is removed and the lines are
+    fitted again, until every remaining intercept is within maxDistance or only two slices are left.
+
+    Args:
+        slices (list): S slice indices
+        coordinates (numpy.ndarray): (S, N, 2) intercepts in mm in the slice planes
+        sliceSpacing (float): distance between slices in mm
+        maxDistance (float): maximum distance of an intercept from its fitted line, in mm
+
+    Returns:
+        numpy.ndarray: (S,) boolean mask of the slices kept
+    """
+    coordinates = np.asarray(coordinates, dtype=float)
+    numSlices, numFiducials = coordinates.shape[:2]
+    heights = np.broadcast_to((np.asarray(slices, dtype=float) * sliceSpacing)[:, np.newaxis, np.newaxis],
+                              (numSlices, numFiducials, 1))
+    points = np.concatenate([coordinates, heights], axis=-1).transpose(1, 0, 2)  # (N, S, 3)
+    kept = np.ones(numSlices, dtype=bool)
+    while np.count_nonzero(kept) > 2:
+        centres = points[:, kept].mean(axis=1, keepdims=True)
+        _, _, axes = np.linalg.svd(points[:, kept] - centres, full_matrices=False)
+        directions = axes[:, 0, np.newaxis, :]
+        offsets = points - centres
+        distances = np.linalg.norm(offsets - np.sum(offsets * directions, axis=-1, keepdims=True) * directions,
+                                   axis=-1)
+        worst = np.where(kept, distances.max(axis=0), -1.0)
+        if worst.max() <= maxDistance:
+            break
+        kept[np.argmax(worst)] = False
+    return kept
@@ -0,0 +1,251 @@
+import bz2
+import gzip
+import os
+import re
+import struct
+
+import numpy as np
+
+# NRRD type names
+_NRRD_TYPES = {
+    'signed char': 'i1', 'int8': 'i1', 'int8_t': 'i1',
+    'uchar': 'u1', 'unsigned char': 'u1', 'uint8': 'u1', 'uint8_t': 'u1',
+    'short': 'i2', 'short int': 'i2', 'signed short': 'i2', 'signed short int': 'i2', 'int16': 'i2', 'int16_t': 'i2',
+    'ushort': 'u2', 'unsigned short': 'u2', 'unsigned short int': 'u2', 'uint16': 'u2', 'uint16_t': 'u2',
+    'int': 'i4', 'signed int': 'i4', 'int32': 'i4', 'int32_t': 'i4',
+    'uint': 'u4', 'unsigned int': 'u4', 'uint32': 'u4', 'uint32_t': 'u4',
+    'longlong': 'i8', 'long long': 'i8', 'long long int': 'i8', 'signed long long': 'i8',
+    'signed long long int': 'i8', 'int64': 'i8', 'int64_t': 'i8',
+    'ulonglong': 'u8', 'unsigned long long': 'u8', 'unsigned long long int': 'u8', 'uint64': 'u8', 'uint64_t': 'u8',
+    'float': 'f4', 'double': 'f8',
+}
+
+# NIfTI-1 datatype codes
+_NIFTI_TYPES = {2: 'u1', 4: 'i2', 8: 'i4', 16: 'f4', 64: 'f8', 256: 'i1', 512: 'u2', 768: 'u4', 1024: 'i8',
+                1280: 'u8'}
+
+_LPS_TO_RAS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+# Size of the blocks read from compressed files
+_CHUNK_SIZE = 1 << 20
+
+_VECTOR = re.compile(r'\(([^)]*)\)')
+
+
+class VolumeFile:
+    """Lazily read 3-D NRRD or NIfTI-1 volume.
+
+    Uncompressed payloads are memory-mapped, so only the pages of the slices that are actually used are
+    read. Compressed payloads (gzip, bzip2) are decompressed as a stream, up to the last requested slice.
+
+    Attributes:
+        path (str): path of the header file
+        shape (tuple): (i, j, k) dimensions
+        dtype (numpy.dtype): voxel type, including byte order
+        ijkToRAS (numpy.ndarray): 4x4 IJK to RAS matrix
+        spacing (numpy.ndarray): voxel spacing in mm
+        dataPath (str): file containing the voxel data
+        offset (int): byte offset of the voxel data (or of the compressed stream) in dataPath
+        streamSkip (int): bytes to skip in the decompressed stream before the voxel data
+        encoding (str): 'raw', 'gzip' or 'bzip2'
+    """
+
+    def __init__(self, path):
+        self.path = path
+        lowerPath = path.lower()
+        if lowerPath.endswith('.nrrd') or lowerPath.endswith('.nhdr'):
+            self._ReadNrrdHeader()
+        elif lowerPath.endswith('.nii') or lowerPath.endswith('.nii.gz') or lowerPath.endswith('.hdr'):
+            self._ReadNiftiHeader()
+        else:
+            raise ValueError(f"Unsupported volume file format: {path}")
+        self.spacing = np.linalg.norm(self.ijkToRAS[:3, :3], axis=0)
+
+    @property
+    def sliceBytes(self):
+        return int(self.shape[0]) * int(self.shape[1]) * self.dtype.itemsize
+
+    def GetArray(self, sliceRange=None):
+        """Return the volume as an (i, j, k) array.
+
+        For an uncompressed payload the array is a view of a read-only memory map. For a compressed payload
+        only the slices in sliceRange are decoded; the others read as zero and take no memory until written.
+
+        Args:
+            sliceRange (list): [start, end) range of the slices that will be accessed, or None for all slices
+
+        Returns:
+            numpy.ndarray: volume indexed [i, j, k]
+        """
+        numSlices = self.shape[2]
+        start, end = (0, numSlices) if sliceRange is None else (max(0, sliceRange[0]), min(numSlices, sliceRange[1]))
+        if self.encoding == 'raw':
+            data = np.memmap(self.dataPath, dtype=self.dtype, mode='r', offset=self.offset,
+                             shape=(numSlices, self.shape[1], self.shape[0]))
+        else:
+            data = np.zeros((numSlices, self.shape[1], self.shape[0]), dtype=self.dtype)
+            if start < end:
+                data[start:end] = self._DecompressSlices(start, end)
+        return data.transpose(2, 1, 0)
+
+    def _DecompressSlices(self, start, end):
+        """Decompress slices start..end-1, stopping the stream after the last of them."""
+        opener = gzip.open if self.encoding == 'gzip' else bz2.open
+        sliceBytes = self.sliceBytes
+        with open(self.dataPath, 'rb') as raw:
+            raw.seek(self.offset)
+            with opener(raw, 'rb') as stream:
+                # Skip the slices before the range without keeping them
+                remaining = self.streamSkip + start * sliceBytes
+                while remaining > 0:
+                    skipped = len(stream.read(min(remaining, _CHUNK_SIZE)))
+                    if skipped == 0:
+                        raise ValueError(f"Unexpected end of compressed data in {self.dataPath}")
+                    remaining -= skipped
+                buffer = bytearray((end - start) * sliceBytes)
+                view = memoryview(buffer)
+                position = 0
+                while position < len(buffer):
+                    count = stream.readinto(view[position:position + _CHUNK_SIZE])
+                    if count == 0:
+                        raise ValueError(f"Unexpected end of compressed data in {self.dataPath}")
+                    position += count
+        return np.frombuffer(buffer, dtype=self.dtype).reshape(end - start, self.shape[1], self.shape[0])
+
+    def _ReadNrrdHeader(self):
+        fields = {}
+        with open(self.path, 'rb') as f:
+            magic = f.readline()
+            if not magic.startswith(b'NRRD'):
+                raise ValueError(f"Not a NRRD file: {self.path}")
+            while True:
+                line = f.readline()
+                if not line or not line.strip():
+                    break
+                line = line.decode('latin-1').rstrip('\r\n')
+                if line.startswith('#') or ':=' in line:
+                    continue
+                key, _, value = line.partition(':')
+                fields[key.strip().lower()] = value.strip()
+            headerEnd = f.tell()
+
+        if int(fields.get('dimension', 0)) != 3:
+            raise ValueError(f"Only 3-D NRRD volumes are supported: {self.path}")
+        self.shape = tuple(int(v) for v in fields['sizes'].split())
+        typeName = _NRRD_TYPES.get(fields['type'].lower())
+        if typeName is None:
+            raise ValueError(f"Unsupported NRRD type: {fields['type']}")
+        byteOrder = '>' if fields.get('endian', 'little').lower() == 'big' else '<'
+        self.dtype = np.dtype(byteOrder + typeName)
+
+        encoding = fields.get('encoding', 'raw').lower()
+        self.encoding = {'raw': 'raw', 'gzip': 'gzip', 'gz': 'gzip', 'bzip2': 'bzip2', 'bz2': 'bzip2'}.get(encoding)
+        if self.encoding is None:
+            raise ValueError(f"Unsupported NRRD encoding: {encoding}")
+
+        dataFile = fields.get('data file', fields.get('datafile'))
+        if dataFile is None:
+            self.dataPath = self.path
+            self.offset = headerEnd
+        else:
+            if dataFile.startswith('LIST') or len(dataFile.split()) > 1:
+                raise ValueError(f"Multi-file NRRD data is not supported: {self.path}")
+            self.dataPath = dataFile if os.path.isabs(dataFile) else os.path.join(os.path.dirname(self.path), dataFile)
+            self.offset = 0
+            for _ in range(int(fields.get('line skip', fields.get('lineskip', 0)))):
+                with open(self.dataPath, 'rb') as f:
+                    f.seek(self.offset)
+                    self.offset += len(f.readline())
+        # For compressed data the byte skip applies to the decompressed stream
+        byteSkip = int(fields.get('byte skip', fields.get('byteskip', 0)))
+        self.streamSkip = 0
+        if byteSkip == -1:
+            if self.encoding != 'raw':
+                raise ValueError("'byte skip: -1' is only valid for raw NRRD data")
+            self.offset = os.path.getsize(self.dataPath) - self.sliceBytes * self.shape[2]
+        elif self.encoding == 'raw':
+            self.offset += byteSkip
+        else:
+            self.streamSkip = byteSkip
+
+        # IJK to space matrix, converted to RAS
+        self.ijkToRAS = np.eye(4)
+        if 'space directions' in fields:
+            directions = [[float(v) for v in vector.split(',')] for vector in _VECTOR.findall(fields['space directions'])]
+            self.ijkToRAS[:3, :3] = np.array(directions).T
+        elif 'spacings' in fields:
+            self.ijkToRAS[:3, :3] = np.diag([float(v) for v in fields['spacings'].split()])
+        if 'space origin' in fields:
+            self.ijkToRAS[:3, 3] = [float(v) for v in _VECTOR.findall(fields['space origin'])[0].split(',')]
+        space = fields.get('space', '').lower()
+        if space in ('left-posterior-superior', 'lps'):
+            self.ijkToRAS = _LPS_TO_RAS @ self.ijkToRAS
+        elif space not in ('', 'right-anterior-superior', 'ras'):
+            raise ValueError(f"Unsupported NRRD space: {space}")
+
+    def _ReadNiftiHeader(self):
+        opener = gzip.open if self.path.lower().endswith('.gz') else open
+        with opener(self.path, 'rb') as f:
+            header = f.read(348)
+        if len(header) < 348:
+            raise ValueError(f"Not a NIfTI-1 file: {self.path}")
+        byteOrder = '<' if struct.unpack('<i', header[:4])[0] == 348 else '>'
+        if struct.unpack(byteOrder + 'i', header[:4])[0] != 348:
+            raise ValueError(f"Not a NIfTI-1 file: {self.path}")
+
+        def read(format, offset):
+            return struct.unpack_from(byteOrder + format, header, offset)
+
+        dim = read('8h', 40)
+        if dim[0] < 3 or any(d > 1 for d in dim[4:dim[0] + 1]):
+            raise ValueError(f"Only 3-D NIfTI volumes are supported: {self.path}")
+        self.shape = tuple(int(d) for d in dim[1:4])
+        datatype = read('h', 70)[0]
+        if datatype not in _NIFTI_TYPES:
+            raise ValueError(f"Unsupported NIfTI datatype: {datatype}")
+        self.dtype = np.dtype(byteOrder + _NIFTI_TYPES[datatype])
+        slope, intercept = read('2f', 112)
+        if (slope not in (0.0, 1.0)) or intercept != 0.0:
+            raise ValueError("Scaled NIfTI data (scl_slope/scl_inter) is not supported")
+
+        if header[344:347] == b'ni1':
+            self.dataPath = self.path[:-4] + '.img'
+            voxelOffset = 0
+        else:
+            self.dataPath = self.path
+            voxelOffset = int(read('f', 108)[0])
+        self.encoding = 'gzip' if self.dataPath.lower().endswith('.gz') else 'raw'
+        # A .nii.gz file is compressed as a whole, header included
+        self.offset, self.streamSkip = (voxelOffset, 0) if self.encoding == 'raw' else (0, voxelOffset)
+
+        # IJK to RAS matrix from the sform, the qform, or the voxel size
+        pixdim = read('8f', 76)
+        qformCode, sformCode = read('2h', 252)
+        self.ijkToRAS = np.eye(4)
+        if sformCode > 0:
+            self.ijkToRAS[:3, :] = np.array(read('12f', 280)).reshape(3, 4)
+        elif qformCode > 0:
+            b, c, d, x, y, z = read('6f', 256)
+            a = np.sqrt(max(0.0, 1.0 - (b*b + c*c + d*d)))
+            rotation = np.array([[a*a + b*b - c*c - d*d, 2*(b*c - a*d), 2*(b*d + a*c)],
+                                 [2*(b*c + a*d), a*a + c*c - b*b - d*d, 2*(c*d - a*b)],
+                                 [2*(b*d - a*c), 2*(c*d + a*b), a*a + d*d - c*c - b*b]])
+            qfac = -1.0 if pixdim[0] < 0 else 1.0
+            self.ijkToRAS[:3, :3] = rotation * np.array([pixdim[1], pixdim[2], pixdim[3] * qfac])
+            self.ijkToRAS[:3, 3] = [x, y, z]
+        else:
+            self.ijkToRAS[:3, :3] = np.diag(pixdim[1:4])
+
+
+def ReadVolume(path, sliceRange=None):
+    """Open a NRRD or NIfTI-1 volume and return its (i, j, k) array and 4x4 IJK to RAS matrix.
+
+    Args:
+        path (str): volume file
+        sliceRange (list): [start, end) range of the slices that will be accessed, or None for all slices
+
+    Returns:
+        tuple: (array, ijkToRAS), see VolumeFile.GetArray
+    """
+    volume = VolumeFile(path)
+    return volume.GetArray(sliceRange), volume.ijkToRAS
@@ -6,8 +6,16 @@ if moduleDir not in sys.path:
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
+import threading
 import numpy as np
-from ZFrame.Registration import zf, ZFrameRegistration
+# Only the light ZFrame modules are imported with the module; ZFrame.Registration is imported by the logic
+# when a registration runs (see ZFrame/ImportBenchmark.py for the import time budget)
+from ZFrame.Topology import registry as topologyRegistry
+from ZFrame.GlobalFit import SOLVER_CLOSED_FORM, SOLVER_GLOBAL_FIT
+from ZFrame.Detection import PRECISION_DOUBLE, PRECISION_SINGLE
+
+# Number of line fiducials of each Z-frame type
+FIDUCIAL_TYPES = {"7-fiducial": 7, "9-fiducial": 9}
 
 class ZFrameRegistrationScripted(ScriptedLoadableModule):
     def __init__(self, parent):
@@ -46,9 +54,9 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
 
     def onReload(self,moduleName="ZFrameRegistrationScripted"):
         self.zFrameTopologies = {}
-        if 'ZFrame.Registration' in sys.modules:
-            del sys.modules['ZFrame.Registration']
-            print("ZFrame.Registration Deleted")
+        for name in [name for name in sys.modules if name.startswith('ZFrame.')]:
+            del sys.modules[name]
+            print(f"{name} Deleted")
 
         globals()[moduleName] = slicer.util.reloadScriptedModule(moduleName)
 
@@ -102,6 +110,15 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
         # Initialize topology text for default selection
         self.onZFrameConfigChanged(self.zframeConfigSelector.currentText)
 
+        # Topology auto-detection
+        self.autoDetectCheckBox = qt.QCheckBox()
+        self.autoDetectCheckBox.checked = False
+        self.autoDetectCheckBox.setToolTip("Detect the fiducials once and pick the configuration of configs.txt "
+                                           "that matches them best, instead of the frame type and configuration "
+                                           "above. The background detection is not used in this mode.")
+        parametersFormLayout.addRow("Auto-detect Frame: ", self.autoDetectCheckBox)
+        self.autoDetectCheckBox.connect('toggled(bool)', self.onAutoDetectToggled)
+
         # Slice range
         self.sliceRangeWidget = slicer.qMRMLRangeWidget()
         self.sliceRangeWidget.decimals = 0
@@ -111,7 +128,29 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
         self.sliceRangeWidget.maximumValue = 11
         self.sliceRangeWidget.singleStep = 1
         parametersFormLayout.addRow("Slice Range: ", self.sliceRangeWidget)
-        self.onInputVolumeSelected(self.inputSelector.currentNode())
+        
+        # Solver selector
+        self.solverSelector = qt.QComboBox()
+        self.solverSelector.addItem("Closed form (per slice)", SOLVER_CLOSED_FORM)
+        self.solverSelector.addItem("Global fit (all slices)", SOLVER_GLOBAL_FIT)
+        self.solverSelector.setToolTip("Average the closed-form pose of each slice, or refine it with a "
+                                       "least-squares fit of the line fiducials to the intercepts of all slices.")
+        parametersFormLayout.addRow("Solver: ", self.solverSelector)
+        
+        # Precision
+        self.singlePrecisionCheckBox = qt.QCheckBox()
+        self.singlePrecisionCheckBox.checked = False
+        self.singlePrecisionCheckBox.setToolTip("Compute the image correlation in single precision (float32), "
+                                                "which is faster and uses half the memory.")
+        parametersFormLayout.addRow("Single Precision: ", self.singlePrecisionCheckBox)
+        
+        # Background detection
+        self.prefetchCheckBox = qt.QCheckBox()
+        self.prefetchCheckBox.checked = False
+        self.prefetchCheckBox.setToolTip("Detect the fiducials of the slice range in the background as soon as a "
+                                         "volume is selected, so that Apply only has to compute the pose.")
+        parametersFormLayout.addRow("Background Detection: ", self.prefetchCheckBox)
+        self.prefetchCheckBox.connect('toggled(bool)', self.onPrefetchToggled)
         
         # Output transform selector
         self.outputSelector = slicer.qMRMLNodeComboBox()
@@ -133,13 +172,47 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
         parametersFormLayout.addRow(self.applyButton)
         self.applyButton.connect('clicked(bool)', self.onApplyButton)
         
+        self.onInputVolumeSelected(self.inputSelector.currentNode())
         self.layout.addStretch(1)
+
+    def cleanup(self):
+        self.logic.stopPrefetch()
         
     def onInputVolumeSelected(self, node):
         if node:
             dims = node.GetImageData().GetDimensions()
             self.sliceRangeWidget.minimum = 0
             self.sliceRangeWidget.maximum = dims[2]-1
+            if self.prefetchCheckBox.checked:
+                self.startPrefetch(node)
+
+    def onAutoDetectToggled(self, checked):
+        for widget in (self.fiducialTypeSelector, self.zframeConfigSelector, self.frameTopologyTextEdit):
+            widget.enabled = not checked
+        if checked:
+            self.logic.stopPrefetch()
+        elif self.prefetchCheckBox.checked and self.inputSelector.currentNode():
+            self.startPrefetch(self.inputSelector.currentNode())
+
+    def onPrefetchToggled(self, checked):
+        if checked and self.inputSelector.currentNode():
+            self.startPrefetch(self.inputSelector.currentNode())
+        elif not checked:
+            self.logic.stopPrefetch()
+
+    def startPrefetch(self, node):
+        if self.autoDetectCheckBox.checked:
+            return
+        try:
+            self.logic.startPrefetch(node,
+                                     self.zframeConfigSelector.currentText,
+                                     self.fiducialTypeSelector.currentText,
+                                     self.frameTopologyTextEdit.toPlainText(),
+                                     [int(self.sliceRangeWidget.minimumValue), int(self.sliceRangeWidget.maximumValue)],
+                                     PRECISION_SINGLE if self.singlePrecisionCheckBox.checked else PRECISION_DOUBLE)
+        except Exception as e:
+            # Apply reports the errors of the inputs
+            logging.warning(f"Background detection not started: {e}")
 
     def loadZFrameConfigs(self):
         """Load Z-frame configurations from configs.txt file"""
@@ -148,25 +221,9 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
         self.zframeConfigSelector.clear()
         
         try:
-            with open(configPath, 'r') as f:
-                lines = f.readlines()
-            
-            self.zFrameTopologies = {}
-            
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):  # Skip empty lines and comments
-                    continue
-                
-                # Split the line into config name and topology data
-                try:
-                    config_name, topology = line.split(':', 1)
-                    config_name = config_name.strip()
-                    topology = topology.strip()
-                    self.zFrameTopologies[config_name] = topology
-                except ValueError:
-                    logging.warning(f"Skipping invalid line in configs.txt: {line}")
-                    continue
+            # The registry parses and validates the file once and re-reads it only when it changes on disk
+            self.zFrameTopologies = {name: topology.text
+                                     for name, topology in topologyRegistry.LoadConfigs(configPath).items()}
             
             # Update the combo box with the config names
             self.zframeConfigSelector.clear()
@@ -187,56 +244,79 @@ class ZFrameRegistrationScriptedWidget(ScriptedLoadableModuleWidget):
 
 
     def onApplyButton(self):
+        startSlice = int(self.sliceRangeWidget.minimumValue)
+        endSlice = int(self.sliceRangeWidget.maximumValue)
+        progressDialog = slicer.util.createProgressDialog(labelText="Registering the Z-frame...",
+                                                          maximum=max(1, endSlice - startSlice))
+        cancel = threading.Event()
+
+        def onSliceProcessed(status):
+            # Slices are not always reported in order (see ZFrameRegistration.SetPropagation)
+            progressDialog.value += 1
+            progressDialog.labelText = f"Slice {status.slice}: {'localized' if status.success else 'skipped'}"
+            slicer.app.processEvents()
+            if progressDialog.wasCanceled:
+                cancel.set()
+
         try:
             self.logic.run(self.inputSelector.currentNode(),
                      self.outputSelector.currentNode(),
                      self.zframeConfigSelector.currentText,
                      self.fiducialTypeSelector.currentText,
                      self.frameTopologyTextEdit.toPlainText(),
-                     int(self.sliceRangeWidget.minimumValue),
-                     int(self.sliceRangeWidget.maximumValue))
+                     startSlice,
+                     endSlice,
+                     self.solverSelector.currentData,
+                     PRECISION_SINGLE if self.singlePrecisionCheckBox.checked else PRECISION_DOUBLE,
+                     progress=onSliceProcessed,
+                     cancel=cancel,
+                     autoDetect=self.autoDetectCheckBox.checked)
+            topology = self.logic.detectedTopology
+            if topology is not None:
+                # Show the configuration that was found
+                self.fiducialTypeSelector.setCurrentText(self.logic.fiducialType(topology.numFiducials))
+                self.zframeConfigSelector.setCurrentText(topology.name)
         except Exception as e:
             slicer.util.errorDisplay("Failed to compute results: "+str(e))
             import traceback
             traceback.print_exc()
+        finally:
+            progressDialog.close()
 
 class ZFrameRegistrationScriptedLogic(ScriptedLoadableModuleLogic):
-    def run(self, inputVolume, outputTransform, zframeConfig, zframeType, frameTopology, startSlice, endSlice):
+    def __init__(self, parent=None):
+        ScriptedLoadableModuleLogic.__init__(self, parent)
+        self.detectionCache = None  # (key, results) of the last background detection
+        self.prefetchThread = None
+        self.prefetchStop = None
+        self.detectedTopology = None  # FrameTopology found by the last run() in auto-detection mode
+
+    def run(self, inputVolume, outputTransform, zframeConfig, zframeType, frameTopology, startSlice, endSlice,
+            solver=SOLVER_CLOSED_FORM, precision=PRECISION_DOUBLE, zFrameFids=None, progress=None, cancel=None,
+            autoDetect=False):
         """
         Run the Z-frame registration algorithm
+
+        zFrameFids optionally gives the fiducial intercepts in IJ pixel coordinates (one list of [i, j] points
+        for every slice, or a dict mapping slice indices to their points), in which case the automatic
+        detection is skipped.
+
+        progress is called with a ZFrame.Results.SliceProgress after each slice, and setting the cancel
+        threading.Event stops the registration between two slices (see ZFrameRegistration.Register); a
+        cancelled registration returns False and leaves the output transform unchanged.
+
+        With autoDetect, zframeConfig, zframeType and frameTopology are ignored: the fiducials are detected once
+        and the configuration of configs.txt that matches them best is used (see
+        ZFrame.TopologySelection.SelectFrameTopology); it is kept in self.detectedTopology.
         """
+        from ZFrame.Registration import zf, ZFrameRegistration
+
         logging.info('Processing started')
         
         if not inputVolume or not outputTransform:
             raise ValueError("Input volume or output transform is missing")
             
-        # Get image data
-        imageData = inputVolume.GetImageData()
-        if not imageData:
-            raise ValueError("Input image is invalid")
-        # Convert vtkImageData to numpy array
-        dim = imageData.GetDimensions()
-        imageData = vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
-        imageData = imageData.reshape(dim[2], dim[1], dim[0]).transpose(2,1,0) # Note: VTK uses opposite order (z,y,x)
-
-        # Get image properties
-        origin = inputVolume.GetOrigin()
-        spacing = inputVolume.GetSpacing()
-        directions = vtk.vtkMatrix4x4()
-        inputVolume.GetIJKToRASDirectionMatrix(directions)
-
-        # Create the RAS to LPS transform
-        ras2lps = vtk.vtkMatrix4x4()
-        ras2lps.Identity()
-        ras2lps.SetElement(0,0,-1)
-        ras2lps.SetElement(1,1,-1)
-        
-        # Create the image to world transform as numpy array
-        imageTransform = np.eye(4)  # Start with 4x4 identity matrix
-        for i in range(3):
-            for j in range(3):
-                imageTransform[i,j] = spacing[j] * directions.GetElement(i,j)
-            imageTransform[i,3] = origin[i]
+        imageData, imageTransform = self.getImageArrayAndTransform(inputVolume)
 
         ZmatrixBase = np.eye(4)
         ZquaternionBase = [0.0, 0.0, 0.0, 1.0]
@@ -247,23 +327,18 @@ class ZFrameRegistrationScriptedLogic(ScriptedLoadableModuleLogic):
         Zorientation = [0.0, 0.0, 0.0, 1.0]
         result = False
 
-        #dim = [dimensions[0], dimensions[1], dimensions[2]]
-        #manualRegistration = False 
-        
-        # Convert frameTopology string back into an array of floats
-        # "[0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0], [0.0, 0.0, 0.0]"
-        frameTopologyArr = []
-        # Remove whitespace from the string and split
-        frameTopologyList = ''.join(frameTopology.split()).strip("[]").split("],[")
-        for n in frameTopologyList:
-            # Convert each coordinate string into floats
-            x, y, z = map(float, n.split(","))
-            frameTopologyArr.append([x, y, z])
-        # Final result is stored in frameTopologyArr[6][3]
-        # The first 3 rows contain the origin points in RAS coordinates of Side 1, Base, and Side 2, respectively. 
-        # The 4th, 5th, and 6th rows contain the diagonal vectors in RAS coordinates of Side 1, Base, and Side 2.
-
-        # TODO: Implement manual registration
+        self.detectedTopology = None
+        detection = None
+        if autoDetect:
+            from ZFrame.TopologySelection import SelectFrameTopology
+            match, _ = SelectFrameTopology(imageData, imageTransform, sliceRange, precision=precision)
+            if match is None:
+                raise ValueError("No Z-frame configuration matches the fiducials of the image")
+            self.detectedTopology = match.topology
+            zframeConfig, frameTopology = match.topology.name, match.topology
+            zframeType = self.fiducialType(match.topology.numFiducials)
+            detection = match.sliceResults
+            logging.info(f"Detected Z-frame configuration: {zframeConfig} ({zframeType})")
 
         # Toggle registration algorithm based on zframe configuration
         if zframeType == "7-fiducial":
@@ -276,12 +351,25 @@ class ZFrameRegistrationScriptedLogic(ScriptedLoadableModuleLogic):
             registration = ZFrameRegistration(numFiducials=9)
         else:
             raise ValueError("Invalid Z-frame configuration")
+
+        # The frameTopology string is parsed once by the shared registry into an immutable topology:
+        # origins and diagonal vectors of Side 1, Base, and Side 2 plus the derived per-side constants
+        topology = topologyRegistry.GetTopology(frameTopology, registration.numFiducials, zframeConfig)
         
         if registration:
             registration.SetInputImage(imageData, imageTransform)
             registration.SetOrientationBase(ZquaternionBase)
-            registration.SetFrameTopology(frameTopologyArr)
-            result, Zposition, Zorientation = registration.Register(sliceRange)
+            registration.SetFrameTopology(topology)
+            registration.SetSolver(solver)
+            registration.SetPrecision(precision)
+            if zFrameFids is not None:
+                registration.SetManualZFrameFiducials(zFrameFids)
+            elif detection is not None:
+                registration.SetDetectionCache(detection)
+            else:
+                registration.SetDetectionCache(self.getPrefetchedDetection(
+                    self.detectionCacheKey(inputVolume, imageTransform, topology, precision)))
+            result, Zposition, Zorientation = registration.Register(sliceRange, progress, cancel)
         else:
             raise ValueError("Invalid Z-frame configuration")
         
@@ -308,39 +396,694 @@ class ZFrameRegistrationScriptedLogic(ScriptedLoadableModuleLogic):
             outputTransform.SetMatrixTransformToParent(zMatrix)
             logging.info('Processing completed')
             return True
+        elif registration.cancelled:
+            logging.info('Processing cancelled')
+            return False
         else:
             logging.error('Processing failed')
             return False
 
+    @staticmethod
+    def fiducialType(numFiducials):
+        """Return the Z-frame type name (see FIDUCIAL_TYPES) of a number of fiducials."""
+        for name, count in FIDUCIAL_TYPES.items():
+            if count == numFiducials:
+                return name
+        raise ValueError(f"Unsupported number of fiducials: {numFiducials}")
+
+    def getImageArrayAndTransform(self, inputVolume):
+        """Return the image of a volume as an [i, j, k] numpy array (without copy) and its 4x4 IJK to RAS matrix."""
+        # Get image data
+        imageData = inputVolume.GetImageData()
+        if not imageData:
+            raise ValueError("Input image is invalid")
+        # Convert vtkImageData to numpy array
+        dim = imageData.GetDimensions()
+        imageData = vtk.util.numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+        imageData = imageData.reshape(dim[2], dim[1], dim[0]).transpose(2,1,0) # Note: VTK uses opposite order (z,y,x)
+
+        # Get image properties
+        origin = inputVolume.GetOrigin()
+        spacing = inputVolume.GetSpacing()
+        directions = vtk.vtkMatrix4x4()
+        inputVolume.GetIJKToRASDirectionMatrix(directions)
+
+        # Create the RAS to LPS transform
+        ras2lps = vtk.vtkMatrix4x4()
+        ras2lps.Identity()
+        ras2lps.SetElement(0,0,-1)
+        ras2lps.SetElement(1,1,-1)
         
-        
-        
-        
+        # Create the image to world transform as numpy array
+        imageTransform = np.eye(4)  # Start with 4x4 identity matrix
+        for i in range(3):
+            for j in range(3):
+                imageTransform[i,j] = spacing[j] * directions.GetElement(i,j)
+            imageTransform[i,3] = origin[i]
+        return imageData, imageTransform
+
+    @staticmethod
+    def detectionCacheKey(inputVolume, imageTransform, topology, precision):
+        """Inputs that the fiducials detected in a volume depend on."""
+        return (inputVolume.GetID(), inputVolume.GetImageData().GetMTime(), tuple(np.ravel(imageTransform)),
+                topology.numFiducials, tuple(np.ravel(topology.values)), precision)
 
-# class ZFrameRegistrationScriptedTest(ScriptedLoadableModuleTest):
-#     def setUp(self):
-#         slicer.mrmlScene.Clear(0)
+    def startPrefetch(self, inputVolume, zframeConfig, zframeType, frameTopology, sliceRange,
+                      precision=PRECISION_DOUBLE):
+        """Detect the fiducials of a slice range in a background thread, ahead of run().
+
+        The slices of the range are copied here, so that the worker thread does not read the volume while it is
+        edited; the slice conversion and the detection run in the worker thread. run() uses the detected slices
+        when its volume (including the modification time of its image data), topology and precision are the same,
+        and only computes the pose from them. A background detection still running is stopped first.
+
+        Args:
+            sliceRange (list): [start_slice, end_slice] range of slices to detect
+        """
+        from ZFrame.Registration import ZFrameRegistration
+
+        self.stopPrefetch()
+        if zframeType not in FIDUCIAL_TYPES:
+            raise ValueError("Invalid Z-frame configuration")
+        imageData, imageTransform = self.getImageArrayAndTransform(inputVolume)
+        topology = topologyRegistry.GetTopology(frameTopology, FIDUCIAL_TYPES[zframeType], zframeConfig)
+        key = self.detectionCacheKey(inputVolume, imageTransform, topology, precision)
+        # Copy of the slab of slices, with its own IJK to RAS matrix; the slices are renumbered after the detection
+        start = min(max(sliceRange[0], 0), imageData.shape[2])
+        end = min(max(sliceRange[1], start), imageData.shape[2])
+        slab = np.array(imageData[:, :, start:end])
+        slabTransform = imageTransform.copy()
+        slabTransform[:3, 3] += start * imageTransform[:3, 2]
+        stop = threading.Event()
+
+        def detect():
+            try:
+                registration = ZFrameRegistration(numFiducials=topology.numFiducials)
+                registration.SetInputImage(slab, slabTransform)
+                registration.SetFrameTopology(topology)
+                registration.SetPrecision(precision)
+                results = registration.DetectSlices(range(end - start), stop)
+                results['slice'] += start
+                self.detectionCache = (key, results)
+            except Exception as e:
+                logging.warning(f"Background detection failed: {e}")
+
+        self.prefetchStop = stop
+        self.prefetchThread = threading.Thread(target=detect, name="ZFrameDetectionPrefetch", daemon=True)
+        self.prefetchThread.start()
+
+    def stopPrefetch(self):
+        """Stop the background detection after its current slice; the slices already detected are kept."""
+        if self.prefetchThread is not None:
+            self.prefetchStop.set()
+            self.prefetchThread.join()
+            self.prefetchThread = None
+
+    def getPrefetchedDetection(self, key):
+        """Return the results of the background detection if it was run with the same inputs, or None.
+
+        Args:
+            key (tuple): inputs of the registration, as returned by detectionCacheKey
+        """
+        self.stopPrefetch()
+        if self.detectionCache is None:
+            return None
+        cachedKey, results = self.detectionCache
+        if cachedKey[0] == key[0] and cachedKey[1] != key[1]:
+            logging.info("Image data modified after the background detection; the slices are detected again")
+            return None
+        if cachedKey != key:
+            return None
+        return results
 
-#     def runTest(self):
-#         self.setUp()
-#         self.test_ZFrameRegistration1()
 
-#     def test_ZFrameRegistration1(self):
-#         self.delayDisplay("Starting the test")
         
-#         # Get/create input data
-#         import SampleData
-#         inputVolume = SampleData.downloadFromURL(
-#             nodeNames='MRHead',
-#             fileNames='MR-Head.nrrd',
-#             uris='https://github.com/Slicer/SlicerTestingData/releases/download/MD5/39b01631b7b38232a220007230624c8e',
-#             checksums='MD5:39b01631b7b38232a220007230624c8e')[0]
-#         self.delayDisplay('Finished with download and loading')
         
-#         outputTransform = slicer.vtkMRMLLinearTransformNode()
-#         slicer.mrmlScene.AddNode(outputTransform)
         
-#         logic = ZFrameRegistrationScriptedLogic()
-#         self.assertTrue(logic.run(inputVolume, outputTransform, "z001", 0, 10))
         
-#         self.delayDisplay('Test passed!') 
\ No newline at end of file
+
+class ZFrameRegistrationScriptedTest(ScriptedLoadableModuleTest):
+    def setUp(self):
+        slicer.mrmlScene.Clear(0)
+
+    def runTest(self):
+        self.setUp()
+        self.test_ZFrameRegistration1()
+        self.setUp()
+        self.test_SinglePrecisionAccuracy()
+        self.setUp()
+        self.test_SinglePrecisionAccuracyHeadless()
+        self.setUp()
+        self.test_GlobalFitSolver()
+        self.setUp()
+        self.test_TrackingMode()
+        self.setUp()
+        self.test_Propagation()
+        self.setUp()
+        self.test_RegisterBatch()
+        self.setUp()
+        self.test_RegistrationService()
+        self.setUp()
+        self.test_RegistrationServiceQueue()
+        self.setUp()
+        self.test_ManualFiducials()
+        self.setUp()
+        self.test_DetectionPrefetch()
+        self.setUp()
+        self.test_ProgressAndCancel()
+        self.setUp()
+        self.test_AutoDetectTopology()
+        self.setUp()
+        self.test_FiducialGeometry()
+        self.setUp()
+        self.test_ImportTimeReport()
+
+    def testVolumePath(self):
+        return os.path.join(os.path.dirname(moduleDir), "ZFrameRegistration", "Data", "Input",
+                            "CoverTemplateMasked.nrrd")
+
+    def loadTestVolume(self):
+        inputVolume = slicer.util.loadVolume(self.testVolumePath())
+        self.delayDisplay('Finished with loading')
+        return inputVolume
+
+    def runRegistration(self, inputVolume, precision, zFrameFids=None, logic=None):
+        outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+        logic = logic or ZFrameRegistrationScriptedLogic()
+        topology = topologyRegistry.LoadConfigs()["z001"]
+        self.assertTrue(logic.run(inputVolume, outputTransform, "z001", "7-fiducial", topology.text, 6, 11,
+                                  precision=precision, zFrameFids=zFrameFids))
+        matrix = vtk.vtkMatrix4x4()
+        outputTransform.GetMatrixTransformToParent(matrix)
+        return np.array([[matrix.GetElement(i, j) for j in range(4)] for i in range(4)])
+
+    def test_ZFrameRegistration1(self):
+        self.delayDisplay("Starting the test")
+        inputVolume = self.loadTestVolume()
+        self.runRegistration(inputVolume, PRECISION_DOUBLE)
+        self.delayDisplay('Test passed!')
+
+    def test_SinglePrecisionAccuracy(self):
+        """The float32 correlation must give the same registration as the float64 one on the test volume."""
+        self.delayDisplay("Starting the single precision accuracy test")
+        inputVolume = self.loadTestVolume()
+        doubleMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+        singleMatrix = self.runRegistration(inputVolume, PRECISION_SINGLE)
+
+        # Within 0.01 mm and 0.01 degree
+        self.assertLess(np.linalg.norm(doubleMatrix[:3, 3] - singleMatrix[:3, 3]), 0.01)
+        cosine = (np.trace(doubleMatrix[:3, :3].T @ singleMatrix[:3, :3]) - 1.0) / 2.0
+        self.assertLess(np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))), 0.01)
+        self.delayDisplay('Test passed!')
+
+    def test_SinglePrecisionAccuracyHeadless(self):
+        """The float32 correlation must match the float64 one on the engine alone, as in the Slicer-free tools."""
+        from ZFrame.Registration import zf, ZFrameRegistration
+        from ZFrame.VolumeReader import ReadVolume
+
+        self.delayDisplay("Starting the headless single precision accuracy test")
+        volume, ijkToRAS = ReadVolume(self.testVolumePath(), [6, 11])
+        matrices = {}
+        for precision in (PRECISION_DOUBLE, PRECISION_SINGLE):
+            registration = ZFrameRegistration(numFiducials=7)
+            registration.SetInputImage(volume, ijkToRAS)
+            registration.SetOrientationBase([0.0, 0.0, 0.0, 1.0])
+            registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+            registration.SetPrecision(precision)
+            success, position, quaternion = registration.Register([6, 11])
+            self.assertTrue(success)
+            matrices[precision] = zf.QuaternionToMatrix(quaternion)
+            matrices[precision][:3, 3] = position
+
+        # Within 0.01 mm and 0.01 degree
+        doubleMatrix, singleMatrix = matrices[PRECISION_DOUBLE], matrices[PRECISION_SINGLE]
+        self.assertLess(np.linalg.norm(doubleMatrix[:3, 3] - singleMatrix[:3, 3]), 0.01)
+        cosine = (np.trace(doubleMatrix[:3, :3].T @ singleMatrix[:3, :3]) - 1.0) / 2.0
+        self.assertLess(np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))), 0.01)
+        self.delayDisplay('Test passed!')
+
+    def test_GlobalFitSolver(self):
+        """The global least-squares fit must fit the line fiducials and stay close to the closed-form pose."""
+        from ZFrame.GlobalFit import SOLVER_CLOSED_FORM, SOLVER_GLOBAL_FIT
+        from ZFrame.Registration import zf, ZFrameRegistration
+        from ZFrame.VolumeReader import ReadVolume
+
+        self.delayDisplay("Starting the global fit solver test")
+        # Five slices, and a single slice, where the closed-form pose of one slice is not averaged
+        for sliceRange in ([6, 11], [9, 10]):
+            volume, ijkToRAS = ReadVolume(self.testVolumePath(), sliceRange)
+            matrices = {}
+            for solver in (SOLVER_CLOSED_FORM, SOLVER_GLOBAL_FIT):
+                registration = ZFrameRegistration(numFiducials=7)
+                registration.SetInputImage(volume, ijkToRAS)
+                registration.SetOrientationBase([0.0, 0.0, 0.0, 1.0])
+                registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+                registration.SetSolver(solver)
+                success, position, quaternion = registration.Register(sliceRange)
+                self.assertTrue(success)
+                matrices[solver] = zf.QuaternionToMatrix(quaternion)
+                matrices[solver][:3, 3] = position
+            self.assertEqual(int(np.count_nonzero(registration.sliceResults['localized'])),
+                             sliceRange[1] - sliceRange[0])
+
+            # RMS distance of the intercepts to the line fiducials below 1 mm
+            self.assertLess(registration.fitResidual, 1.0)
+
+            # Within 0.5 mm and 1 degree of the closed-form pose
+            closedForm, globalFit = matrices[SOLVER_CLOSED_FORM], matrices[SOLVER_GLOBAL_FIT]
+            self.assertLess(np.linalg.norm(closedForm[:3, 3] - globalFit[:3, 3]), 0.5)
+            cosine = (np.trace(closedForm[:3, :3].T @ globalFit[:3, :3]) - 1.0) / 2.0
+            self.assertLess(np.degrees(np.arccos(np.clip(cosine, -1.0, 1.0))), 1.0)
+        self.delayDisplay('Test passed!')
+
+    def test_TrackingMode(self):
+        """Tracked frames must give the pose of a full detection, and a lost track must fall back to it."""
+        from ZFrame.Registration import zf, ZFrameRegistration
+        from ZFrame.VolumeReader import ReadVolume
+
+        self.delayDisplay("Starting the tracking mode test")
+        volume, ijkToRAS = ReadVolume(self.testVolumePath(), [6, 11])
+        # Consecutive slices, a blank frame, and a frame whose content moved 20 pixels, out of the search windows
+        frames = [(k, volume[:, :, k]) for k in (6, 7, 8, 9, 10, 9)]
+        frames += [(8, np.zeros_like(volume[:, :, 8])), (8, volume[:, :, 8]), (9, volume[:, :, 9]),
+                   (9, np.roll(volume[:, :, 9], 20, axis=0)), (9, np.roll(volume[:, :, 9], 20, axis=0))]
+
+        def registerFrames(tracking):
+            registration = ZFrameRegistration(numFiducials=7)
+            registration.SetInputImage(volume, ijkToRAS)
+            registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+            registration.SetTracking(tracking)
+            registration.Init(volume.shape[0], volume.shape[1])
+            spacing = registration.ImageSpacing()
+            orientation = zf.MatrixToQuaternion(registration.ImageAxes())
+            poses = []
+            for slindex, image in frames:
+                position, quaternion = list(registration.SlicePositions([slindex])[0]), list(orientation)
+                success = registration.RegisterQuaternion(position, quaternion, [0.0, 0.0, 0.0, 1.0], image,
+                                                          list(volume.shape), spacing)
+                poses.append((success, registration.tracked, np.array(position), np.array(quaternion)))
+            return poses
+
+        detected = registerFrames(False)
+        tracked = registerFrames(True)
+        self.assertEqual([pose[0] for pose in tracked], [True] * 6 + [False] + [True] * 4)
+        self.assertEqual([pose[1] for pose in tracked], [False] + [True] * 5 + [False, False, True, False, True])
+        for full, track in zip(detected, tracked):
+            self.assertEqual(full[0], track[0])
+            if full[0]:
+                self.assertTrue(np.allclose(full[2], track[2], atol=1e-6))
+                self.assertTrue(np.allclose(full[3], track[3], atol=1e-9))
+        self.delayDisplay('Test passed!')
+
+    def test_Propagation(self):
+        """Fiducials propagated from the centre slice must match a detection in every slice."""
+        from ZFrame.Registration import ZFrameRegistration
+        from ZFrame.Tracking import RejectTrackOutliers
+        from ZFrame.VolumeReader import ReadVolume
+
+        self.delayDisplay("Starting the propagation test")
+        volume, ijkToRAS = ReadVolume(self.testVolumePath(), [3, 15])
+        registrations = {}
+        for propagation in (False, True):
+            registration = ZFrameRegistration(numFiducials=7)
+            registration.SetInputImage(volume, ijkToRAS)
+            registration.SetOrientationBase([0.0, 0.0, 0.0, 1.0])
+            registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+            registration.SetPropagation(propagation)
+            success, position, quaternion = registration.Register([3, 15])
+            self.assertTrue(success)
+            registrations[propagation] = (registration.sliceResults, position, quaternion)
+
+        detected, position, quaternion = registrations[False]
+        propagated, propagatedPosition, propagatedQuaternion = registrations[True]
+        self.assertTrue(np.array_equal(detected['detected'], propagated['detected']))
+        self.assertTrue(np.array_equal(detected['localized'], propagated['localized']))
+        self.assertGreater(int(np.count_nonzero(propagated['tracked'])), 0)
+        found = detected['detected']
+        self.assertTrue(np.allclose(detected['pixels'][found], propagated['pixels'][found], atol=1e-9))
+        self.assertTrue(np.allclose(position, propagatedPosition, atol=1e-9))
+        self.assertTrue(np.allclose(quaternion, propagatedQuaternion, atol=1e-12))
+
+        # The intercepts of the detected slices lie on their tracks, until one of them is moved off its line
+        slices = detected['slice'][found]
+        coordinates = detected['coordinates'][found].copy()
+        sliceSpacing = registration.ImageSpacing()[2]
+        self.assertTrue(np.all(RejectTrackOutliers(slices, coordinates, sliceSpacing)))
+        coordinates[2, 4] += [3.0, 0.0]
+        kept = RejectTrackOutliers(slices, coordinates, sliceSpacing)
+        self.assertEqual(np.flatnonzero(~kept).tolist(), [2])
+        self.delayDisplay('Test passed!')
+
+    def test_RegisterBatch(self):
+        """Batch results must stream in job order, and a quiet batch must only silence its own registrations."""
+        import contextlib
+        import io
+        from ZFrame.Batch import BatchJob, RegisterBatch
+        from ZFrame.VolumeReader import ReadVolume
+
+        self.delayDisplay("Starting the batch registration test")
+        volume, ijkToRAS = ReadVolume(self.testVolumePath(), [6, 11])
+        jobs = [BatchJob(self.testVolumePath(), None, "z001", [6, 11]),
+                BatchJob(volume, ijkToRAS, "z001", [6, 11]),
+                BatchJob(self.testVolumePath() + ".missing", None, "z001", [6, 11])]
+        events = []
+
+        def progress(index, sliceProgress):
+            events.append(('slice', index))
+            print(f"Batch progress: job {index}, slice {sliceProgress.slice}")
+
+        output = io.StringIO()
+        results = []
+        with contextlib.redirect_stdout(output):
+            for result in RegisterBatch(jobs, progress=progress):
+                events.append(('result', result.index))
+                results.append(result)
+
+        # Each result is yielded before the next job starts
+        self.assertEqual([result.index for result in results], [0, 1, 2])
+        self.assertEqual(events, [('slice', 0)] * 5 + [('result', 0)] + [('slice', 1)] * 5 +
+                         [('result', 1), ('result', 2)])
+        self.assertTrue(results[0].success and results[1].success)
+        self.assertTrue(np.array_equal(results[0].position, results[1].position))
+        self.assertTrue(np.array_equal(results[0].orientation, results[1].orientation))
+        self.assertFalse(results[2].success)
+        self.assertTrue(results[2].error.startswith("Could not load the volume"))
+        self.assertIsNone(results[2].sliceResults)
+
+        # The output of the caller is kept, that of the registrations is not
+        self.assertEqual(output.getvalue().count("Batch progress:"), 10)
+        self.assertNotIn("Processing slices", output.getvalue())
+        self.delayDisplay('Test passed!')
+
+    def test_RegistrationService(self):
+        """A registration through the local socket service must match the one of the module logic."""
+        from ZFrame.Registration import zf
+        from ZFrame.Service import RegistrationService, RegistrationClient
+
+        self.delayDisplay("Starting the registration service test")
+        inputVolume = self.loadTestVolume()
+        logicMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+
+        volume = slicer.util.arrayFromVolume(inputVolume).transpose(2, 1, 0)
+        ijkToRAS = vtk.vtkMatrix4x4()
+        inputVolume.GetIJKToRASMatrix(ijkToRAS)
+        affine = np.array([[ijkToRAS.GetElement(i, j) for j in range(4)] for i in range(4)])
+
+        service = RegistrationService(maxQueuedRequests=1)
+        address = service.Start(port=0)
+        try:
+            with RegistrationClient(address, timeout=60.0) as client:
+                # Pipelined requests are queued and answered in order
+                for requestId in range(3):
+                    client.Send(volume, affine, "z001", [6, 11], id=requestId)
+                responses = [client.Receive() for _ in range(3)]
+        finally:
+            service.Stop()
+
+        self.assertEqual([response['id'] for response in responses], [0, 1, 2])
+        for response in responses:
+            self.assertTrue(response['success'], response['error'])
+            matrix = zf.QuaternionToMatrix(response['orientation'])
+            self.assertTrue(np.allclose(matrix[:3, :3], logicMatrix[:3, :3], atol=1e-9))
+            self.assertTrue(np.allclose(response['position'], logicMatrix[:3, 3], atol=1e-6))
+            self.assertGreaterEqual(response['timing']['total'], response['timing']['registration'])
+        self.delayDisplay('Test passed!')
+
+    def test_RegistrationServiceQueue(self):
+        """The service must push back when its queue is full, cancel on disconnect and reject malformed requests."""
+        import time
+        from ZFrame.Service import (_HEADER, MAX_PAYLOAD_BYTES, EncodeMessage, RegistrationService,
+                                    RegistrationClient)
+        from ZFrame.VolumeReader import ReadVolume
+
+        class HeldService(RegistrationService):
+            """Service whose registrations wait for release to be set, counting the requests it accepts."""
+
+            def __init__(self, maxQueuedRequests):
+                super().__init__(maxQueuedRequests)
+                self.release = threading.Event()
+                self.started = threading.Event()
+                self.finished = threading.Event()
+                self.accepted = 0
+                self.cancelEvents = []
+                self.responses = []
+
+            async def _Respond(self, writer, future, previous):
+                # Called once a request has a slot in the queue
+                self.accepted += 1
+                await RegistrationService._Respond(writer, future, previous)
+
+            def _Register(self, metadata, payload, cancel=None):
+                self.cancelEvents.append(cancel)
+                self.started.set()
+                self.release.wait(60.0)
+                response = super()._Register(metadata, payload, cancel)
+                self.responses.append(response)
+                self.finished.set()
+                return response
+
+        self.delayDisplay("Starting the registration service queue test")
+        volume, ijkToRAS = ReadVolume(self.testVolumePath(), [6, 11])
+        numRequests = 8
+
+        # Backpressure: while the first registration is held, only one more request gets a slot in the queue;
+        # the connection is not read further until the queue drains, whatever the socket buffers hold
+        service = HeldService(maxQueuedRequests=1)
+        address = service.Start(port=0)
+        try:
+            with RegistrationClient(address, timeout=60.0) as client:
+                def send():
+                    for requestId in range(numRequests):
+                        client.Send(volume, ijkToRAS, "z001", [6, 11], id=requestId)
+
+                # The sends block once the socket buffers are full, so they run in their own thread
+                sender = threading.Thread(target=send, daemon=True)
+                sender.start()
+                self.assertTrue(service.started.wait(60.0))
+                time.sleep(1.0)
+                self.assertEqual(len(service.cancelEvents), 1)
+                self.assertEqual(service.accepted, 1 + service.maxQueuedRequests)
+
+                service.release.set()
+                sender.join(60.0)
+                self.assertFalse(sender.is_alive())
+                responses = [client.Receive() for _ in range(numRequests)]
+        finally:
+            service.Stop()
+        self.assertEqual([response['id'] for response in responses], list(range(numRequests)))
+        for response in responses:
+            self.assertTrue(response['success'], response['error'])
+
+        # Disconnect: the registration in progress is cancelled and the queued request is dropped
+        service = HeldService(maxQueuedRequests=1)
+        address = service.Start(port=0)
+        try:
+            with RegistrationClient(address, timeout=60.0) as client:
+                client.Send(volume, ijkToRAS, "z001", [6, 11], id=0)
+                client.Send(volume, ijkToRAS, "z001", [6, 11], id=1)
+                self.assertTrue(service.started.wait(60.0))
+            self.assertTrue(service.cancelEvents[0].wait(10.0))
+            service.release.set()
+            self.assertTrue(service.finished.wait(60.0))
+            # Leave the worker time to skip the dropped request
+            time.sleep(0.5)
+        finally:
+            service.Stop()
+        self.assertEqual(len(service.cancelEvents), 1)
+        self.assertEqual(service.responses[0]['error'], "Registration cancelled")
+
+        # Malformed requests: a payload that does not match the volume is answered in order without reaching
+        # the worker, and a payload length over the limit closes the connection before the payload is read
+        service = HeldService(maxQueuedRequests=1)
+        service.release.set()
+        address = service.Start(port=0)
+        try:
+            with RegistrationClient(address, timeout=60.0) as client:
+                metadata = dict(id=0, shape=[4, 4, 4], dtype='<f8', affine=np.eye(4).tolist(), topology="z001",
+                                sliceRange=[0, 4])
+                client.socket.sendall(EncodeMessage(metadata, np.zeros(63).tobytes()))
+                client.Send(volume, ijkToRAS, "z001", [6, 11], id=1)
+                responses = [client.Receive() for _ in range(2)]
+            with RegistrationClient(address, timeout=60.0) as client:
+                client.socket.sendall(_HEADER.pack(2, MAX_PAYLOAD_BYTES + 1) + b'{}')
+                with self.assertRaises(ConnectionError):
+                    client.Receive()
+        finally:
+            service.Stop()
+        self.assertEqual([response['id'] for response in responses], [0, 1])
+        self.assertFalse(responses[0]['success'])
+        self.assertIn("does not match", responses[0]['error'])
+        self.assertTrue(responses[1]['success'], responses[1]['error'])
+        self.assertEqual(len(service.cancelEvents), 1)
+        self.delayDisplay('Test passed!')
+
+    def test_ManualFiducials(self):
+        """Registering the detected fiducials, in any order, must give the same result as the detection."""
+        from ZFrame.Registration import ZFrameRegistration
+
+        self.delayDisplay("Starting the manual fiducials test")
+        inputVolume = self.loadTestVolume()
+        automaticMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+
+        volume = slicer.util.arrayFromVolume(inputVolume).transpose(2, 1, 0)
+        registration = ZFrameRegistration(numFiducials=7)
+        registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+        registration.Init(volume.shape[0], volume.shape[1])
+        rng = np.random.default_rng(0)
+        zFrameFids = {}
+        for slindex in range(6, 11):
+            _, points = registration.LocateFiducials(volume[:, :, slindex].astype(int), volume.shape[0],
+                                                     volume.shape[1], inputVolume.GetSpacing())
+            if points is not None and registration.CheckFiducialGeometry(np.array(points, dtype=int),
+                                                                         volume.shape[0], volume.shape[1]):
+                zFrameFids[slindex] = np.array(points)[rng.permutation(7)]
+        self.assertTrue(zFrameFids)
+
+        manualMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE, zFrameFids)
+        self.assertTrue(np.allclose(manualMatrix, automaticMatrix, atol=1e-9))
+        self.delayDisplay('Test passed!')
+
+    def test_DetectionPrefetch(self):
+        """A registration from fiducials detected in the background must match a plain one."""
+        self.delayDisplay("Starting the background detection test")
+        inputVolume = self.loadTestVolume()
+        plainMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+
+        logic = ZFrameRegistrationScriptedLogic()
+        topology = topologyRegistry.LoadConfigs()["z001"]
+        logic.startPrefetch(inputVolume, "z001", "7-fiducial", topology.text, [6, 11])
+        logic.prefetchThread.join()
+        self.assertEqual(logic.detectionCache[1]['slice'].tolist(), [6, 7, 8, 9, 10])
+        prefetchedMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE, logic=logic)
+        self.assertTrue(np.array_equal(prefetchedMatrix, plainMatrix))
+
+        # A different precision does not use the prefetched slices
+        key, prefetched = logic.detectionCache
+        self.assertIsNone(logic.getPrefetchedDetection(key[:-1] + (PRECISION_SINGLE,)))
+
+        # The slices are copied when the detection starts: an edit of the volume does not reach the worker
+        # thread, and the edited volume does not use the prefetched slices
+        logic.startPrefetch(inputVolume, "z001", "7-fiducial", topology.text, [6, 11])
+        imageArray = logic.getImageArrayAndTransform(inputVolume)[0]
+        original = np.array(imageArray[:, :, 6:11])
+        imageArray[:, :, 6:11] = 0
+        inputVolume.GetImageData().Modified()
+        logic.prefetchThread.join()
+        self.assertTrue(np.array_equal(logic.detectionCache[1]['pixels'], prefetched['pixels']))
+        editedKey = (key[0], inputVolume.GetImageData().GetMTime()) + key[2:]
+        self.assertNotEqual(editedKey, key)
+        self.assertIsNone(logic.getPrefetchedDetection(editedKey))
+        imageArray[:, :, 6:11] = original
+        inputVolume.GetImageData().Modified()
+        self.delayDisplay('Test passed!')
+
+    def test_ProgressAndCancel(self):
+        """Each slice must be reported with the partial pose, and a cancelled run must leave the output unchanged."""
+        self.delayDisplay("Starting the progress and cancellation test")
+        inputVolume = self.loadTestVolume()
+        plainMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+
+        logic = ZFrameRegistrationScriptedLogic()
+        topology = topologyRegistry.LoadConfigs()["z001"]
+        outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+        statuses = []
+        self.assertTrue(logic.run(inputVolume, outputTransform, "z001", "7-fiducial", topology.text, 6, 11,
+                                  progress=statuses.append))
+        self.assertEqual([status.slice for status in statuses], [6, 7, 8, 9, 10])
+        self.assertTrue(all(status.seconds >= 0.0 for status in statuses))
+        # With the closed-form solver, the partial pose of the last slice is the final pose
+        self.assertTrue(np.allclose(statuses[-1].position, plainMatrix[:3, 3]))
+
+        cancel = threading.Event()
+        cancelledTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+        statuses = []
+
+        def onSliceProcessed(status):
+            statuses.append(status)
+            cancel.set()
+
+        self.assertFalse(logic.run(inputVolume, cancelledTransform, "z001", "7-fiducial", topology.text, 6, 11,
+                                   progress=onSliceProcessed, cancel=cancel))
+        self.assertEqual(len(statuses), 1)
+        matrix = vtk.vtkMatrix4x4()
+        cancelledTransform.GetMatrixTransformToParent(matrix)
+        self.assertTrue(matrix.IsIdentity())
+        self.delayDisplay('Test passed!')
+
+    def test_AutoDetectTopology(self):
+        """Auto-detection must find the test frame and give the same registration as its configuration."""
+        self.delayDisplay("Starting the topology auto-detection test")
+        inputVolume = self.loadTestVolume()
+        plainMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE)
+
+        # The frame type and configuration passed in are ignored
+        logic = ZFrameRegistrationScriptedLogic()
+        wrongTopology = topologyRegistry.LoadConfigs()["z002"]
+        outputTransform = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+        self.assertTrue(logic.run(inputVolume, outputTransform, "z002", "9-fiducial", wrongTopology.text, 6, 11,
+                                  autoDetect=True))
+        self.assertEqual(logic.detectedTopology.name, "z001")
+        matrix = vtk.vtkMatrix4x4()
+        outputTransform.GetMatrixTransformToParent(matrix)
+        autoMatrix = np.array([[matrix.GetElement(i, j) for j in range(4)] for i in range(4)])
+        self.assertTrue(np.array_equal(autoMatrix, plainMatrix))
+        self.delayDisplay('Test passed!')
+
+    def test_FiducialGeometry(self):
+        """The geometry check must accept the detected fiducials and leave out slices with misplaced ones."""
+        from ZFrame.Registration import ZFrameRegistration
+
+        self.delayDisplay("Starting the fiducial geometry test")
+        inputVolume = self.loadTestVolume()
+        volume = slicer.util.arrayFromVolume(inputVolume).transpose(2, 1, 0)
+        registration = ZFrameRegistration(numFiducials=7)
+        registration.SetFrameTopology(topologyRegistry.LoadConfigs()["z001"])
+        registration.Init(volume.shape[0], volume.shape[1])
+        zFrameFids = {}
+        for slindex in range(6, 11):
+            _, points = registration.LocateFiducials(volume[:, :, slindex].astype(int), volume.shape[0],
+                                                     volume.shape[1], inputVolume.GetSpacing())
+            zFrameFids[slindex] = np.array(points)
+        points = np.stack(list(zFrameFids.values()))
+        self.assertTrue(np.all(registration.CheckFiducialGeometry(points, volume.shape[0], volume.shape[1])))
+
+        # Middle fiducial off its side, corner off the parallel edges, fiducial out of the image
+        bad = np.repeat(points[:1], 3, axis=0)
+        bad[0, 1] += 0.5 * (bad[0, 0] - bad[0, 4])
+        bad[1, 6] += 0.3 * (bad[1, 4] - bad[1, 6])
+        bad[2, 3, 0] = volume.shape[0] + 1
+        self.assertFalse(np.any(registration.CheckFiducialGeometry(bad, volume.shape[0], volume.shape[1])))
+
+        # A slice with misplaced manual fiducials is left out of the registration
+        fullMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE, dict(zFrameFids))
+        zFrameFids[8] = bad[1]
+        manualMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE, zFrameFids)
+        del zFrameFids[8]
+        expectedMatrix = self.runRegistration(inputVolume, PRECISION_DOUBLE, zFrameFids)
+        self.assertTrue(np.array_equal(manualMatrix, expectedMatrix))
+        self.assertFalse(np.array_equal(manualMatrix, fullMatrix))
+        self.delayDisplay('Test passed!')
+
+    def test_ImportTimeReport(self):
+        """The import time report must give the nesting depth of each module."""
+        from ZFrame.ImportBenchmark import ParseImportTime
+
+        self.delayDisplay("Starting the import time report test")
+        # Report of `python -X importtime -c "import json"`, shortened
+        report = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       478 |       2539 |       re._compiler",
+            "import time:       237 |        237 |       copyreg",
+            "import time:       703 |       9455 |     re",
+            "import time:       255 |        255 |       _json",
+            "import time:       667 |        921 |     json.scanner",
+            "import time:       610 |      10986 |   json.decoder",
+            "import time:       693 |        693 |   json.encoder",
+            "import time:       428 |      12105 | json",
+        ])
+        entries = ParseImportTime(report)
+        self.assertEqual([(name, depth) for name, depth, _, _ in entries],
+                         [("re._compiler", 3), ("copyreg", 3), ("re", 2), ("_json", 3), ("json.scanner", 2),
+                          ("json.decoder", 1), ("json.encoder", 1), ("json", 0)])
+        self.assertEqual(entries[-1][2:], (428, 12105))
+        self.delayDisplay('Test passed!')
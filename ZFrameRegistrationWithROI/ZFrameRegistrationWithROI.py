@@ -1,12 +1,13 @@
+import itertools
 import os
 import unittest
 import vtk, qt, ctk, slicer
 from slicer.ScriptedLoadableModule import *
 import logging
-import SimpleITK as sitk
-import sitkUtils
+import numpy as np
+# The mixins are base classes and must be imported with the module; SimpleITK, sitkUtils and the icons are
+# imported where they are first used to keep them out of the Slicer startup time
 from SlicerDevelopmentToolboxUtils.mixins import ModuleLogicMixin, ModuleWidgetMixin
-from SlicerDevelopmentToolboxUtils.icons import Icons
 
 
 #
@@ -44,6 +45,127 @@ class OpenSourceZFrameRegistration(object):
       slicer.cli.run(slicer.modules.zframeregistration, None, params, wait_for_completion=True)
 
 
+class ZFrameRegistrationStageCache(object):
+  """Keeps the most recent result of every ROI registration stage together with the key it was computed for.
+
+  MRML nodes stored as stage results are owned by the cache: they are hidden from editors while cached and removed
+  from the scene when the stage is recomputed for a different key or the cache is cleared.
+  """
+
+  def __init__(self, mrmlScene):
+    self.mrmlScene = mrmlScene
+    self._entries = {}
+
+  def get(self, stage, key):
+    entry = self._entries.get(stage)
+    if entry is None or entry[0] != key:
+      return None
+    value = entry[1]
+    if isinstance(value, slicer.vtkMRMLNode) and value.GetScene() is None:
+      # node was removed from the scene behind our back
+      del self._entries[stage]
+      return None
+    return value
+
+  def set(self, stage, key, value):
+    self.evict(stage)
+    if isinstance(value, slicer.vtkMRMLNode):
+      value.SetHideFromEditors(True)
+    self._entries[stage] = (key, value)
+    return value
+
+  def evict(self, stage):
+    entry = self._entries.pop(stage, None)
+    if entry is None:
+      return
+    value = entry[1]
+    if isinstance(value, slicer.vtkMRMLNode) and value.GetScene() is not None:
+      self.mrmlScene.RemoveNode(value)
+
+  def clear(self):
+    for stage in list(self._entries.keys()):
+      self.evict(stage)
+
+
+class ZFrameModelRegistry(object):
+  """Parses every Z-frame model file once per session and keeps its polydata and fiducial line geometry in memory.
+
+  An entry is dropped and the file parsed again when its modification time or size on disk changes. The cached
+  polydata is shared between the model nodes created from it and must be treated as read-only.
+  """
+
+  def __init__(self):
+    self._entries = {}
+
+  def getEntry(self, modelPath):
+    stat = os.stat(modelPath)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    entry = self._entries.get(modelPath)
+    if entry is None or entry["signature"] != signature:
+      entry = self._parseModel(modelPath)
+      entry["signature"] = signature
+      self._entries[modelPath] = entry
+    return entry
+
+  def createModelNode(self, modelPath, mrmlScene, name):
+    modelNode = slicer.vtkMRMLModelNode()
+    modelNode.SetName(name)
+    modelNode.SetAndObservePolyData(self.getEntry(modelPath)["polyData"])
+    mrmlScene.AddNode(modelNode)
+    modelNode.CreateDefaultDisplayNodes()
+    return modelNode
+
+  def evict(self, modelPath=None):
+    if modelPath is None:
+      self._entries.clear()
+    else:
+      self._entries.pop(modelPath, None)
+
+  def _parseModel(self, modelPath):
+    # read through a storage node so that the LPS/RAS conventions match slicer.util.loadModel
+    storageNode = slicer.vtkMRMLModelStorageNode()
+    storageNode.SetFileName(modelPath)
+    modelNode = slicer.vtkMRMLModelNode()
+    if not storageNode.ReadData(modelNode):
+      raise IOError("Failed to read zFrame model: %s" % modelPath)
+    polyData = vtk.vtkPolyData()
+    polyData.DeepCopy(modelNode.GetPolyData())
+    entry = {"polyData": polyData}
+    entry.update(self._computeFiducialLines(polyData))
+    return entry
+
+  @staticmethod
+  def _computeFiducialLines(polyData):
+    """Fit one line per rod (connected region) of the model: centre, unit direction and length, all in RAS."""
+    from vtk.util import numpy_support
+    connectivity = vtk.vtkPolyDataConnectivityFilter()
+    connectivity.SetInputData(polyData)
+    connectivity.SetExtractionModeToAllRegions()
+    connectivity.ColorRegionsOn()
+    connectivity.Update()
+    output = connectivity.GetOutput()
+    points = numpy_support.vtk_to_numpy(output.GetPoints().GetData()).astype(float)
+    regionIds = numpy_support.vtk_to_numpy(output.GetPointData().GetArray("RegionId"))
+    centres, directions, lengths = [], [], []
+    for regionId in range(connectivity.GetNumberOfExtractedRegions()):
+      regionPoints = points[regionIds == regionId]
+      if len(regionPoints) < 2:
+        continue
+      centre = regionPoints.mean(axis=0)
+      _, _, axes = np.linalg.svd(regionPoints - centre, full_matrices=False)
+      direction = axes[0]
+      extent = (regionPoints - centre).dot(direction)
+      centres.append(centre + direction * (extent.max() + extent.min()) / 2.0)
+      directions.append(direction)
+      lengths.append(extent.max() - extent.min())
+    return {"lineCentres": np.array(centres).reshape(-1, 3),
+            "lineDirections": np.array(directions).reshape(-1, 3),
+            "lineLengths": np.array(lengths)}
+
+
+zFrameModelRegistry = ZFrameModelRegistry()
+
+
 class ZFrameRegistrationWithROI(ScriptedLoadableModule):
   """Uses ScriptedLoadableModule base class, available at:
   https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
@@ -111,6 +233,7 @@ class ZFrameRegistrationWithROIWidget(ScriptedLoadableModuleWidget, ModuleWidget
     self.createSliceWidgetClassMembers("Green")
 
   def setupGUIAndConnections(self):
+    from SlicerDevelopmentToolboxUtils.icons import Icons
     # Select zFrame model
     modelGroupBox = qt.QGroupBox()
     self.layout.addWidget(modelGroupBox)
@@ -282,10 +405,7 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
 
   def __init__(self):
     ScriptedLoadableModuleLogic.__init__(self)
-    self.redSliceWidget = slicer.app.layoutManager().sliceWidget("Red")
-    self.redSliceView = self.redSliceWidget.sliceView()
-    self.redSliceLogic = self.redSliceWidget.sliceLogic()
-    self.otsuFilter = sitk.OtsuThresholdImageFilter()
+    self.otsuFilter = None
     self.openSourceRegistration = OpenSourceZFrameRegistration(slicer.mrmlScene)
     self.templateVolume = None
     self.zFrameCroppedVolume = None
@@ -294,7 +414,9 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
     self.otsuOutputVolume = None
     self.startIndex = None
     self.endIndex = None
+    self.componentCounts = {}
     self.zFrameModelNode = None
+    self.stageCache = ZFrameRegistrationStageCache(slicer.mrmlScene)
     self.resetAndInitializeData()
 
   def resetAndInitializeData(self):
@@ -303,21 +425,15 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
     self.endIndex = None
 
   def clearVolumeNodes(self):
-    if self.zFrameCroppedVolume:
-      slicer.mrmlScene.RemoveNode(self.zFrameCroppedVolume)
-      self.zFrameCroppedVolume = None
-    if self.zFrameLabelVolume:
-      slicer.mrmlScene.RemoveNode(self.zFrameLabelVolume)
-      self.zFrameLabelVolume = None
-    if self.zFrameMaskedVolume:
-      slicer.mrmlScene.RemoveNode(self.zFrameMaskedVolume)
-      self.zFrameMaskedVolume = None
-    if self.otsuOutputVolume:
-      slicer.mrmlScene.RemoveNode(self.otsuOutputVolume)
-      self.otsuOutputVolume = None
+    # intermediate volumes are owned by the stage cache and stay available for the next retry
+    self.zFrameCroppedVolume = None
+    self.zFrameLabelVolume = None
+    self.zFrameMaskedVolume = None
+    self.otsuOutputVolume = None
 
   def cleanup(self):
     self.clearVolumeNodes()
+    self.stageCache.clear()
     self.clearOldCalculationNodes()
 
   def clearOldCalculationNodes(self):
@@ -331,58 +447,147 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
       slicer.mrmlScene.RemoveNode(self.openSourceRegistration.outputTransform)
       self.openSourceRegistration.outputTransform = None
 
+  @staticmethod
+  def getZFrameModelPath(zFrameModelName):
+    currentFilePath = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(currentFilePath, "Resources", "zframe", zFrameModelName)
+
   def loadZFrameModel(self, zFrameModelName):
     if self.zFrameModelNode:
       slicer.mrmlScene.RemoveNode(self.zFrameModelNode)
       self.zFrameModelNode = None
-    currentFilePath = os.path.dirname(os.path.realpath(__file__))
-    zFrameModelPath = os.path.join(currentFilePath, "Resources", "zframe", zFrameModelName)
-    _, self.zFrameModelNode = slicer.util.loadModel(zFrameModelPath, returnNode=True)
-    self.zFrameModelNode.SetName('ZFrameModel')
+    zFrameModelPath = self.getZFrameModelPath(zFrameModelName)
+    self.zFrameModelNode = zFrameModelRegistry.createModelNode(zFrameModelPath, slicer.mrmlScene, 'ZFrameModel')
     modelDisplayNode = self.zFrameModelNode.GetDisplayNode()
     modelDisplayNode.SetColor(1, 1, 0)
     self.zFrameModelNode.SetDisplayVisibility(False)
 
+  def getZFrameModelFiducialLines(self, zFrameModelName):
+    """Return (centres, unit directions, lengths) of the model's line fiducials in model (RAS) coordinates."""
+    entry = zFrameModelRegistry.getEntry(self.getZFrameModelPath(zFrameModelName))
+    return entry["lineCentres"], entry["lineDirections"], entry["lineLengths"]
+
+  def computeFiducialLineResiduals(self, zFrameModelName, points, transformNode=None):
+    """Distance of each RAS point to the closest model line fiducial, after applying the registration transform."""
+    centres, directions, _ = self.getZFrameModelFiducialLines(zFrameModelName)
+    if transformNode is not None:
+      toWorld = vtk.vtkMatrix4x4()
+      transformNode.GetMatrixTransformToWorld(toWorld)
+      matrix = np.array([[toWorld.GetElement(row, col) for col in range(4)] for row in range(4)])
+      centres = centres.dot(matrix[:3, :3].T) + matrix[:3, 3]
+      directions = directions.dot(matrix[:3, :3].T)
+      directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    offsets = np.asarray(points, dtype=float)[:, np.newaxis, :] - centres[np.newaxis, :, :]
+    along = np.einsum('pld,ld->pl', offsets, directions)
+    distances = np.linalg.norm(offsets - along[:, :, np.newaxis] * directions[np.newaxis, :, :], axis=2)
+    return distances.min(axis=1)
+
   def runZFrameOpenSourceRegistration(self, zFrameModelName, zFrameTemplateVolume, coverTemplateROI, start=None, end=None):
     self.startIndex = start
     self.endIndex = end
     self.loadZFrameModel(zFrameModelName) # Load selected zFrame Model
-    self.zFrameCroppedVolume = self.createCroppedVolume(zFrameTemplateVolume, coverTemplateROI)
-    self.zFrameLabelVolume = self.createLabelMapFromCroppedVolume(self.zFrameCroppedVolume, "labelmap")
-    self.zFrameMaskedVolume = self.createMaskedVolume(zFrameTemplateVolume, self.zFrameLabelVolume,
-                                                      outputVolumeName="maskedTemplateVolume")
+    # Every stage is keyed by the inputs that affect it, so a retry only recomputes what actually changed
+    cropKey = self.getVolumeCacheKey(zFrameTemplateVolume) + (self.getROICacheKey(coverTemplateROI),)
+    self.zFrameCroppedVolume = self.getCachedStage("crop", cropKey, lambda: self.createCroppedVolume(
+      zFrameTemplateVolume, coverTemplateROI))
+    self.zFrameLabelVolume = self.getCachedStage("label", cropKey, lambda: self.createLabelMapFromCroppedVolume(
+      self.zFrameCroppedVolume, "labelmap"))
+    self.zFrameMaskedVolume = self.getCachedStage("mask", cropKey, lambda: self.createMaskedVolume(
+      zFrameTemplateVolume, self.zFrameLabelVolume, outputVolumeName="maskedTemplateVolume"))
     self.zFrameMaskedVolume.SetName(zFrameTemplateVolume.GetName() + "-label")
     if self.startIndex is None or self.endIndex is None:
-      self.startIndex, center, self.endIndex = self.getROIMinCenterMaxSliceNumbers(coverTemplateROI)
-      self.otsuOutputVolume = self.applyITKOtsuFilter(self.zFrameMaskedVolume)
-      self.dilateMask(self.otsuOutputVolume)
-      self.startIndex, self.endIndex = self.getStartEndWithConnectedComponents(self.otsuOutputVolume, center)
+      self.startIndex, center, self.endIndex = self.getROIMinCenterMaxSliceNumbers(coverTemplateROI,
+                                                                                   zFrameTemplateVolume)
+      self.otsuOutputVolume = self.getCachedStage("otsu", cropKey, lambda: self.createDilatedOtsuVolume(
+        self.zFrameMaskedVolume))
+      componentCounts = self.getCachedStage("components", cropKey, dict)
+      self.startIndex, self.endIndex = self.getCachedStage("sliceRange", cropKey + (center,),
+        lambda: self.getStartEndWithConnectedComponents(self.otsuOutputVolume, center, componentCounts))
     self.openSourceRegistration.setInputVolume(self.zFrameMaskedVolume)
-    self.openSourceRegistration.runRegistration(self.startIndex, self.endIndex)
+    registrationKey = cropKey + (self.startIndex, self.endIndex)
+    cachedMatrix = self.stageCache.get("registration", registrationKey)
+    if cachedMatrix is not None:
+      self.openSourceRegistration.outputTransform.SetMatrixTransformToParent(cachedMatrix)
+    else:
+      self.openSourceRegistration.runRegistration(self.startIndex, self.endIndex)
+      resultMatrix = vtk.vtkMatrix4x4()
+      self.openSourceRegistration.outputTransform.GetMatrixTransformToParent(resultMatrix)
+      self.stageCache.set("registration", registrationKey, resultMatrix)
     self.clearVolumeNodes()
     return True
 
-  def getROIMinCenterMaxSliceNumbers(self, coverTemplateROI):
+  def getCachedStage(self, stage, key, compute):
+    value = self.stageCache.get(stage, key)
+    if value is None:
+      logging.debug("ZFrameRegistrationWithROI - recomputing stage '%s'" % stage)
+      value = self.stageCache.set(stage, key, compute())
+    return value
+
+  @staticmethod
+  def getVolumeCacheKey(volume):
+    ijkToRAS = vtk.vtkMatrix4x4()
+    volume.GetIJKToRASMatrix(ijkToRAS)
+    return (volume.GetID(), volume.GetImageData().GetMTime(),
+            tuple(ijkToRAS.GetElement(row, col) for row in range(3) for col in range(4)))
+
+  @staticmethod
+  def getROICacheKey(roi):
+    # The exact ROI geometry: however small, a change can move a bound across a voxel centre and change the
+    # cropped extent. Markups ROIs may also be rotated, which their RAS bounds alone do not capture.
+    bounds = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
+    roi.GetRASBounds(bounds)
+    key = tuple(bounds)
+    if hasattr(roi, "GetObjectToWorldMatrix"):
+      objectToWorld = roi.GetObjectToWorldMatrix()
+      key += tuple(objectToWorld.GetElement(row, col) for row in range(3) for col in range(4))
+    return key
+
+  def getROIMinCenterMaxSliceNumbers(self, coverTemplateROI, volume):
+    """Return the [min, center, max] slice numbers of the ROI in the volume.
+
+    The eight corners of the ROI's RAS bounds and its center are mapped at once with the volume's RAS to IJK
+    matrix, so no slice view is involved and the logic also runs without a layout.
+    """
     center = [0.0, 0.0, 0.0]
     coverTemplateROI.GetXYZ(center)
     bounds = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
     coverTemplateROI.GetRASBounds(bounds)
-    pMin = [bounds[0], bounds[2], bounds[4]]
-    pMax = [bounds[1], bounds[3], bounds[5]]
-    return [self.getIJKForXYZ(self.redSliceWidget, pMin)[2], self.getIJKForXYZ(self.redSliceWidget, center)[2],
-            self.getIJKForXYZ(self.redSliceWidget, pMax)[2]]
-
-  def getStartEndWithConnectedComponents(self, volume, center):
+    corners = list(itertools.product(bounds[0:2], bounds[2:4], bounds[4:6]))
+    sliceNumbers = self.getSliceNumbersForRAS(volume, corners + [center])
+    return [int(sliceNumbers[:8].min()), int(sliceNumbers[8]), int(sliceNumbers[:8].max())]
+
+  @staticmethod
+  def getSliceNumbersForRAS(volume, points):
+    """Return the rounded K index of each RAS point in the volume, through its parent transform if linear."""
+    rasToIJK = vtk.vtkMatrix4x4()
+    volume.GetRASToIJKMatrix(rasToIJK)
+    transformNode = volume.GetParentTransformNode()
+    if transformNode is not None and transformNode.IsTransformToWorldLinear():
+      worldToParent = vtk.vtkMatrix4x4()
+      transformNode.GetMatrixTransformFromWorld(worldToParent)
+      vtk.vtkMatrix4x4.Multiply4x4(rasToIJK, worldToParent, rasToIJK)
+    row = np.array([rasToIJK.GetElement(2, col) for col in range(4)])
+    return np.rint(np.asarray(points, dtype=float).dot(row[:3]) + row[3]).astype(int)
+
+  def getStartEndWithConnectedComponents(self, volume, center, componentCounts=None):
+    import SimpleITK as sitk
+    import sitkUtils
     address = sitkUtils.GetSlicerITKReadWriteAddress(volume.GetName())
     image = sitk.ReadImage(address)
+    self.componentCounts = componentCounts if componentCounts is not None else {}
     start = self.getStartSliceUsingConnectedComponents(center, image)
     end = self.getEndSliceUsingConnectedComponents(center, image)
     return start, end
 
+  def getComponentCount(self, image, sliceIndex):
+    if sliceIndex not in self.componentCounts:
+      self.componentCounts[sliceIndex] = self.getIslandCount(image, sliceIndex)
+    return self.componentCounts[sliceIndex]
+
   def getStartSliceUsingConnectedComponents(self, center, image):
     sliceIndex = start = center
     while sliceIndex > 0:
-      if self.getIslandCount(image, sliceIndex) > 6:
+      if self.getComponentCount(image, sliceIndex) > 6:
         start = sliceIndex
         sliceIndex -= 1
         continue
@@ -393,7 +598,7 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
     imageSize = image.GetSize()
     sliceIndex = end = center
     while sliceIndex < imageSize[2]:
-      if self.getIslandCount(image, sliceIndex) > 6:
+      if self.getComponentCount(image, sliceIndex) > 6:
         end = sliceIndex
         sliceIndex += 1
         continue
@@ -401,12 +606,21 @@ class ZFrameRegistrationWithROILogic(ScriptedLoadableModuleLogic, ModuleLogicMix
     return end
 
   def applyITKOtsuFilter(self, volume):
+    import SimpleITK as sitk
+    import sitkUtils
+    if self.otsuFilter is None:
+      self.otsuFilter = sitk.OtsuThresholdImageFilter()
     inputVolume = sitk.Cast(sitkUtils.PullVolumeFromSlicer(volume.GetID()), sitk.sitkInt16)
     self.otsuFilter.SetInsideValue(0)
     self.otsuFilter.SetOutsideValue(1)
     otsuITKVolume = self.otsuFilter.Execute(inputVolume)
     # return sitkUtils.PushToSlicer(otsuITKVolume, "otsuITKVolume", 0, True)
     return sitkUtils.PushVolumeToSlicer(otsuITKVolume, name="otsuITKVolume") # Mariana fix
+
+  def createDilatedOtsuVolume(self, volume):
+    otsuOutputVolume = self.applyITKOtsuFilter(volume)
+    self.dilateMask(otsuOutputVolume)
+    return otsuOutputVolume
     
 
 class ZFrameRegistrationWithROITest(ScriptedLoadableModuleTest):
@@ -430,6 +644,10 @@ class ZFrameRegistrationWithROITest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_ZFrameRegistrationWithROI1()
+    self.setUp()
+    self.test_ROISliceNumbers()
+    self.setUp()
+    self.test_ZFrameModelFiducialLines()
 
   def isclose(self, a, b, rel_tol=1e-05, abs_tol=0.0):
     return abs(a - b) <= max(rel_tol * max(abs(a), abs(b)), abs_tol)
@@ -482,6 +700,72 @@ class ZFrameRegistrationWithROITest(ScriptedLoadableModuleTest):
 
     self.delayDisplay('Test passed!')
 
+  def test_ROISliceNumbers(self):
+    """The ROI slice numbers come from the volume geometry alone, including its parent transform."""
+    self.delayDisplay("Starting the ROI slice numbers test")
+    imageDataNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode")
+    imageDataNode.SetSpacing(0.703125, 0.703125, 2.4)
+    imageDataNode.SetOrigin(82.15, 107.77, -122.735)
+    imageDataNode.SetIJKToRASDirections([[-1.0, 0.0, 0.0], [0.0, -1.0, 0.0], [0.0, 0.0, 1.0]])
+    ROINode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsROINode")
+    ROINode.SetXYZ([-6.9, 15.2, -101.135])
+    ROINode.SetRadiusXYZ([36.5, 38.8, 36.08])
+
+    zFrameRegistrationLogic = ZFrameRegistrationWithROILogic()
+    self.assertEqual(zFrameRegistrationLogic.getROIMinCenterMaxSliceNumbers(ROINode, imageDataNode), [-6, 9, 24])
+
+    # Moving the volume 2 slices superior moves the ROI 2 slices down in it
+    transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    matrix = vtk.vtkMatrix4x4()
+    matrix.SetElement(2, 3, 4.8)
+    transformNode.SetMatrixTransformToParent(matrix)
+    imageDataNode.SetAndObserveTransformNodeID(transformNode.GetID())
+    self.assertEqual(zFrameRegistrationLogic.getROIMinCenterMaxSliceNumbers(ROINode, imageDataNode), [-8, 7, 22])
+    self.delayDisplay('Test passed!')
+
+  def test_ZFrameModelFiducialLines(self):
+    """The model gives the 7 rods of the frame, and points on the rods have no residual, with or without a transform."""
+    from vtk.util import numpy_support
+    self.delayDisplay("Starting the Z-frame model fiducial lines test")
+    zFrameRegistrationLogic = ZFrameRegistrationWithROILogic()
+    centres, directions, lengths = zFrameRegistrationLogic.getZFrameModelFiducialLines('zframe_original_vertical.vtk')
+
+    # 4 parallel rods and 3 diagonal ones, all spanning the 60 mm height of the frame
+    self.assertEqual(len(centres), 7)
+    self.assertTrue(np.allclose(np.abs(directions[:, 2]) * lengths, 60.0, atol=0.1))
+    self.assertEqual(int(np.sum(np.isclose(lengths, 60.0, atol=0.1))), 4)
+    self.assertEqual(int(np.sum(np.isclose(lengths, 60.0 * np.sqrt(2.0), atol=0.1))), 3)
+
+    # Points along the rod axes, and the model vertices, which lie on the 1.5 mm radius of the rods
+    fractions = np.linspace(-0.5, 0.5, 5)
+    axisPoints = (centres[:, np.newaxis, :] +
+                  (fractions[np.newaxis, :, np.newaxis] * lengths[:, np.newaxis, np.newaxis]) *
+                  directions[:, np.newaxis, :]).reshape(-1, 3)
+    residuals = zFrameRegistrationLogic.computeFiducialLineResiduals('zframe_original_vertical.vtk', axisPoints)
+    self.assertLess(residuals.max(), 1e-6)
+    polyData = zFrameModelRegistry.getEntry(zFrameRegistrationLogic.getZFrameModelPath(
+      'zframe_original_vertical.vtk'))["polyData"]
+    vertices = numpy_support.vtk_to_numpy(polyData.GetPoints().GetData()).astype(float)
+    residuals = zFrameRegistrationLogic.computeFiducialLineResiduals('zframe_original_vertical.vtk', vertices)
+    self.assertLess(residuals.max(), 1.5 + 1e-3)
+
+    # The residuals follow the registration transform
+    matrix = vtk.vtkMatrix4x4()
+    transform = vtk.vtkTransform()
+    transform.Translate(5.0, -10.0, 100.0)
+    transform.RotateWXYZ(10.0, 0.2, 0.3, 1.0)
+    transform.GetMatrix(matrix)
+    transformNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLLinearTransformNode")
+    transformNode.SetMatrixTransformToParent(matrix)
+    transformed = np.array([transform.TransformPoint(point) for point in axisPoints])
+    residuals = zFrameRegistrationLogic.computeFiducialLineResiduals('zframe_original_vertical.vtk', transformed,
+                                                                     transformNode)
+    self.assertLess(residuals.max(), 1e-6)
+    residuals = zFrameRegistrationLogic.computeFiducialLineResiduals('zframe_original_vertical.vtk', axisPoints,
+                                                                     transformNode)
+    self.assertGreater(residuals.min(), 1.0)
+    self.delayDisplay('Test passed!')
+
 
 class ZFrameRegistrationWithROISlicelet(qt.QWidget):
   def __init__(self):